@@ -0,0 +1,74 @@
+#!/usr/bin/env python3.5
+
+import argparse
+import json
+import tempfile
+
+import fix_paths
+import mvz.benchmark
+import mvz.const
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='time each stage of the pipeline on a synthetic video, '
+                    'writing the results as json')
+    parser.add_argument(
+        '--width', type=int, default=mvz.const.frame_width,
+        help='the width of the synthetic video (even)')
+    parser.add_argument(
+        '--height', type=int, default=mvz.const.frame_height,
+        help='the height of the synthetic video (even)')
+    parser.add_argument(
+        '--seconds', type=float, default=20,
+        help='the length of the synthetic video')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument(
+        '--legacy-frames', type=int, default=10,
+        help='the number of frame pairs to run the PIL center of change on')
+    parser.add_argument(
+        '--path-frames', type=int, default=54000,
+        help='the number of frames of path data to smooth and snap')
+    parser.add_argument(
+        '--repeat', type=int, default=1,
+        help='run each stage this many times, keeping the fastest')
+    parser.add_argument(
+        '--adaptive-stride', type=int, default=3,
+        help='the stride to find the center of change at adaptively')
+    parser.add_argument(
+        '--no-memory', action='store_true',
+        help="don't measure the peak memory use of each stage, which takes "
+             "another run of each")
+    parser.add_argument(
+        '--no-startup', action='store_true',
+        help="don't time bin/run_mvz.py on the cached video, which takes a "
+             "full run of it first")
+    parser.add_argument(
+        '--workdir', type=str, default=None,
+        help='where to write the video and outputs (default: a temporary '
+             'directory)')
+    parser.add_argument(
+        '--output', type=str, default=None,
+        help='the json file to write (default: output/benchmarks/'
+             '<time>_<commit>.json)')
+    parser.add_argument(
+        '--compare', type=str, default=None,
+        help='a json file from an earlier run to compare against')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        results = mvz.benchmark.run(
+            args.workdir or tmp_dir, args.width, args.height, args.seconds,
+            args.seed, args.legacy_frames, args.path_frames, args.repeat,
+            not args.no_memory, not args.no_startup, args.adaptive_stride)
+    print(mvz.benchmark.format_results(results))
+    print('wrote %s' % mvz.benchmark.write_results(results, args.output))
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            old = json.load(f)
+        print(mvz.benchmark.format_comparison(
+            mvz.benchmark.compare(old, results)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,42 @@
+#!/usr/bin/env python3.5
+
+import argparse
+import os.path
+
+import fix_paths
+import mvz.const
+import mvz.image_processing
+import mvz.methods.ewma
+import mvz.pipeline
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='write ewma boxes for a video whose path data has been '
+                    'computed (by bin/run_mvz.py), in constant memory, as an '
+                    'array file')
+    parser.add_argument('youtube_id', type=str,
+                        help='the youtube id of the video')
+    parser.add_argument(
+        '--keyframes-only', action='store_true',
+        help='only write the boxes for frames where the box moves')
+    parser.add_argument(
+        '--box-size', type=mvz.pipeline.parse_box_size,
+        default=mvz.const.box_size,
+        help='a WIDTHxHEIGHT box size, or WIDTH:HEIGHT aspect ratio '
+             '(default: %dx%d)' % mvz.const.box_size)
+    args = parser.parse_args()
+    if not os.path.exists(mvz.const.output_dir):
+        os.makedirs(mvz.const.output_dir)
+    output_fn = mvz.pipeline.box_output_fn(args.youtube_id, 'ewma', 'array',
+                                           args.box_size)
+    count = mvz.methods.ewma.write_boxes(
+        args.youtube_id, output_fn,
+        mvz.image_processing.n_frames(args.youtube_id),
+        mvz.const.frame_width, mvz.const.frame_height, args.box_size,
+        args.keyframes_only)
+    print('wrote %d boxes to %s' % (count, output_fn))
+
+
+if __name__ == '__main__':
+    main()
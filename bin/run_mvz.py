@@ -1,16 +1,23 @@
 #!/usr/bin/env python3.5
 
-import csv
 import json
 import os.path
+import time
 
 import argparse
+import funcy as fn
 
 import fix_paths
+import mvz.cache
 import mvz.const
-import mvz.downloader
-import mvz.generate_video
+import mvz.methods
+import mvz.methods.shared
 import mvz.image_processing
+import mvz.instrument
+import mvz.pipeline
+
+stages = ['download', 'split_frames', 'center_of_change', 'boxes', 'render',
+          'write_output']
 
 
 def main():
@@ -20,42 +27,129 @@ def main():
                         help='the youtube id of the video to process')
     parser.add_argument(
         '--bust-cache', action='store_true',
-        help='refetch the video from youtube and reprocess everything')
+        help='refetch the video from youtube and recompute the path data')
     parser.add_argument(
         '--all-frames', action='store_true',
-        help='write output for every frame, not only for the keyframe positions')
+        help='write output for every frame, not only for the keyframe '
+             'positions, and write the cropped video')
+    parser.add_argument(
+        '--format', type=str, choices=mvz.pipeline.output_formats,
+        default='csv',
+        help='write output as csv, json arrays, a binary array file, or an '
+             'ffmpeg filter script that crops the video')
+    parser.add_argument(
+        '--json', action='store_const', dest='format', const='json',
+        help='the same as --format json')
+    parser.add_argument(
+        '--render-script', action='store_true',
+        help='with --format ffmpeg, render the cropped video from the script '
+             'in one ffmpeg pass (faster than --all-frames)')
+    parser.add_argument(
+        '--write-frames', type=str,
+        choices=sorted(mvz.methods.shared.frame_formats),
+        help='with --all-frames, also write each cropped frame to the output '
+             'directory in this format (png-fast compresses less, raw is '
+             'rgb24 bytes)')
+    parser.add_argument(
+        '--method', type=str, choices=mvz.methods.names(),
+        default='bandpass_and_snapping')
+    parser.add_argument(
+        '--box-size', type=mvz.pipeline.parse_box_size, action='append',
+        default=[], dest='box_sizes',
+        help='a WIDTHxHEIGHT box size, or WIDTH:HEIGHT aspect ratio, to crop '
+             'to; give it more than once to get output at each size from '
+             'one run (default: %dx%d)' % mvz.const.box_size)
+    parser.add_argument(
+        '--cache-frames', action='store_true',
+        help='(debugging) also write every frame of the video to the cache as '
+             'a png, and read frames from there instead of from the video')
+    parser.add_argument(
+        '--workers', type=int, default=1,
+        help='the number of processes to use for finding the center of change')
     parser.add_argument(
-        '--json', action='store_true',
-        help='write output as json arrays instead of csv')
+        '--analysis-scale', type=mvz.image_processing.parse_analysis_scale,
+        default=1,
+        help='find the center of change on frames binned down by this factor '
+             '(from 1 to %d)' % mvz.image_processing.max_analysis_scale)
     parser.add_argument(
-        '--method', type=str, default='bandpass_and_snapping')
+        '--adaptive-stride', type=int, default=1,
+        help='difference frames this many apart, only differencing every '
+             'pair where the change is large or the center of change jumps')
+    parser.add_argument(
+        '--no-scene-detection', action='store_false', dest='scene_detection',
+        help='find the center of change for every pair of frames, rather '
+             'than skipping static pairs and scene cuts (and resetting the '
+             'smoothing at cuts)')
+    parser.add_argument(
+        '--mask', type=str, default=None,
+        help='an image whose black pixels are excluded from the analysis')
+    parser.add_argument(
+        '--exclude-box', type=mvz.image_processing.parse_box,
+        action='append', default=[],
+        help='a left,top,right,bottom region to exclude from the analysis')
+    parser.add_argument(
+        '--cache-budget', type=float, default=mvz.const.cache_budget_gb,
+        help='evict the least recently used cache entries to keep the cache '
+             'under this many GB')
+    parser.add_argument(
+        '--progress', action='store_true',
+        help='print progress lines for long stages to stderr')
+    parser.add_argument(
+        '--profile', type=str, choices=stages, action='append', default=[],
+        help='run a stage under cProfile, writing the stats to '
+             'output/<youtube_id>_<stage>.prof (only this process is '
+             'profiled, so use --workers 1 for center_of_change)')
     args = parser.parse_args()
+    if args.render_script and args.format != 'ffmpeg':
+        parser.error('--render-script needs --format ffmpeg')
+    if args.write_frames and not args.all_frames:
+        parser.error('--write-frames needs --all-frames')
+    start_time = time.time()
     if not os.path.exists(mvz.const.output_dir):
         os.makedirs(mvz.const.output_dir)
-    mvz.downloader.download(args.youtube_id, bust_cache=args.bust_cache)
-    (_, video_width, video_height) = mvz.image_processing.main(args.youtube_id, bust_cache=args.bust_cache)
-    mvz_methods = __import__('mvz.methods.%s' % args.method).methods
-    boxes = getattr(mvz_methods, args.method).main(
-        args.youtube_id,
-        frame_count=mvz.image_processing.n_frames(args.youtube_id),
-        keyframes_only=not args.all_frames,
-        video_width=video_width,
-        video_height=video_height
-    )
-    normalized_boxes = mvz_methods.shared.normalize_boxes(boxes, video_width, video_height)
-    if args.all_frames:
-        mvz.generate_video.main(args.youtube_id, args.method, "auto")
-
-    extension = "json" if args.json else "csv"
-
-    box_output_fn = os.path.join(
-        mvz.const.output_dir, "%s_%s_auto_boxes.%s" % (
-            args.youtube_id, args.method, extension))
-    with open(box_output_fn, 'w') as f:
-        if args.json:
-            f.write(json.dumps(normalized_boxes))
-        else:
-            csv.writer(f).writerows(normalized_boxes)
+    mask = mvz.image_processing.load_mask(
+        mvz.const.frame_width, mvz.const.frame_height,
+        args.mask, args.exclude_box)
+    recorder = mvz.instrument.Recorder(
+        progress=mvz.instrument.print_progress if args.progress else None,
+        profile_stages=args.profile,
+        profile_fn_template=mvz.pipeline.profile_fn_template(args.youtube_id))
+    with mvz.instrument.recording(recorder):
+        box_sizes = list(fn.distinct(args.box_sizes)) or [
+            mvz.const.box_size]
+        (all_boxes, video_width, video_height) = mvz.pipeline.run_sizes(
+            args.youtube_id, box_sizes, args.method,
+            all_frames=args.all_frames,
+            bust_cache=args.bust_cache,
+            cache_frames=args.cache_frames,
+            workers=args.workers,
+            analysis_scale=args.analysis_scale,
+            mask=mask,
+            frame_format=args.write_frames,
+            adaptive_stride=args.adaptive_stride,
+            scene_detection=args.scene_detection)
+        with mvz.instrument.stage('write_output'):
+            for box_size, boxes in zip(box_sizes, all_boxes):
+                output_fn = mvz.pipeline.write_boxes(
+                    args.youtube_id, args.method, boxes, video_width,
+                    video_height, output_format=args.format,
+                    box_size=box_size)
+                mvz.instrument.count('bytes_written',
+                                     os.path.getsize(output_fn))
+        if args.render_script:
+            with mvz.instrument.stage('render'):
+                for box_size in box_sizes:
+                    mvz.pipeline.render_filter_script(
+                        args.youtube_id, args.method, box_size)
+
+    stats = recorder.to_json()
+    stats.update({'youtube_id': args.youtube_id, 'args': vars(args)})
+    with open(mvz.pipeline.stats_output_fn(args.youtube_id, args.method),
+              'w') as f:
+        json.dump(stats, f, indent=2, default=str)
+
+    if args.cache_budget is not None:
+        mvz.cache.evict(int(args.cache_budget * 1e9), keep_since=start_time)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3.5
+
+import argparse
+import os.path
+
+import funcy as fn
+
+import fix_paths
+import mvz.batch
+import mvz.const
+import mvz.image_processing
+import mvz.methods
+import mvz.pipeline
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='process many videos into candidate mobile video '
+                    'sequences, writing a manifest of the results')
+    parser.add_argument('youtube_ids', type=str, nargs='*',
+                        help='the youtube ids of the videos to process')
+    parser.add_argument(
+        '--ids-file', type=str, default=None,
+        help='a file of youtube ids to process, one per line')
+    parser.add_argument(
+        '--processes', type=int, default=None,
+        help='the number of videos to process at once (default: one per '
+             'cpu)')
+    parser.add_argument(
+        '--download-threads', type=int, default=4,
+        help='the number of videos to download at once')
+    parser.add_argument(
+        '--all-frames', action='store_true',
+        help='write output for every frame, not only for the keyframe '
+             'positions, and write the cropped videos')
+    parser.add_argument(
+        '--format', type=str, choices=mvz.pipeline.output_formats,
+        default='csv',
+        help='write output as csv, json arrays, a binary array file, or an '
+             'ffmpeg filter script that crops the video')
+    parser.add_argument(
+        '--json', action='store_const', dest='format', const='json',
+        help='the same as --format json')
+    parser.add_argument(
+        '--method', type=str, choices=mvz.methods.names(),
+        default='bandpass_and_snapping')
+    parser.add_argument(
+        '--analysis-scale', type=mvz.image_processing.parse_analysis_scale,
+        default=1,
+        help='find the center of change on frames binned down by this factor '
+             '(from 1 to %d)' % mvz.image_processing.max_analysis_scale)
+    parser.add_argument(
+        '--adaptive-stride', type=int, default=1,
+        help='difference frames this many apart, only differencing every '
+             'pair where the change is large or the center of change jumps')
+    parser.add_argument(
+        '--box-size', type=mvz.pipeline.parse_box_size, action='append',
+        default=[], dest='box_sizes',
+        help='a WIDTHxHEIGHT box size, or WIDTH:HEIGHT aspect ratio, to crop '
+             'to; may be given more than once (default: %dx%d)'
+             % mvz.const.box_size)
+    args = parser.parse_args()
+
+    youtube_ids = list(args.youtube_ids)
+    if args.ids_file is not None:
+        youtube_ids.extend(mvz.batch.read_ids(args.ids_file))
+    if not youtube_ids:
+        parser.error('no youtube ids given')
+    if not os.path.exists(mvz.const.output_dir):
+        os.makedirs(mvz.const.output_dir)
+
+    manifest = mvz.batch.run(
+        youtube_ids, args.method,
+        all_frames=args.all_frames,
+        output_format=args.format,
+        analysis_scale=args.analysis_scale,
+        processes=args.processes,
+        download_threads=args.download_threads,
+        box_sizes=list(fn.distinct(args.box_sizes)) or [mvz.const.box_size],
+        adaptive_stride=args.adaptive_stride)
+    failed = [entry['youtube_id'] for entry in manifest
+              if entry['status'] != 'ok']
+    print('%d of %d videos succeeded; manifest in %s' % (
+        len(manifest) - len(failed), len(manifest), mvz.batch.manifest_fn()))
+    if failed:
+        print('failed: %s' % ' '.join(failed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,47 @@
+#!/usr/bin/env python3.5
+
+import argparse
+import os.path
+
+import fix_paths
+import mvz.const
+import mvz.downloader
+import mvz.image_processing
+import mvz.scale_report
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='compare center-of-change analysis at reduced scales '
+                    'against full resolution')
+    parser.add_argument('youtube_id', type=str,
+                        help='the youtube id of the video to process')
+    parser.add_argument(
+        '--scales', type=mvz.image_processing.parse_analysis_scale,
+        nargs='+', default=[1, 2, 4, 8],
+        help='the analysis scales to compare (each from 1 to %d)' %
+             mvz.image_processing.max_analysis_scale)
+    parser.add_argument(
+        '--frames', type=int, default=None,
+        help='only analyze this many frames from the start of the video')
+    parser.add_argument(
+        '--mask', type=str, default=None,
+        help='an image whose black pixels are excluded from the analysis')
+    parser.add_argument(
+        '--exclude-box', type=mvz.image_processing.parse_box,
+        action='append', default=[],
+        help='a left,top,right,bottom region to exclude from the analysis')
+    args = parser.parse_args()
+    if not os.path.exists(mvz.const.output_dir):
+        os.makedirs(mvz.const.output_dir)
+    mvz.downloader.download(args.youtube_id)
+    mask = mvz.image_processing.load_mask(
+        mvz.const.frame_width, mvz.const.frame_height,
+        args.mask, args.exclude_box)
+    results = mvz.scale_report.main(
+        args.youtube_id, args.scales, args.frames, mask)
+    print(mvz.scale_report.format_report(results))
+
+
+if __name__ == '__main__':
+    main()
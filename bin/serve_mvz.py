@@ -0,0 +1,45 @@
+#!/usr/bin/env python3.5
+
+import argparse
+import sys
+
+import fix_paths
+import mvz.service
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='serve boxes over http from a long-lived process, which '
+                    'keeps recently used path data and boxes in memory (see '
+                    'mvz/service.py for the endpoints)')
+    parser.add_argument(
+        '--host', type=str, default='127.0.0.1',
+        help='the address to listen on (default: only this machine)')
+    parser.add_argument(
+        '--port', type=int, default=mvz.service.default_port)
+    parser.add_argument(
+        '--path-entries', type=int, default=mvz.service.path_entries,
+        help="the most videos' path data to keep in memory")
+    parser.add_argument(
+        '--box-entries', type=int, default=mvz.service.box_entries,
+        help='the most sets of boxes to keep in memory')
+    parser.add_argument(
+        '--quiet', action='store_true',
+        help="don't log each request to stderr")
+    args = parser.parse_args()
+    mvz.service.warm_imports()
+    service = mvz.service.Service(args.path_entries, args.box_entries)
+    server = mvz.service.make_server(service, args.host, args.port,
+                                     quiet=args.quiet)
+    sys.stderr.write('serving on http://%s:%d\n' % server.server_address[:2])
+    sys.stderr.flush()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3.5
+
+import argparse
+import json
+import os.path
+
+import fix_paths
+import mvz.const
+import mvz.pipeline
+import mvz.sweep
+
+# The settings that can be swept, and the flags to give their values with.
+flags = [('freq_cutoff', '--freq-cutoff'), ('padding', '--padding'),
+         ('anticipation_time', '--anticipation-time'),
+         ('initial_offset', '--initial-offset')]
+
+columns = ['shots', 'mean_shot_seconds', 'change_inside', 'motion_per_second']
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='score bandpass_and_snapping on every combination of the '
+                    'given settings, for a video whose path data has been '
+                    'computed (by bin/run_mvz.py)')
+    parser.add_argument('youtube_id', type=str,
+                        help='the youtube id of the video')
+    for name, flag in flags:
+        parser.add_argument(
+            flag, type=mvz.sweep.parse_values, dest=name,
+            help='comma-separated values of %s to try (default: the current '
+                 'value)' % name)
+    parser.add_argument(
+        '--box-size', type=mvz.pipeline.parse_box_size,
+        default=mvz.const.box_size,
+        help='a WIDTHxHEIGHT box size, or WIDTH:HEIGHT aspect ratio '
+             '(default: %dx%d)' % mvz.const.box_size)
+    parser.add_argument(
+        '--workers', type=int, default=1,
+        help='the number of processes to score settings in')
+    parser.add_argument(
+        '--output', type=str, default=None,
+        help='the json file to write the results to (default: '
+             'output/<youtube_id>_sweep.json)')
+    args = parser.parse_args()
+    values = {name: getattr(args, name) for name, _ in flags
+              if getattr(args, name) is not None}
+    results = mvz.sweep.sweep(args.youtube_id, mvz.sweep.grid(values),
+                              args.box_size, args.workers)
+
+    names = [name for name, _ in flags]
+    print('\t'.join(names + columns))
+    for result in results:
+        print('\t'.join(['%g' % result[key] for key in names + columns]))
+
+    output_fn = args.output or os.path.join(
+        mvz.const.output_dir, '%s_sweep.json' % args.youtube_id)
+    if not os.path.exists(os.path.dirname(output_fn) or '.'):
+        os.makedirs(os.path.dirname(output_fn))
+    with open(output_fn, 'w') as f:
+        json.dump({'box_size': list(args.box_size), 'results': results}, f,
+                  indent=2)
+
+
+if __name__ == '__main__':
+    main()
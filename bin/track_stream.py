@@ -0,0 +1,49 @@
+#!/usr/bin/env python3.5
+
+import argparse
+import sys
+
+import fix_paths
+import mvz.const
+import mvz.image_processing
+import mvz.tracker
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='track the crop box of a live stream (or a video file), '
+                    'writing frame,left,top,right,bottom lines to stdout as '
+                    'each box is decided')
+    parser.add_argument('video', type=str,
+                        help='a video file or stream url that ffmpeg can read')
+    parser.add_argument(
+        '--lookahead', type=int, default=mvz.tracker.default_lookahead,
+        help='the number of frames to wait for before deciding on a box')
+    parser.add_argument(
+        '--realtime', action='store_true',
+        help='replay a file at its own frame rate, as if it were live')
+    parser.add_argument(
+        '--analysis-scale', type=mvz.image_processing.parse_analysis_scale,
+        default=1,
+        help='find the center of change on frames binned down by this factor '
+             '(from 1 to %d)' % mvz.image_processing.max_analysis_scale)
+    parser.add_argument(
+        '--mask', type=str, default=None,
+        help='an image whose black pixels are excluded from the analysis')
+    parser.add_argument(
+        '--exclude-box', type=mvz.image_processing.parse_box,
+        action='append', default=[],
+        help='a left,top,right,bottom region to exclude from the analysis')
+    args = parser.parse_args()
+    mask = mvz.image_processing.load_mask(
+        mvz.const.frame_width, mvz.const.frame_height,
+        args.mask, args.exclude_box)
+    for frame, box in mvz.tracker.track_video(
+            args.video, args.lookahead, args.realtime,
+            args.analysis_scale, mask):
+        print('%d,%d,%d,%d,%d' % ((frame,) + tuple(box)))
+        sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    main()
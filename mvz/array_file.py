@@ -0,0 +1,160 @@
+"""A compact binary file format for path data and boxes.
+
+Each file is a 64 byte header followed by a little-endian C-order 2d array, so
+it can be opened with np.memmap and sliced without parsing anything.  The
+header records
+
+    magic, format version
+    the kind of data, and the array's dtype, rows, and columns
+    the size of the video, and its number of frames
+
+The kinds are
+
+    path: float64 x, y center of change per consecutive pair of frames (NaN
+        where nothing changed)
+    boxes: int16 left, top, right, bottom per frame, in pixels
+    keyboxes: int32 frame, left, top, right, bottom per keyframe, in pixels
+    labels: uint8 scene label (see image_processing.label_*) per row of path
+        data
+
+CSV and JSON files for these are exported from the arrays.
+"""
+import collections
+import os
+import struct
+from typing import Any, Iterable, List, Tuple
+
+import numpy as np
+
+magic = b'MVZARRAY'
+version = 1
+
+# magic, version, kind, dtype, rows, columns, video width, video height,
+# frame count, then padding
+_header = struct.Struct('<8sH8s8sQIIIQ10x')
+header_size = _header.size
+
+kind_dtypes = {
+    'path': np.dtype('<f8'),
+    'boxes': np.dtype('<i2'),
+    'keyboxes': np.dtype('<i4'),
+    'labels': np.dtype('u1'),
+}
+
+Header = collections.namedtuple(
+    'Header', ['kind', 'dtype', 'rows', 'columns', 'video_width',
+               'video_height', 'frame_count'])
+
+
+def write(fn: str, kind: str, data: np.ndarray, video_width: int,
+          video_height: int, frame_count: int) -> None:
+    """Atomically write a 2d array of the given kind."""
+    data = np.ascontiguousarray(data, dtype=kind_dtypes[kind])
+    rows, columns = data.shape
+    tmp_fn = '%s.%d.tmp' % (fn, os.getpid())
+    with open(tmp_fn, 'wb') as f:
+        f.write(_header.pack(
+            magic, version, kind.encode('ascii'),
+            data.dtype.str.encode('ascii'), rows, columns,
+            video_width, video_height, frame_count))
+        f.write(data.tobytes())
+    os.replace(tmp_fn, fn)
+
+
+def write_chunks(fn: str, kind: str, chunks: Iterable[np.ndarray],
+                 columns: int, video_width: int, video_height: int,
+                 frame_count: int) -> int:
+    """Atomically write a 2d array of the given kind, in blocks of rows.
+
+    Only one chunk is in memory at once, so this can write arrays of any
+    length.  Return the number of rows written.
+    """
+    dtype = kind_dtypes[kind]
+    rows = 0
+    tmp_fn = '%s.%d.tmp' % (fn, os.getpid())
+    with open(tmp_fn, 'wb') as f:
+        f.seek(header_size)
+        for chunk in chunks:
+            chunk = np.ascontiguousarray(chunk, dtype=dtype).reshape(
+                (-1, columns))
+            f.write(chunk.tobytes())
+            rows += len(chunk)
+        # Now that we know how many rows there are, write the header.
+        f.seek(0)
+        f.write(_header.pack(
+            magic, version, kind.encode('ascii'), dtype.str.encode('ascii'),
+            rows, columns, video_width, video_height, frame_count))
+    os.replace(tmp_fn, fn)
+    return rows
+
+
+def read_header(fn: str) -> Header:
+    with open(fn, 'rb') as f:
+        header = f.read(header_size)
+    if len(header) < header_size:
+        raise ValueError('%s is too short to be an array file' % fn)
+    (file_magic, file_version, kind, dtype, rows, columns, video_width,
+     video_height, frame_count) = _header.unpack(header)
+    if file_magic != magic or file_version != version:
+        raise ValueError('%s is not a version %d array file' % (fn, version))
+    return Header(kind.rstrip(b'\x00').decode('ascii'),
+                  np.dtype(dtype.rstrip(b'\x00').decode('ascii')),
+                  rows, columns, video_width, video_height, frame_count)
+
+
+def open_array(fn: str, *kinds: str) -> Tuple[Header, np.ndarray]:
+    """Memory map an array file, which must be one of the given kinds.
+
+    The array is read-only, and only the parts that are used get read.
+    """
+    header = read_header(fn)
+    if kinds and header.kind not in kinds:
+        raise ValueError('%s holds %s, not %s' % (
+            fn, header.kind, ' or '.join(kinds)))
+    shape = (header.rows, header.columns)
+    if header.rows == 0:
+        return (header, np.empty(shape, dtype=header.dtype))
+    return (header, np.memmap(fn, dtype=header.dtype, mode='r',
+                              offset=header_size, shape=shape))
+
+
+def write_path(fn: str, positions: Any, video_width: int,
+               video_height: int) -> None:
+    positions = np.asarray(positions, dtype=float).reshape((-1, 2))
+    write(fn, 'path', positions, video_width, video_height,
+          len(positions) + 1)
+
+
+def write_labels(fn: str, labels: Any, video_width: int,
+                 video_height: int) -> None:
+    labels = np.asarray(labels).reshape((-1, 1))
+    write(fn, 'labels', labels, video_width, video_height, len(labels) + 1)
+
+
+def write_boxes(fn: str, boxes: List[Tuple[Any, ...]], frame_count: int,
+                video_width: int, video_height: int) -> None:
+    """Write per-frame boxes, or (time, box) keyframe boxes, as pixels.
+
+    Keyframe times are stored as frame numbers, which frame_count turns back
+    into the same times.
+    """
+    data = np.array(boxes, dtype=float).reshape((len(boxes), -1))
+    if data.shape[1] == 5:
+        data[:, 0] = np.round(data[:, 0] * frame_count)
+        kind = 'keyboxes'
+    else:
+        kind = 'boxes'
+    write(fn, kind, data, video_width, video_height, frame_count)
+
+
+def read_boxes(fn: str) -> Tuple[List[Tuple[Any, ...]], Header]:
+    """Read boxes as written by write_boxes, as lists of python numbers."""
+    header, data = open_array(fn, 'boxes', 'keyboxes')
+    boxes = data.tolist()
+    if header.kind == 'keyboxes':
+        boxes = [(frame / header.frame_count,) + tuple(box)
+                 for frame, *box in boxes]
+    else:
+        boxes = [tuple(box) for box in boxes]
+    return (boxes, header)
+
@@ -0,0 +1,126 @@
+"""Process many videos in one run.
+
+Downloads are I/O bound, so run in a pool of threads; the rest of the work for
+each video runs in a pool of processes, which each import the heavy modules
+once and then handle many videos.  A video is handed to the process pool as
+soon as its download finishes, so downloading overlaps with processing.
+
+A failure processing one video is recorded in the manifest and doesn't affect
+the others.
+"""
+import concurrent.futures
+import json
+import os.path
+import time
+import traceback
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+import funcy as fn
+
+from mvz import const
+from mvz import downloader
+from mvz import pipeline
+
+
+def manifest_fn() -> str:
+    return os.path.join(const.output_dir, 'batch_manifest.json')
+
+
+def read_ids(ids_fn: str) -> List[str]:
+    """Read youtube ids from a file, one per line; # starts a comment."""
+    with open(ids_fn, 'r') as f:
+        lines = (line.split('#')[0].strip() for line in f)
+        return [line for line in lines if line]
+
+
+def _failure(youtube_id: str, stage: str, start: float) -> Dict[str, Any]:
+    return {
+        'youtube_id': youtube_id,
+        'status': 'failed',
+        'stage': stage,
+        'error': traceback.format_exc(),
+        'seconds': time.time() - start,
+    }
+
+
+def process_video(youtube_id: str, method_name: str, all_frames: bool,
+                  output_format: str, analysis_scale: int,
+                  box_sizes: Sequence[const.BoxSize] = (const.box_size,),
+                  adaptive_stride: int = 1) -> Dict[str, Any]:
+    """Run the pipeline for one (already downloaded) video.
+
+    This runs in a worker process, so catches everything and reports it.
+    """
+    start = time.time()
+    try:
+        (all_boxes, video_width, video_height) = pipeline.run_sizes(
+            youtube_id, box_sizes, method_name, all_frames=all_frames,
+            analysis_scale=analysis_scale, adaptive_stride=adaptive_stride)
+        output_fns = [
+            pipeline.write_boxes(
+                youtube_id, method_name, boxes, video_width, video_height,
+                output_format=output_format, box_size=box_size)
+            for box_size, boxes in zip(box_sizes, all_boxes)]
+    except Exception:
+        return _failure(youtube_id, 'process', start)
+    return {
+        'youtube_id': youtube_id,
+        'status': 'ok',
+        'boxes': len(all_boxes[0]),
+        'output': output_fns[0],
+        'outputs': output_fns,
+        'seconds': time.time() - start,
+    }
+
+
+def run(youtube_ids: Iterable[str],
+        method_name: str = 'bandpass_and_snapping',
+        all_frames: bool = False, output_format: str = 'csv',
+        analysis_scale: int = 1, processes: Optional[int] = None,
+        download_threads: int = 4,
+        box_sizes: Sequence[const.BoxSize] = (const.box_size,),
+        adaptive_stride: int = 1) -> List[Dict[str, Any]]:
+    """Process every video, and write a manifest of the results.
+
+    Return the manifest entries, one per video in the order given.
+    """
+    youtube_ids = list(fn.distinct(youtube_ids))
+    results = {}  # type: Dict[str, Dict[str, Any]]
+    start = time.time()
+
+    with concurrent.futures.ThreadPoolExecutor(download_threads) as io_pool, \
+            concurrent.futures.ProcessPoolExecutor(processes) as cpu_pool:
+        downloads = {io_pool.submit(downloader.download, youtube_id):
+                     youtube_id for youtube_id in youtube_ids}
+        processing = {}
+        for future in concurrent.futures.as_completed(downloads):
+            youtube_id = downloads[future]
+            try:
+                future.result()
+            except Exception:
+                results[youtube_id] = _failure(youtube_id, 'download', start)
+                continue
+            processing[cpu_pool.submit(
+                process_video, youtube_id, method_name, all_frames,
+                output_format, analysis_scale, box_sizes,
+                adaptive_stride)] = youtube_id
+        for future in concurrent.futures.as_completed(processing):
+            youtube_id = processing[future]
+            try:
+                results[youtube_id] = future.result()
+            except Exception:
+                # For instance, the worker process died.
+                results[youtube_id] = _failure(youtube_id, 'process', start)
+
+    manifest = [results[youtube_id] for youtube_id in youtube_ids]
+    with open(manifest_fn(), 'w') as f:
+        json.dump({
+            'method': method_name,
+            'all_frames': all_frames,
+            'box_sizes': [list(box_size) for box_size in box_sizes],
+            'seconds': time.time() - start,
+            'succeeded': sum(r['status'] == 'ok' for r in manifest),
+            'failed': sum(r['status'] != 'ok' for r in manifest),
+            'videos': manifest,
+        }, f, indent=2)
+    return manifest
@@ -0,0 +1,433 @@
+"""Benchmark each stage of the pipeline on a synthetic video.
+
+The video is a "blackboard": a dark board with a cursor that wanders around
+it, drawing strokes some of the time and jumping to a new part of the board
+now and then.  It is generated from a seed, so every run (and every commit)
+benchmarks the same frames.
+
+Each stage is timed, and its peak memory use is measured with tracemalloc
+(which sees numpy's allocations, but not ffmpeg's).  The results, with
+frames per second for each stage, are written as json so that runs at
+different commits can be compared with `compare`.
+
+The startup_cached stage times a whole run of bin/run_mvz.py on the video
+once everything is cached, which is mostly interpreter startup and imports.
+"""
+import collections
+import contextlib
+import json
+import os
+import platform
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+import funcy as fn
+import numpy as np
+import pandas as pd
+from PIL import Image
+
+from mvz import const
+from mvz import frames
+from mvz import generate_video
+from mvz import image_processing
+from mvz.methods import bandpass_and_snapping
+from mvz.methods import ewma
+from mvz.methods import shared
+
+benchmark_id = 'benchmark'
+
+package_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+run_mvz_fn = os.path.join(package_dir, 'bin', 'run_mvz.py')
+
+board_color = (32, 44, 38)
+cursor_size = 6
+stroke_width = 3
+
+
+def blackboard_frames(width: int, height: int, frame_count: int,
+                      seed: int = 0) -> Iterator[np.ndarray]:
+    """Generate the frames of a synthetic blackboard video.
+
+    The same buffer is yielded every time, so copy a frame to keep it.
+    """
+    rng = np.random.RandomState(seed)
+    board = np.empty((height, width, 3), dtype=np.uint8)
+    board[:] = board_color
+    frame = np.empty_like(board)
+    margin = 4 * cursor_size
+    center = np.array([width / 2, height / 2])
+    # The cursor follows a sum of sines around a center that jumps every
+    # eight seconds or so.
+    freqs = rng.uniform(0.02, 0.2, (3, 2))
+    phases = rng.uniform(0, 2 * np.pi, (3, 2))
+    amplitude = np.array([width, height]) / 12.0
+    color = (255, 255, 255)
+    pen_down = False
+    for i in range(frame_count):
+        if rng.rand() < 1.0 / (8 * const.frame_rate):
+            center = rng.uniform([margin, margin],
+                                 [width - margin, height - margin])
+        if rng.rand() < 1.0 / (2 * const.frame_rate):
+            pen_down = not pen_down
+            color = tuple(rng.randint(160, 256, 3))
+        offset = (amplitude * np.sin(freqs * i + phases)).sum(axis=0)
+        x, y = np.clip(center + offset, margin, [width - margin,
+                                                 height - margin]).astype(int)
+        if pen_down:
+            board[y - stroke_width:y + stroke_width,
+                  x - stroke_width:x + stroke_width] = color
+        frame[:] = board
+        frame[y:y + cursor_size, x:x + cursor_size] = 255
+        yield frame
+
+
+def write_video(video_fn: str, width: int, height: int, seconds: float,
+                seed: int = 0) -> int:
+    """Encode a synthetic blackboard video; return its number of frames."""
+    frame_count = int(round(seconds * const.frame_rate))
+    command = generate_video.encode_command(video_fn, width, height)
+    proc = subprocess.Popen(command, stdin=subprocess.PIPE)
+    try:
+        for frame in blackboard_frames(width, height, frame_count, seed):
+            proc.stdin.write(memoryview(frame))
+    finally:
+        proc.stdin.close()
+        returncode = proc.wait()
+    if returncode != 0:
+        raise subprocess.CalledProcessError(returncode, command)
+    return frame_count
+
+
+@contextlib.contextmanager
+def working_dir(dirname: str) -> Iterator[None]:
+    """Run in dirname, which gets its own cache and output directories."""
+    previous = os.getcwd()
+    for subdir in (const.cache_dir, const.output_dir):
+        os.makedirs(os.path.join(dirname, subdir), exist_ok=True)
+    os.chdir(dirname)
+    try:
+        yield
+    finally:
+        os.chdir(previous)
+
+
+@contextlib.contextmanager
+def temporary_video(youtube_id: str, seconds: Optional[float],
+                    width: int = const.frame_width,
+                    height: int = const.frame_height,
+                    write: Optional[Callable[[str], Any]] = None) -> (
+        Iterator[Any]):
+    """A synthetic video, in a temporary working directory of its own.
+
+    The video is written to const.video_fn(youtube_id): by write, if given,
+    and otherwise by write_video.  Yield what that returns.
+    """
+    tmpdir = tempfile.mkdtemp()
+    try:
+        with working_dir(tmpdir):
+            if write is None:
+                yield write_video(const.video_fn(youtube_id), width, height,
+                                  seconds)
+            else:
+                yield write(const.video_fn(youtube_id))
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def time_stage(stage: Callable[[], Any], frame_count: int,
+               repeat: int = 1, memory: bool = True) -> (
+        Tuple[Any, Dict[str, Any]]):
+    """Run a stage, and measure the fastest of repeat runs.
+
+    tracemalloc slows down allocation a lot, so if memory is set the peak
+    memory use is measured in one more run of its own.
+
+    Return the stage's result and its measurements.
+    """
+    best = best_cpu = float('Infinity')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        start_cpu = time.process_time()
+        result = stage()
+        best = min(best, time.perf_counter() - start)
+        best_cpu = min(best_cpu, time.process_time() - start_cpu)
+    peak = None
+    if memory:
+        tracemalloc.start()
+        try:
+            stage()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return (result, {
+        'seconds': best,
+        'cpu_seconds': best_cpu,
+        'frames': frame_count,
+        'frames_per_second': frame_count / best if best > 0 else None,
+        'peak_bytes': peak,
+    })
+
+
+def box_agreement(expected: List[Tuple[float, float]],
+                  actual: List[Tuple[float, float]], frame_count: int,
+                  tolerance: int = 8) -> float:
+    """The fraction of frames whose bandpass_and_snapping boxes, from two
+    sets of path data, are within tolerance pixels of each other."""
+    expected_boxes, actual_boxes = (
+        np.array(bandpass_and_snapping.boxes_for_path_array(
+            positions, frame_count, const.frame_width,
+            const.frame_height)[0])
+        for positions in (expected, actual))
+    close = np.abs(expected_boxes - actual_boxes).max(axis=1) <= tolerance
+    return float(np.mean(close))
+
+
+def startup_command(youtube_id: str) -> List[str]:
+    return [sys.executable, run_mvz_fn, youtube_id]
+
+
+def startup_env() -> Dict[str, str]:
+    """The environment to run bin/ scripts in from another directory."""
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        [package_dir] + ([env['PYTHONPATH']] if env.get('PYTHONPATH') else []))
+    return env
+
+
+def import_seconds(command: List[str]) -> float:
+    """Run a python command with -X importtime, and total its import time."""
+    output = subprocess.run(
+        command[:1] + ['-X', 'importtime'] + command[1:],
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, env=startup_env(),
+        check=True).stderr.decode()
+    # Each line is "import time: self | cumulative | name", with the name
+    # indented by its depth; the top level cumulative times add up to the
+    # total.
+    top_level = re.findall(r'^import time:\s+\d+ \|\s+(\d+) \| \S', output,
+                           re.MULTILINE)
+    return sum(int(microseconds) for microseconds in top_level) / 1e6
+
+
+def time_startup(youtube_id: str, repeat: int = 1) -> Dict[str, Any]:
+    """Time bin/run_mvz.py on an already processed video."""
+    command = startup_command(youtube_id)
+    _, stage = time_stage(
+        lambda: subprocess.check_call(command, stderr=subprocess.DEVNULL,
+                                      env=startup_env()),
+        1, repeat, memory=False)
+    stage['import_seconds'] = import_seconds(command)
+    return stage
+
+
+def current_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL,
+            cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(workdir: str, width: int = const.frame_width,
+        height: int = const.frame_height, seconds: float = 20,
+        seed: int = 0, legacy_frames: int = 10, path_frames: int = 54000,
+        repeat: int = 1, memory: bool = True,
+        startup: bool = True, adaptive_stride: int = 3) -> Dict[str, Any]:
+    """Benchmark every stage on a synthetic video in workdir.
+
+    Args:
+        width, height, seconds: the size and length of the synthetic video.
+            The size must be even.  (The pipeline always works on frames
+            scaled to const.frame_width x const.frame_height.)
+        legacy_frames: the number of frame pairs to run the slow PIL center
+            of change functions on.
+        path_frames: the length, in frames, to repeat the path data out to
+            for the smoothing and snapping stages.  The default is an hour.
+        repeat: the number of times to run each stage, keeping the fastest.
+        memory: whether to also measure each stage's peak memory use.
+        startup: whether to time run_mvz.py once the video is cached.  (It
+            has to be processed in full first.)
+        adaptive_stride: the stride of the center_of_change_adaptive stage.
+
+    Return:
+        the results, ready to be written as json.
+    """
+    stages = collections.OrderedDict()  # type: Dict[str, Dict[str, Any]]
+    with working_dir(workdir):
+        video_fn = const.video_fn(benchmark_id)
+        frame_count = write_video(video_fn, width, height, seconds, seed)
+
+        def decode():
+            return fn.ilen(frames.get_frames(benchmark_id))
+        frame_count, stages['decode'] = time_stage(decode, frame_count,
+                                                   repeat, memory)
+
+        pairs = [tuple(Image.fromarray(frame.copy()) for frame in pair)
+                 for pair in fn.pairwise(frames.get_frames(
+                     benchmark_id, legacy_frames + 1))]
+        bands, stages['image_squared_difference'] = time_stage(
+            lambda: [image_processing.image_squared_difference(pair)
+                     for pair in pairs], len(pairs), repeat, memory)
+        _, stages['weighted_average_pos'] = time_stage(
+            lambda: [image_processing.weighted_average_pos(
+                band, const.frame_width, const.frame_height)
+                for band in bands], len(bands), repeat, memory)
+
+        positions, stages['center_of_change_positions'] = time_stage(
+            lambda: list(image_processing.center_of_change_positions(
+                frames.get_frames(benchmark_id))),
+            frame_count - 1, repeat, memory)
+        adaptive, stages['center_of_change_adaptive'] = time_stage(
+            lambda: list(image_processing.center_of_change_positions(
+                frames.get_frames(benchmark_id),
+                adaptive_stride=adaptive_stride)),
+            frame_count - 1, repeat, memory)
+        # How much subsampling moves the boxes, which the timing alone
+        # doesn't show.
+        stages['center_of_change_adaptive']['boxes_within_tolerance'] = (
+            box_agreement(positions, adaptive, frame_count))
+
+        tiled = (positions * (path_frames // len(positions) + 1))[
+            :path_frames]
+        data = shared.clean_path_data(
+            pd.DataFrame(tiled, columns=['x', 'y'], dtype=float))
+        (x_filt, y_filt), stages['bandpass_filter_data'] = time_stage(
+            lambda: bandpass_and_snapping.bandpass_filter_data(data),
+            len(tiled), repeat, memory)
+        (xspec, yspec), stages['make_frame_specs'] = time_stage(
+            lambda: bandpass_and_snapping.make_frame_specs(
+                x_filt, y_filt, const.frame_width, const.frame_height),
+            len(tiled), repeat, memory)
+        boxes, stages['make_boxes_from_frame_spec'] = time_stage(
+            lambda: bandpass_and_snapping.make_boxes_from_frame_spec(
+                0, len(tiled) + 1, xspec, yspec,
+                const.frame_width, const.frame_height),
+            len(tiled) + 1, repeat, memory)
+        boxes, stages['anticipate_changes'] = time_stage(
+            lambda: bandpass_and_snapping.anticipate_changes(boxes),
+            len(boxes), repeat, memory)
+        # The whole of the ewma method, to compare with the four stages of
+        # bandpass_and_snapping above.
+        tiled_array = np.array(tiled, dtype=float)
+        _, stages['ewma_boxes'] = time_stage(
+            lambda: np.concatenate(list(ewma.stream_boxes(
+                tiled_array, len(tiled) + 1,
+                const.frame_width, const.frame_height))),
+            len(tiled) + 1, repeat, memory)
+
+        video_boxes = boxes[:frame_count]
+        _, stages['crop_to_bounding_boxes'] = time_stage(
+            lambda: shared.crop_to_bounding_boxes(
+                benchmark_id, frame_count, video_boxes),
+            frame_count, repeat, memory)
+        # The same on one thread, to see what the encoding threads buy.
+        _, stages['crop_to_bounding_boxes_1_thread'] = time_stage(
+            lambda: shared.crop_to_bounding_boxes(
+                benchmark_id, frame_count, video_boxes, encode_threads=1),
+            frame_count, repeat, memory)
+        for frame_format in sorted(shared.frame_formats):
+            if frame_format != 'png':
+                _, stages['crop_to_bounding_boxes_' + frame_format] = (
+                    time_stage(
+                        lambda: shared.crop_to_bounding_boxes(
+                            benchmark_id, frame_count, video_boxes,
+                            frame_format),
+                        frame_count, repeat, memory))
+        _, stages['generate_video'] = time_stage(
+            lambda: generate_video.main(
+                benchmark_id, 'benchmark', 'auto', video_boxes),
+            frame_count, repeat, memory)
+
+        if startup:
+            subprocess.check_call(startup_command(benchmark_id),
+                                  stderr=subprocess.DEVNULL, env=startup_env())
+            stages['startup_cached'] = time_startup(benchmark_id, repeat)
+
+    return {
+        'commit': current_commit(),
+        'time': time.time(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'cpus': os.cpu_count(),
+        'video': {
+            'width': width,
+            'height': height,
+            'frames': frame_count,
+            'seed': seed,
+        },
+        'path_frames': path_frames,
+        'adaptive_stride': adaptive_stride,
+        'repeat': repeat,
+        'memory': memory,
+        'stages': stages,
+    }
+
+
+def compare(old: Dict[str, Any], new: Dict[str, Any]) -> (
+        List[Dict[str, Any]]):
+    """Compare the stages of two runs.
+
+    A speedup above 1 means new is faster; a memory ratio above 1 means new
+    uses more.
+    """
+    comparison = []
+    for name, new_stage in new['stages'].items():
+        old_stage = old['stages'].get(name)
+        if old_stage is None:
+            continue
+        comparison.append({
+            'stage': name,
+            'old_seconds': old_stage['seconds'],
+            'new_seconds': new_stage['seconds'],
+            'speedup': (old_stage['seconds'] / new_stage['seconds']
+                        if new_stage['seconds'] > 0 else None),
+            'memory_ratio': (new_stage['peak_bytes'] / old_stage['peak_bytes']
+                             if new_stage['peak_bytes'] is not None and
+                             old_stage['peak_bytes'] else None),
+        })
+    return comparison
+
+
+def format_results(results: Dict[str, Any]) -> str:
+    lines = ['stage\tseconds\tframes/s\tpeak MB']
+    for name, stage in results['stages'].items():
+        lines.append('%s\t%.4f\t%.1f\t%s' % (
+            name, stage['seconds'], stage['frames_per_second'] or 0,
+            '-' if stage['peak_bytes'] is None
+            else '%.1f' % (stage['peak_bytes'] / 1e6)))
+    for name, stage in results['stages'].items():
+        if 'boxes_within_tolerance' in stage:
+            lines.append('%s: %.1f%% of boxes match the full rate ones' % (
+                name, 100 * stage['boxes_within_tolerance']))
+    return '\n'.join(lines)
+
+
+def format_comparison(comparison: List[Dict[str, Any]]) -> str:
+    lines = ['stage\told s\tnew s\tspeedup\tmemory']
+    for row in comparison:
+        lines.append('%s\t%.4f\t%.4f\t%.2fx\t%s' % (
+            row['stage'], row['old_seconds'], row['new_seconds'],
+            row['speedup'] or 0,
+            '-' if row['memory_ratio'] is None
+            else '%.2fx' % row['memory_ratio']))
+    return '\n'.join(lines)
+
+
+def results_fn(results: Dict[str, Any]) -> str:
+    return os.path.join(const.output_dir, 'benchmarks', '%s_%s.json' % (
+        time.strftime('%Y%m%d-%H%M%S', time.localtime(results['time'])),
+        (results['commit'] or 'unknown')[:10]))
+
+
+def write_results(results: Dict[str, Any], fn: Optional[str] = None) -> str:
+    fn = fn or results_fn(results)
+    os.makedirs(os.path.dirname(fn) or '.', exist_ok=True)
+    with open(fn, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+    return fn
@@ -0,0 +1,217 @@
+"""A content-addressed cache for the output of each stage of the pipeline.
+
+Each stage's output lives in its own directory under `store_dir`, named by a
+hash of the stage, its version, and everything it depends on: the hash of the
+input video's contents and the stage's parameters.  Changing any of those
+gives a new entry rather than reusing a stale one.  The stages are
+
+    download: the video, keyed by url
+    frames: the (optional) png per frame, keyed by video and frame size/rate
+    path: the center of change path data, keyed by video and analysis options
+    boxes: the output boxes, keyed by path data and method parameters
+
+Each entry has a meta.json recording what it is, its size, and when it was last
+used, so that the least recently used entries can be evicted to keep the
+cache under a disk budget.  An entry is only returned by `lookup` once it has
+been marked complete with `finish`.
+
+The old per-video names in the cache directory (const.video_fn and so on) are
+kept as symlinks to the current entries.
+"""
+import hashlib
+import json
+import os
+import shutil
+import time
+from typing import Any, Dict, List, Optional
+
+from mvz import const
+
+store_dir = os.path.join(const.cache_dir, 'store')
+
+# Bump a stage's version when its output format or algorithm changes.
+stage_versions = {
+    'download': 1,
+    'frames': 1,
+    'path': 3,
+    'boxes': 2,
+}
+
+_meta_fn = 'meta.json'
+
+
+def entry_key(stage: str, params: Dict[str, Any]) -> str:
+    key_data = json.dumps(
+        {'stage': stage, 'version': stage_versions[stage], 'params': params},
+        sort_keys=True)
+    return hashlib.sha1(key_data.encode('utf-8')).hexdigest()
+
+
+def entry_dir(key: str) -> str:
+    return os.path.join(store_dir, key)
+
+
+def read_meta(dirname: str) -> Optional[Dict[str, Any]]:
+    try:
+        with open(os.path.join(dirname, _meta_fn), 'r') as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def _write_meta(dirname: str, meta: Dict[str, Any]) -> None:
+    tmp_fn = os.path.join(dirname, '%s.%d.tmp' % (_meta_fn, os.getpid()))
+    with open(tmp_fn, 'w') as f:
+        json.dump(meta, f, sort_keys=True)
+    os.replace(tmp_fn, os.path.join(dirname, _meta_fn))
+
+
+def lookup(stage: str, params: Dict[str, Any]) -> Optional[str]:
+    """Find the directory of a complete entry, marking it as used."""
+    dirname = entry_dir(entry_key(stage, params))
+    meta = read_meta(dirname)
+    if meta is None or not meta['complete']:
+        return None
+    touch(dirname)
+    return dirname
+
+
+def open_entry(stage: str, params: Dict[str, Any], youtube_id: str) -> str:
+    """Get the directory for a new (or previously interrupted) entry.
+
+    The stage should write its output into the directory and then call
+    finish.
+    """
+    key = entry_key(stage, params)
+    dirname = entry_dir(key)
+    if read_meta(dirname) is None:
+        os.makedirs(dirname, exist_ok=True)
+        now = time.time()
+        _write_meta(dirname, {
+            'key': key,
+            'stage': stage,
+            'version': stage_versions[stage],
+            'params': params,
+            'youtube_id': youtube_id,
+            'complete': False,
+            'size': 0,
+            'created': now,
+            'last_access': now,
+        })
+    return dirname
+
+
+def finish(dirname: str, **extra_meta: Any) -> None:
+    """Mark an entry complete, recording its size and any extra metadata."""
+    meta = read_meta(dirname)
+    meta.update(extra_meta)
+    meta['complete'] = True
+    meta['size'] = _dir_size(dirname)
+    meta['last_access'] = time.time()
+    _write_meta(dirname, meta)
+
+
+def touch(dirname: str) -> None:
+    meta = read_meta(dirname)
+    meta['last_access'] = time.time()
+    _write_meta(dirname, meta)
+
+
+def remove(dirname: str) -> None:
+    shutil.rmtree(dirname, ignore_errors=True)
+
+
+def _dir_size(dirname: str) -> int:
+    try:
+        return sum(os.path.getsize(os.path.join(dirname, fn))
+                   for fn in os.listdir(dirname))
+    except OSError:
+        return 0
+
+
+def entries() -> List[Dict[str, Any]]:
+    """The metadata for every entry in the cache."""
+    if not os.path.exists(store_dir):
+        return []
+    metas = (read_meta(entry_dir(key)) for key in os.listdir(store_dir))
+    return [meta for meta in metas if meta is not None]
+
+
+def find_entries(stage: str, youtube_id: str) -> List[Dict[str, Any]]:
+    """Entries for a stage of a video, most recently used first."""
+    return sorted((meta for meta in entries()
+                   if meta['stage'] == stage and
+                   meta['youtube_id'] == youtube_id),
+                  key=lambda meta: meta['last_access'], reverse=True)
+
+
+def evict(budget_bytes: int, keep_since: Optional[float] = None) -> (
+        List[str]):
+    """Remove least recently used entries until the cache fits the budget.
+
+    Entries used at or after keep_since (for instance, the start of the current
+    run) are never removed, and nor are incomplete entries, which another
+    process may still be writing.  Return the keys of the removed entries.
+    """
+    all_entries = entries()
+    total = sum(_dir_size(entry_dir(meta['key'])) for meta in all_entries)
+    removed = []
+    for meta in sorted(all_entries, key=lambda meta: meta['last_access']):
+        if total <= budget_bytes:
+            break
+        if not meta['complete']:
+            continue
+        if keep_since is not None and meta['last_access'] >= keep_since:
+            continue
+        total -= _dir_size(entry_dir(meta['key']))
+        remove(entry_dir(meta['key']))
+        removed.append(meta['key'])
+    return removed
+
+
+def link(target_fn: str, link_fn: str) -> None:
+    """Atomically point link_fn at target_fn."""
+    tmp_fn = '%s.%d.tmp' % (link_fn, os.getpid())
+    if os.path.lexists(tmp_fn):
+        os.remove(tmp_fn)
+    os.symlink(os.path.relpath(target_fn, os.path.dirname(link_fn)), tmp_fn)
+    os.replace(tmp_fn, link_fn)
+
+
+def file_hash(fn: str) -> str:
+    sha = hashlib.sha1()
+    with open(fn, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def download_params(youtube_id: str) -> Dict[str, Any]:
+    return {'url': const.url_for_youtube_id % {'yt_id': youtube_id}}
+
+
+def video_hash(youtube_id: str) -> str:
+    """The content hash of the cached video.
+
+    Later stages are keyed by it.
+    """
+    dirname = lookup('download', download_params(youtube_id))
+    if dirname is None:
+        raise KeyError('%s has not been downloaded' % youtube_id)
+    return read_meta(dirname)['video_hash']
+
+
+def frame_params(youtube_id: str) -> Dict[str, Any]:
+    return {
+        'video': video_hash(youtube_id),
+        'frame_rate': const.frame_rate,
+        'width': const.frame_width,
+        'height': const.frame_height,
+    }
+
+
+def module_params(module: Any) -> Dict[str, Any]:
+    """The public numeric and string settings of a module, for a cache key."""
+    return {name: value for name, value in vars(module).items()
+            if not name.startswith('_') and
+            isinstance(value, (int, float, str))}
@@ -0,0 +1,201 @@
+"""An append-only checkpoint file for path data as it is computed.
+
+The file starts with a fixed size header recording the resolution and
+settings the positions were computed with, the video file they were computed
+from, and the number of frames covered so far.  After that come chunks, each of
+
+    start frame, number of positions, crc32 of the frame ending the chunk
+    the positions, as little-endian float64 x, y pairs
+    a label byte for each position (see image_processing.label_*)
+    crc32 of all of the above
+
+A chunk is only used if it is complete and its crc matches, so a run that was
+killed partway through can resume after the last complete chunk.  The crc of
+each chunk's final frame lets us check, after the video has changed, which
+chunks still describe the same frames.
+"""
+import collections
+import hashlib
+import json
+import os
+import struct
+import zlib
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from mvz import const
+
+magic = b'MVZPATH\x00'
+version = 2
+
+# magic, version, width, height, frame rate, settings hash, video size,
+# video mtime, frames covered
+_header = struct.Struct('<8sHIII20sQQI')
+_chunk_header = struct.Struct('<III')
+_chunk_footer = struct.Struct('<I')
+
+Chunk = collections.namedtuple(
+    'Chunk', ['start_frame', 'positions', 'end_frame_crc', 'labels'])
+
+
+def frame_crc(frame: np.ndarray) -> int:
+    return zlib.crc32(np.ascontiguousarray(frame)) & 0xffffffff
+
+
+def video_stamp(youtube_id: str) -> Tuple[int, int]:
+    """Something that changes whenever the cached video file is replaced."""
+    st = os.stat(const.video_fn(youtube_id))
+    return (st.st_size, st.st_mtime_ns)
+
+
+def settings_hash(settings: Dict[str, Any]) -> bytes:
+    return hashlib.sha1(
+        json.dumps(settings, sort_keys=True).encode('utf-8')).digest()
+
+
+class PathCheckpoint(object):
+    """The checkpoint file for one video, opened for appending."""
+
+    def __init__(self, fn: str, width: int, height: int,
+                 settings: Dict[str, Any], stamp: Tuple[int, int]) -> None:
+        self.fn = fn
+        self.width = width
+        self.height = height
+        self.settings_hash = settings_hash(settings)
+        self.stamp = stamp
+        self.stored_stamp = stamp
+        self.chunks = []  # type: List[Chunk]
+        # The offset in the file at which each chunk starts.
+        self._offsets = []  # type: List[int]
+        if not self._read():
+            self.clear()
+
+    def _read(self) -> bool:
+        """Load the existing file, returning False if it is unusable."""
+        if not os.path.exists(self.fn):
+            return False
+        with open(self.fn, 'rb') as f:
+            header = f.read(_header.size)
+            if len(header) < _header.size:
+                return False
+            (file_magic, file_version, width, height, frame_rate,
+             file_settings_hash, size, mtime, _) = _header.unpack(header)
+            if (file_magic, file_version, width, height, frame_rate,
+                    file_settings_hash) != (
+                        magic, version, self.width, self.height,
+                        const.frame_rate, self.settings_hash):
+                return False
+            self.stored_stamp = (size, mtime)
+            while True:
+                offset = f.tell()
+                chunk = _read_chunk(f)
+                if chunk is None:
+                    break
+                self.chunks.append(chunk)
+                self._offsets.append(offset)
+        # Drop any partly written chunk at the end.
+        self._truncate(self._end_offset())
+        return True
+
+    def _end_offset(self) -> int:
+        if not self.chunks:
+            return _header.size
+        last = self.chunks[-1]
+        return (self._offsets[-1] + _chunk_header.size +
+                17 * len(last.positions) + _chunk_footer.size)
+
+    def _truncate(self, offset: int) -> None:
+        with open(self.fn, 'r+b') as f:
+            f.truncate(offset)
+
+    def _write_header(self) -> None:
+        with open(self.fn, 'r+b') as f:
+            f.write(_header.pack(
+                magic, version, self.width, self.height, const.frame_rate,
+                self.settings_hash,
+                self.stored_stamp[0], self.stored_stamp[1],
+                self.frame_count()))
+            f.flush()
+            os.fsync(f.fileno())
+
+    def clear(self) -> None:
+        """Start over with no chunks."""
+        self.chunks = []
+        self._offsets = []
+        self.stored_stamp = self.stamp
+        with open(self.fn, 'wb'):
+            pass
+        self._write_header()
+
+    def is_stale(self) -> bool:
+        """Whether the video was replaced after the chunks were written."""
+        return self.stored_stamp != self.stamp
+
+    def mark_current(self) -> None:
+        """Record that the remaining chunks match the current video."""
+        self.stored_stamp = self.stamp
+        self._write_header()
+
+    def drop_last_chunk(self) -> None:
+        self._truncate(self._offsets[-1])
+        self.chunks.pop()
+        self._offsets.pop()
+        self._write_header()
+
+    def next_frame(self) -> int:
+        """The frame the next chunk starts at."""
+        if not self.chunks:
+            return 0
+        last = self.chunks[-1]
+        return last.start_frame + len(last.positions)
+
+    def frame_count(self) -> int:
+        return self.next_frame() + 1 if self.chunks else 0
+
+    def positions(self) -> List[Tuple[float, float]]:
+        return [pos for chunk in self.chunks for pos in chunk.positions]
+
+    def labels(self) -> List[int]:
+        return [label for chunk in self.chunks for label in chunk.labels]
+
+    def append(self, start_frame: int, positions: List[Tuple[float, float]],
+               end_frame_crc: int, labels: Optional[List[int]] = None) -> None:
+        """Add a chunk; labels default to all zero (plain change)."""
+        assert start_frame == self.next_frame()
+        if not positions:
+            return
+        if labels is None:
+            labels = [0] * len(positions)
+        data = _chunk_header.pack(start_frame, len(positions), end_frame_crc)
+        data += np.array(positions, dtype='<f8').tobytes()
+        data += np.array(labels, dtype=np.uint8).tobytes()
+        data += _chunk_footer.pack(zlib.crc32(data) & 0xffffffff)
+        offset = self._end_offset()
+        with open(self.fn, 'ab') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        self.chunks.append(
+            Chunk(start_frame, positions, end_frame_crc, list(labels)))
+        self._offsets.append(offset)
+        self._write_header()
+
+
+def _read_chunk(f) -> Optional[Chunk]:
+    header = f.read(_chunk_header.size)
+    if len(header) < _chunk_header.size:
+        return None
+    start_frame, count, end_frame_crc = _chunk_header.unpack(header)
+    payload = f.read(17 * count)
+    footer = f.read(_chunk_footer.size)
+    if len(payload) < 17 * count or len(footer) < _chunk_footer.size:
+        return None
+    (crc,) = _chunk_footer.unpack(footer)
+    if crc != zlib.crc32(header + payload) & 0xffffffff:
+        return None
+    positions = [(float(x), float(y)) for x, y in np.frombuffer(
+        payload, dtype='<f8', count=2 * count).reshape((count, 2))]
+    labels = np.frombuffer(payload, dtype=np.uint8, offset=16 * count).tolist()
+    return Chunk(start_frame, positions, end_frame_crc, labels)
+
@@ -13,30 +13,54 @@ url_for_youtube_id = (
 cache_dir = "./cache"
 output_dir = "./output"
 
+# The disk budget for the cache, in GB, or None for no limit.
+cache_budget_gb = None
+
+# The rate and size at which frames are extracted from the source video.
+frame_rate = 15
+frame_width = 1280
+frame_height = 720
+
 # The size of the mobile video player target in px
 # Original testing was done at 432 x 243
 box_width = 400
 box_height = box_width
+box_size = (box_width, box_height)
 
 BoundingBox = Tuple[int, int, int, int]
+BoxSize = Tuple[int, int]
 
 
 def video_fn(youtube_id: str) -> str:
     return os.path.join(cache_dir, '%s.mp4' % youtube_id)
 
 
-def frame_fn_template(youtube_id: str) -> str:
-    return os.path.join(cache_dir, '%s_%%06d.png' % youtube_id)
-
-
 def path_data_fn(youtube_id: str) -> str:
     return os.path.join(cache_dir, '%s_path_data.csv' % youtube_id)
 
 
-def output_frame_template(youtube_id: str) -> str:
-    return os.path.join(output_dir, '%s_%%06d.png' % youtube_id)
+def path_array_fn(youtube_id: str) -> str:
+    return os.path.join(cache_dir, '%s_path_data.array' % youtube_id)
+
+
+def path_labels_fn(youtube_id: str) -> str:
+    return os.path.join(cache_dir, '%s_path_labels.array' % youtube_id)
+
+
+def output_frame_template(youtube_id: str, extension: str = 'png',
+                          size: BoxSize = box_size) -> str:
+    return os.path.join(output_dir, '%s%s_%%06d.%s' % (
+        youtube_id, size_suffix(size), extension))
+
+
+def size_suffix(size: BoxSize) -> str:
+    """What to add to output filenames for a box size other than box_size."""
+    if tuple(size) == box_size:
+        return ''
+    return '_%dx%d' % tuple(size)
 
 
-def output_video_fn(youtube_id: str, method: str, param: str) -> str:
-    return os.path.join(output_dir, '%s_%s_%s.mp4' % (
-        youtube_id, method, param))
+def output_video_fn(youtube_id: str, method: str, param: str,
+                    size: BoxSize = box_size) -> str:
+    return os.path.join(output_dir, '%s_%s_%s%s.mp4' % (
+        youtube_id, method, param, size_suffix(size)))
@@ -1,33 +1,161 @@
-from io import BytesIO
-import os.path
+import os
 import subprocess
+import time
+from typing import TYPE_CHECKING, Optional
 
-import requests as req
-
+from mvz import cache
 import mvz.const as const
+from mvz import frames
+from mvz import instrument
+
+video_basename = 'video.mp4'
+
+# Network settings for fetching videos.  The timeout is in seconds, for
+# connecting and between bytes received; failed attempts are retried, resuming
+# where they left off, after retry_delay * 2**attempt seconds.
+timeout = 30
+retries = 5
+retry_delay = 1.0
+chunk_size = 1 << 16
+
+if TYPE_CHECKING:
+    # requests is only imported once there's something to fetch.
+    import requests as req
+
+_session = None  # type: Optional[req.Session]
+
+
+def session() -> 'req.Session':
+    """A shared session, so connections are pooled across downloads."""
+    import requests as req
+    import requests.adapters
+    global _session
+    if _session is None:
+        _session = req.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=4,
+                                                pool_maxsize=16)
+        _session.mount('http://', adapter)
+        _session.mount('https://', adapter)
+    return _session
+
+
+def _fetch_once(url: str, part_fn: str, validator_fn: str) -> None:
+    """Make one attempt at fetching url into part_fn, resuming if possible.
 
+    We resume from the end of any existing partial file with a Range request.
+    If-Range makes the server send the whole file instead if it has changed
+    since the partial file was started.
+    """
+    headers = {}
+    offset = os.path.getsize(part_fn) if os.path.exists(part_fn) else 0
+    if offset > 0 and os.path.exists(validator_fn):
+        with open(validator_fn, 'r') as f:
+            headers['Range'] = 'bytes=%d-' % offset
+            headers['If-Range'] = f.read()
 
-def download(youtube_id: str, bust_cache: bool = False) -> str:
-    url = const.url_for_youtube_id % {'yt_id': youtube_id}
-    video = BytesIO(req.get(url).content)
+    response = session().get(url, headers=headers, stream=True,
+                             timeout=timeout)
+    try:
+        if response.status_code == 416:
+            # We already have the whole thing.
+            return
+        response.raise_for_status()
+        mode = 'ab' if response.status_code == 206 else 'wb'
+        validator = (response.headers.get('ETag') or
+                     response.headers.get('Last-Modified'))
+        if mode == 'wb':
+            if validator is not None:
+                with open(validator_fn, 'w') as f:
+                    f.write(validator)
+            elif os.path.exists(validator_fn):
+                os.remove(validator_fn)
+        total = response.headers.get('Content-Length')
+        with open(part_fn, mode) as f:
+            start = f.tell()
+            for block in response.iter_content(chunk_size):
+                f.write(block)
+                instrument.count('bytes_written', len(block))
+                instrument.progress(f.tell() - start,
+                                    int(total) if total else None)
+    finally:
+        response.close()
+
+
+def fetch(url: str, fn: str) -> None:
+    """Stream url to fn, retrying and resuming on failure.
+
+    The data goes to a partial file next to fn, which is renamed into place
+    once it is complete.
+    """
+    import requests as req
+    part_fn = fn + '.part'
+    validator_fn = part_fn + '.validator'
+    for attempt in range(retries + 1):
+        try:
+            _fetch_once(url, part_fn, validator_fn)
+            break
+        except (req.exceptions.ConnectionError, req.exceptions.Timeout,
+                req.exceptions.ChunkedEncodingError):
+            if attempt == retries:
+                raise
+        except req.exceptions.HTTPError as e:
+            if e.response.status_code < 500 or attempt == retries:
+                raise
+        time.sleep(retry_delay * 2 ** attempt)
+    os.replace(part_fn, fn)
+    if os.path.exists(validator_fn):
+        os.remove(validator_fn)
+
+
+def download(youtube_id: str, bust_cache: bool = False,
+             cache_frames: bool = False) -> str:
+    """Fetch the video into the cache.
+
+    If cache_frames is set, also write every frame out as a png.  That is only
+    useful for debugging: the later stages stream frames from the video
+    directly (see mvz.frames) unless the png frames exist.
+    """
+    params = cache.download_params(youtube_id)
     video_fn = const.video_fn(youtube_id)
 
     if not os.path.exists(const.cache_dir):
         os.makedirs(const.cache_dir)
 
-    if not os.path.exists(video_fn) or bust_cache:
-        with open(video_fn, 'wb') as f:
-            f.write(video.read())
+    entry = cache.lookup('download', params)
+    if entry is not None and bust_cache:
+        cache.remove(entry)
+        entry = None
+
+    if entry is None:
+        entry = cache.open_entry('download', params, youtube_id)
+        entry_video_fn = os.path.join(entry, video_basename)
+        if os.path.isfile(video_fn) and not os.path.islink(video_fn):
+            # A video downloaded before there were cache entries.
+            os.replace(video_fn, entry_video_fn)
+        else:
+            fetch(params['url'], entry_video_fn)
+        cache.finish(entry, video_hash=cache.file_hash(entry_video_fn))
+
+    cache.link(os.path.join(entry, video_basename), video_fn)
 
-        split_into_frames(youtube_id)
+    if cache_frames and not frames.has_frame_cache(youtube_id):
+        with instrument.stage('split_frames'):
+            split_into_frames(youtube_id)
 
     return video_fn
 
 
 def split_into_frames(youtube_id: str) -> None:
+    entry = cache.open_entry('frames', cache.frame_params(youtube_id),
+                             youtube_id)
     command = (
-        "ffmpeg -i %(video_fn)s -vsync 1 -r 15 -s 1280x720"
+        "ffmpeg -copyts -i %(video_fn)s -an -vf '%(filter)s'"
+        " -s %(width)dx%(height)d"
         " -f image2 '%(output_fn_template)s'") % {
             'video_fn': const.video_fn(youtube_id),
-            'output_fn_template': const.frame_fn_template(youtube_id)}
+            'filter': frames.frame_filter(),
+            'width': const.frame_width,
+            'height': const.frame_height,
+            'output_fn_template': os.path.join(entry, frames.frame_basename)}
     subprocess.call(command, shell=True)
+    cache.finish(entry)
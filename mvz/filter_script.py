@@ -0,0 +1,84 @@
+"""Crop a video with a single ffmpeg pass, driven by a filter script.
+
+The script selects frames as frames.decode_command does, scales them to the
+size the boxes were computed at, and crops them, with a sendcmd filter moving
+the crop whenever the box changes.  Boxes hold still for most frames, so the
+script is short (a command per frame only while panning ahead of a change),
+and no frame passes through Python.
+"""
+import subprocess
+from typing import List, Sequence
+
+import numpy as np
+
+from mvz import const
+from mvz import frames
+from mvz import generate_video
+
+
+def crop_commands(boxes: Sequence[const.BoundingBox]) -> List[str]:
+    """The sendcmd commands that move the crop to each frame's box.
+
+    There's a command for each frame whose box differs from the one before.
+    It is timed half a frame early, so that it lands before its frame however
+    the timestamps round.
+    """
+    if len(boxes) < 2:
+        return []
+    box_array = np.array(boxes, dtype=int)
+    changed = np.flatnonzero(np.any(box_array[1:, :2] != box_array[:-1, :2],
+                                    axis=1)) + 1
+    return ['%.6f crop x %d, crop y %d;' % (
+        (frame - 0.5) / const.frame_rate, left, top)
+        for frame, (left, top) in zip(changed.tolist(),
+                                      box_array[changed, :2].tolist())]
+
+
+def filter_graph(boxes: Sequence[const.BoundingBox], video_width: int,
+                 video_height: int) -> str:
+    """The filtergraph that crops each frame of the video to its box.
+
+    Every box must be the same size, and the video is scaled to video_width x
+    video_height first, as it was when the boxes were computed.
+    """
+    left, top, right, bottom = boxes[0]
+    commands = crop_commands(boxes)
+    parts = [frames.frame_filter(),
+             'scale=%d:%d' % (video_width, video_height)]
+    if commands:
+        parts.append("sendcmd=c='\n%s\n'" % '\n'.join(commands))
+    parts.append('crop=w=%d:h=%d:x=%d:y=%d:exact=1' % (
+        right - left, bottom - top, left, top))
+    return ',\n'.join(parts) + '\n'
+
+
+def write(script_fn: str, boxes: Sequence[const.BoundingBox],
+          video_width: int, video_height: int) -> None:
+    """Write the filter script for per-frame boxes."""
+    with open(script_fn, 'w') as f:
+        f.write(filter_graph(boxes, video_width, video_height))
+
+
+def render_command(video_fn: str, script_fn: str, output_fn: str,
+                   frame_count: int) -> List[str]:
+    """The ffmpeg command that renders the cropped video from a script.
+
+    Timestamps are kept (-copyts), as when decoding frames, so that the
+    frame selection, and the sendcmd timings, line up with the boxes.
+    """
+    return [
+        'ffmpeg', '-v', 'error', '-y',
+        '-copyts', '-i', video_fn, '-an',
+        '-filter_script:v', script_fn,
+        '-frames:v', str(frame_count),
+        '-c:v', 'libx264', '-pix_fmt', 'yuv420p',
+        '-r', str(generate_video.fps),
+        '-metadata', 'title=Simple smoothing',
+        output_fn]
+
+
+def render(video_fn: str, script_fn: str, output_fn: str,
+           frame_count: int) -> None:
+    """Render the cropped video from a filter script with one ffmpeg pass."""
+    subprocess.check_call(render_command(video_fn, script_fn, output_fn,
+                                         frame_count))
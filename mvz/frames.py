@@ -0,0 +1,185 @@
+"""Sources of decoded video frames.
+
+Frames are normally streamed straight out of an ffmpeg subprocess as raw rgb24
+data, so nothing is written to disk.  For debugging, the frames can instead be
+written to the cache as one png per frame (see
+`mvz.downloader.split_into_frames`); when those exist they are read in
+preference to decoding the video again.
+
+All frames are yielded as (height, width, 3) uint8 numpy arrays.
+"""
+import glob
+import math
+import os
+import re
+import subprocess
+from typing import Iterator, List, Optional
+
+import numpy as np
+
+from mvz import cache
+from mvz import const
+
+frame_basename = '%06d.png'
+
+# How far (in seconds) before the first wanted frame to seek to, so that the
+# frame filter sees the frames leading up to it.
+seek_margin = 1.0
+
+
+def frame_filter(start_frame: int = 0) -> str:
+    """The ffmpeg filter that selects frames from the video.
+
+    Frames are resampled to const.frame_rate against the video's own
+    timestamps (hence -copyts wherever this is used), so that frame n is always
+    the same image whether or not decoding started with a seek.
+    """
+    selection = 'fps=%d:start_time=0' % const.frame_rate
+    if start_frame > 0:
+        selection += ',trim=start_pts=%d' % start_frame
+    return selection
+
+
+def decode_command(video_fn: str, width: int = const.frame_width,
+                   height: int = const.frame_height,
+                   start_frame: int = 0,
+                   frame_count: Optional[int] = None,
+                   realtime: bool = False) -> List[str]:
+    """The ffmpeg command that writes raw rgb24 frames to stdout.
+
+    The frame selection matches the one used to write the png frame cache, so
+    both sources produce the same frames.  When starting partway through, we
+    seek to a bit before the start frame and let the filter find it exactly.
+    If realtime is set, the video is read no faster than it would play, as if
+    it were a live stream.
+    """
+    command = ['ffmpeg', '-v', 'error']
+    if start_frame > 0:
+        seek_time = max(0.0, start_frame / const.frame_rate - seek_margin)
+        command += ['-ss', '%.6f' % seek_time]
+    if realtime:
+        command += ['-re']
+    command += ['-copyts', '-i', video_fn, '-an',
+                '-vf', frame_filter(start_frame),
+                '-s', '%dx%d' % (width, height)]
+    if frame_count is not None:
+        command += ['-frames:v', str(frame_count)]
+    return command + ['-f', 'rawvideo', '-pix_fmt', 'rgb24', '-']
+
+
+def duration_frame_count(video_fn: str) -> Optional[int]:
+    """Estimate the number of frames in a video from its container duration.
+
+    This can be off by a frame or so; use it for planning, not for indexing.
+    """
+    result = subprocess.run(['ffmpeg', '-i', video_fn],
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    match = re.search(br'Duration: (\d+):(\d\d):(\d\d(?:\.\d+)?)',
+                      result.stderr)
+    if not match:
+        return None
+    hours, minutes, seconds = match.groups()
+    duration = int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+    return int(math.ceil(duration * const.frame_rate))
+
+
+def _read_into(stream, buf: np.ndarray) -> bool:
+    """Fill buf from stream; return False if the stream ends first."""
+    view = memoryview(buf).cast('B')
+    pos = 0
+    while pos < len(view):
+        n = stream.readinto(view[pos:])
+        if not n:
+            return False
+        pos += n
+    return True
+
+
+def read_video_frames(video_fn: str, width: int = const.frame_width,
+                      height: int = const.frame_height,
+                      start_frame: int = 0,
+                      frame_count: Optional[int] = None,
+                      n_buffers: int = 2,
+                      realtime: bool = False) -> Iterator[np.ndarray]:
+    """Stream the frames of a video from an ffmpeg pipe.
+
+    Frames are read into a ring of n_buffers preallocated arrays and yielded
+    without copying, so a yielded frame is only valid until n_buffers more
+    frames have been read.  The default of 2 is enough to look at consecutive
+    pairs of frames; copy a frame if you need to keep it for longer.  Set
+    realtime to replay a file at its own frame rate.
+    """
+    buffers = [np.empty((height, width, 3), dtype=np.uint8)
+               for _ in range(n_buffers)]
+    proc = subprocess.Popen(
+        decode_command(video_fn, width, height, start_frame, frame_count,
+                       realtime),
+        stdout=subprocess.PIPE)
+    try:
+        i = 0
+        while frame_count is None or i < frame_count:
+            buf = buffers[i % n_buffers]
+            if not _read_into(proc.stdout, buf):
+                break
+            yield buf
+            i += 1
+    finally:
+        proc.stdout.close()
+        if proc.poll() is None:
+            proc.kill()
+        proc.wait()
+
+
+def frame_cache_dir(youtube_id: str) -> Optional[str]:
+    """The cache entry holding the (optional) png frames for this video."""
+    try:
+        return cache.lookup('frames', cache.frame_params(youtube_id))
+    except KeyError:
+        return None
+
+
+def frame_fn_template(youtube_id: str) -> Optional[str]:
+    dirname = frame_cache_dir(youtube_id)
+    return None if dirname is None else os.path.join(dirname, frame_basename)
+
+
+def has_frame_cache(youtube_id: str) -> bool:
+    return frame_cache_dir(youtube_id) is not None
+
+
+def cached_frame_fns(youtube_id: str) -> List[str]:
+    dirname = frame_cache_dir(youtube_id)
+    if dirname is None:
+        return []
+    return sorted(glob.glob(os.path.join(dirname, '[0-9]' * 6 + '.png')))
+
+
+def read_cached_frames(youtube_id: str, start_frame: int = 0,
+                       frame_count: Optional[int] = None) -> (
+        Iterator[np.ndarray]):
+    """Read frames back from the png frame cache."""
+    from PIL import Image
+    fns = cached_frame_fns(youtube_id)[start_frame:]
+    if frame_count is not None:
+        fns = fns[:frame_count]
+    for frame_fn in fns:
+        yield np.asarray(Image.open(frame_fn).convert('RGB'))
+
+
+def get_frames(youtube_id: str, frame_count: Optional[int] = None,
+               start_frame: int = 0) -> Iterator[np.ndarray]:
+    """Get the frames of a video, from the png cache if there is one.
+
+    Frames are 0-indexed; if frame_count is None, read to the end.
+    """
+    if has_frame_cache(youtube_id):
+        return read_cached_frames(youtube_id, start_frame, frame_count)
+    return read_video_frames(const.video_fn(youtube_id),
+                             start_frame=start_frame, frame_count=frame_count)
+
+
+def count_frames(youtube_id: str) -> Optional[int]:
+    """The (possibly approximate) number of frames in a video."""
+    if has_frame_cache(youtube_id):
+        return len(cached_frame_fns(youtube_id))
+    return duration_frame_count(const.video_fn(youtube_id))
@@ -1,41 +1,139 @@
-"""Generate a new video from a sequence of frame images.
+"""Generate a new video by cropping the frames of the original to boxes.
 
-For now, the frame images
+The cropped frames are piped as raw rgb24 data straight into an ffmpeg encoder,
+so no intermediate images are written.
 """
-import matplotlib
+import os
+import subprocess
+import time
+from typing import Callable, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
 
 from mvz import const
+from mvz import frames
+from mvz import instrument
+
+fps = const.frame_rate
+
+
+def encode_command(video_fn: str, width: int, height: int) -> List[str]:
+    return [
+        'ffmpeg', '-v', 'error', '-y',
+        '-f', 'rawvideo', '-pix_fmt', 'rgb24',
+        '-s', '%dx%d' % (width, height), '-r', str(fps),
+        '-i', '-',
+        '-an', '-c:v', 'libx264', '-pix_fmt', 'yuv420p',
+        '-metadata', 'title=Simple smoothing',
+        video_fn]
+
+
+def crop_frame(frame: np.ndarray, box: const.BoundingBox,
+               out: np.ndarray) -> np.ndarray:
+    """Copy the part of frame inside box into out.
+
+    Like PIL's crop, any part of the box outside of the frame is black.
+    """
+    left, top, right, bottom = box
+    height, width = frame.shape[:2]
+    src_left, src_top = max(left, 0), max(top, 0)
+    src_right, src_bottom = min(right, width), min(bottom, height)
+    if src_left > left or src_top > top or src_right < right or (
+            src_bottom < bottom):
+        out[:] = 0
+    if src_right > src_left and src_bottom > src_top:
+        out[src_top - top:src_bottom - top,
+            src_left - left:src_right - left] = (
+                frame[src_top:src_bottom, src_left:src_right])
+    return out
+
+
+def encode_cropped(all_frames: Iterable[np.ndarray],
+                   boxes: Iterable[const.BoundingBox], video_fn: str,
+                   width: int = const.box_width,
+                   height: int = const.box_height) -> None:
+    """Crop each frame to its box and encode the results as a video.
+
+    Every box must be width x height.
+    """
+    encode_cropped_sizes(all_frames, [(boxes, video_fn, (width, height))])
 
-matplotlib.use("Agg")
-import matplotlib.pyplot as pl
-import matplotlib.animation
 
-fps = 15
-dpi = 72
+def encode_cropped_sizes(
+        all_frames: Iterable[np.ndarray],
+        outputs: Sequence[Tuple[Iterable[const.BoundingBox], str,
+                                const.BoxSize]],
+        frame_sinks: Optional[Sequence[Callable[[np.ndarray],
+                                                None]]] = None) -> None:
+    """Crop each frame for several videos at once, each with its own boxes.
 
+    Each output is (boxes, video_fn, (width, height)), and every box of an
+    output must be its size.  The frames are only read once, and every
+    encoder runs at the same time.  If frame_sinks are given, each output's
+    cropped frames are also passed to its sink, in a buffer that is reused
+    for the next frame (as shared.FrameWriter.write_copy expects).
+    """
+    outs = [np.zeros((height, width, 3), dtype=np.uint8)
+            for _, _, (width, height) in outputs]
+    boxes = [output_boxes for output_boxes, _, _ in outputs]
+    total = min((len(b) for b in boxes if isinstance(b, list)), default=None)
+    crop_seconds = write_seconds = 0.0
+    procs = []  # type: List[subprocess.Popen]
+    try:
+        for _, video_fn, (width, height) in outputs:
+            procs.append(subprocess.Popen(
+                encode_command(video_fn, width, height),
+                stdin=subprocess.PIPE))
+        for i, (frame, frame_boxes) in enumerate(zip(all_frames,
+                                                     zip(*boxes))):
+            for k, (box, out, proc) in enumerate(zip(frame_boxes, outs,
+                                                     procs)):
+                start = time.perf_counter()
+                crop_frame(frame, box, out)
+                cropped = time.perf_counter()
+                proc.stdin.write(memoryview(out))
+                crop_seconds += cropped - start
+                write_seconds += time.perf_counter() - cropped
+                if frame_sinks is not None:
+                    frame_sinks[k](out)
+            instrument.count('frames')
+            instrument.progress(i + 1, total)
+    finally:
+        for proc in procs:
+            proc.stdin.close()
+        returncodes = [proc.wait() for proc in procs]
+    for returncode in returncodes:
+        if returncode != 0:
+            raise subprocess.CalledProcessError(returncode, 'ffmpeg')
+    # Time spent writing is time the encoder (or decoder) kept us waiting.
+    instrument.count('crop_seconds', crop_seconds)
+    instrument.count('encoder_wait_seconds', write_seconds)
+    instrument.count('bytes_written', sum(
+        os.path.getsize(video_fn) for _, video_fn, _ in outputs))
 
-def main(youtube_id: str, method_name: str, method_param: str) -> None:
-    FFMpegWriter = matplotlib.animation.writers['ffmpeg']
-    metadata = {'title': 'Simple smoothing'}
-    writer = FFMpegWriter(fps=fps, metadata=metadata)
 
-    fig = pl.figure(
-        figsize=(const.box_width/float(dpi), const.box_height/float(dpi)))
-    ax = pl.Axes(pl.gcf(), [0, 0, 1, 1], yticks=[], xticks=[], frame_on=False)
-    pl.gcf().delaxes(fig.gca())
-    pl.gcf().add_axes(ax)
+def main(youtube_id: str, method_name: str, method_param: str,
+         boxes: List[const.BoundingBox]) -> None:
+    """Write the video cropped to the given per-frame boxes."""
+    render_sizes(youtube_id, method_name, method_param,
+                 [(const.box_size, boxes)])
 
-    imobj = None
 
-    video_fn = const.output_video_fn(youtube_id, method_name, method_param)
+def render_sizes(youtube_id: str, method_name: str, method_param: str,
+                 sized_boxes: Sequence[Tuple[const.BoxSize,
+                                             List[const.BoundingBox]]],
+                 frame_sinks: Optional[Sequence[Callable[[np.ndarray],
+                                                         None]]] = None) -> (
+        None):
+    """Write a cropped video for each (box size, per-frame boxes) given.
 
-    with writer.saving(fig, video_fn, dpi):
-        for i in range(0, const.max_frame):
-            frame_fn = const.output_frame_template(youtube_id) % (i+1)
-            im = pl.imread(frame_fn)
-            if imobj is None:
-                imobj = pl.imshow(im)
-            else:
-                imobj.set_data(im)
-            pl.pause(0.001)
-            writer.grab_frame()
+    The videos are named by their size (see const.output_video_fn).  The
+    video is decoded once for all of them; frame_sinks are as for
+    encode_cropped_sizes.
+    """
+    frame_count = max(len(boxes) for _, boxes in sized_boxes)
+    encode_cropped_sizes(
+        frames.get_frames(youtube_id, frame_count),
+        [(boxes, const.output_video_fn(youtube_id, method_name, method_param,
+                                       box_size), box_size)
+         for box_size, boxes in sized_boxes], frame_sinks)
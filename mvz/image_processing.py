@@ -4,44 +4,89 @@ The "center of change" is defined as the average position of pixels in the
 video, weighted by the squared value of the (approximate) time derivative of
 the video.
 """
+import concurrent.futures
 import csv
+import hashlib
+import itertools
 import os.path
-from typing import Iterable, List, Tuple
+import shutil
+from typing import (TYPE_CHECKING, Any, Dict, Iterable, Iterator, List,
+                    Optional, Tuple)
 
-import funcy as fn
-import itertools
 import numpy as np
-from PIL import Image
-from PIL import ImageMath
 
+from . import array_file
+from . import cache
+from . import checkpoint
 from . import const
+from . import frames
+from . import instrument
+
+if TYPE_CHECKING:
+    # PIL is only needed for the png frame cache, the reference
+    # implementation and mask images, so it is imported where they are.
+    from PIL import Image
+
+path_data_basename = 'path_data.csv'
+path_array_basename = 'path_data.array'
+path_labels_basename = 'path_labels.array'
+checkpoint_basename = 'path_data.bin'
+
+# What each pair of frames is labeled by the scene detection pre-pass.  Static
+# pairs and cuts are given a NaN position without the full computation.
+label_change = 0
+label_static = 1
+label_cut = 2
+
+# The pre-pass compares thumbnails, each pixel the sum of a thumbnail_scale x
+# thumbnail_scale block.  A pair is static if no block changed by more than
+# static_threshold per pixel (in any band), and a cut if at least
+# cut_fraction of the blocks changed by more than cut_level per pixel.
+thumbnail_scale = 8
+static_threshold = 1.0
+cut_level = 24
+cut_fraction = 0.5
+
+# With an adaptive_stride, a window of that many pairs is only analyzed pair by
+# pair if its change, over the whole window, is more than refine_energy (the
+# mean squared difference per pixel, summed over bands, whatever the
+# analysis_scale), or moves the center of change more than refine_distance
+# pixels (see adaptive_windows).
+refine_energy = 64.0
+refine_distance = 64.0
+
+# bin_frame sums blocks of up to max_analysis_scale x max_analysis_scale
+# pixels, which fit in a uint16.
+max_analysis_scale = 16
+
+# The number of frame pairs in each checkpointed chunk, and handled by each
+# parallel worker task.
+chunk_frames = 900
 
 
 def n_frames(youtube_id: str) -> int:
-    # TODO(colin): somehow unite this with the filename in the const module
-    extractor = r'%s_(\d+).png' % youtube_id
-    return fn.rcompose(
-        os.listdir,
-        fn.partial(fn.filter, extractor),
-        fn.partial(fn.map, extractor),
-        fn.partial(fn.map, int),
-        max)(const.cache_dir)
+    """The number of frames in the video.
 
+    This is read off the png frame cache if there is one, and otherwise from
+    the header of the path data.
+    """
+    if frames.has_frame_cache(youtube_id):
+        return len(frames.cached_frame_fns(youtube_id))
+    return array_file.read_header(
+        const.path_array_fn(youtube_id)).frame_count
 
-def get_frame(youtube_id: str, frame_index: int) -> Image.Image:
-    """Get a PIL.image for the specified 0-indexed frame number."""
-    return Image.open(const.frame_fn_template(youtube_id) % (frame_index + 1))
 
+def get_frame(youtube_id: str, frame_index: int) -> 'Image.Image':
+    """Get a PIL.image for the specified 0-indexed frame number.
 
-def get_frames(youtube_id: str, frame_count: int, min_frame: int = 0) -> (
-        Iterable[Image.Image]):
-    """Get frame_count frames starting at min_frame as PIL.images."""
-    return (get_frame(youtube_id, i)
-            for i in range(min_frame, min_frame + frame_count))
+    This requires the png frame cache.
+    """
+    from PIL import Image
+    return Image.open(frames.frame_fn_template(youtube_id) % (frame_index + 1))
 
 
 def image_squared_difference(
-        im_tuple: Tuple[Image.Image, Image.Image]) -> Tuple[float, ...]:
+        im_tuple: Tuple['Image.Image', 'Image.Image']) -> Tuple[float, ...]:
     """Find the squared difference between two images.
 
     Args:
@@ -50,6 +95,7 @@ def image_squared_difference(
     Return:
         a tuple containing an Image for each band in the input images.
     """
+    from PIL import ImageMath
     im0, im1 = im_tuple
     parts1 = im1.split()
     parts0 = im0.split()
@@ -60,16 +106,16 @@ def image_squared_difference(
     return bands
 
 
-def weighted_average_pos(im_bands: Tuple[Image.Image, ...],
+def weighted_average_pos(im_bands: Tuple['Image.Image', ...],
                          video_width: int, video_height: int) -> (
         Tuple[float, float]):
     """Find the average position in the image weighted by the image values.
 
     All bands are weighted equally.
 
-    Note that this is the only particularly slow step in the image processing;
-    this might be worth trying to rewrite with better use of PIL or numpy ops
-    or moving to C.
+    Together with image_squared_difference, this is the original (slow) PIL
+    implementation.  main uses center_of_change_positions instead; these are
+    kept as the reference it is tested against.
     """
     pixel_sum = 0.0
     weighted_average_x = 0.0
@@ -80,7 +126,7 @@ def weighted_average_pos(im_bands: Tuple[Image.Image, ...],
     xm, ym = np.meshgrid(xvec, yvec, indexing='xy')
 
     for im in im_bands:
-        pxdata = np.fromstring(im.tobytes(), dtype=np.uint32,
+        pxdata = np.frombuffer(im.tobytes(), dtype=np.uint32,
                                count=(video_width * video_height))
         pxdata = np.reshape(pxdata, (video_height,
                                      video_width)).astype(np.double)
@@ -93,37 +139,721 @@ def weighted_average_pos(im_bands: Tuple[Image.Image, ...],
     return (weighted_average_x / pixel_sum, weighted_average_y / pixel_sum)
 
 
-def main(youtube_id: str, bust_cache: bool = False) -> (
-        Tuple[List[Tuple[float, float]], int, int]):
-    """Read in the frames of the video, find the center of change.
+def bin_frame(frame: np.ndarray, scale: int) -> np.ndarray:
+    """Downscale a frame by summing scale x scale blocks of pixels.
+
+    Any partial blocks at the right and bottom edges are dropped.  The sums of
+    up to max_analysis_scale x max_analysis_scale uint8 pixels fit in a
+    uint16.
+    """
+    if scale == 1:
+        return frame
+    height = frame.shape[0] // scale * scale
+    width = frame.shape[1] // scale * scale
+    # Summing strided slices is much faster than reducing over a reshaped
+    # array's interleaved axes.
+    rows = sum(frame[dy:height:scale, :width].astype(np.uint16)
+               for dy in range(scale))
+    return sum(rows[:, dx::scale] for dx in range(scale))
+
+
+def bin_mask(mask: np.ndarray, scale: int) -> np.ndarray:
+    """Downscale a mask to match bin_frame.
+
+    Each bin is the fraction of its pixels that are included.
+    """
+    return bin_frame(mask.astype(np.uint8), scale) / float(scale * scale)
+
+
+def change_energy(batch: np.ndarray) -> np.ndarray:
+    """Sum the squared differences of consecutive frames over bands.
+
+    Args:
+        batch: an (n + 1, height, width, bands) array of frames, either uint8
+            or uint16 as from bin_frame.
+
+    Return:
+        an (n, height, width) array: uint32 for uint8 frames, otherwise
+        int64.
+    """
+    if batch.dtype != np.uint8:
+        diff = batch[1:].astype(np.int64)
+        diff -= batch[:-1]
+        diff *= diff
+        return diff.sum(axis=-1)
+    diff = batch[1:].astype(np.int16)
+    diff -= batch[:-1]
+    # The squares are at most 255**2, which overflows int16 but fits in
+    # uint16, so reinterpreting the wrapped result gives the right value.
+    diff *= diff
+    return diff.view(np.uint16).sum(axis=-1, dtype=np.uint32)
+
+
+def weighted_average_positions(energy: np.ndarray, xvec: np.ndarray,
+                               yvec: np.ndarray) -> np.ndarray:
+    """Find the average position in each image weighted by its values.
+
+    Rather than weighting full coordinate grids, this projects each image onto
+    its row and column sums and takes the moments of those against the
+    precomputed column and row index vectors.  (The energies are integers, so
+    the double precision sums are exact.)
+
+    Args:
+        energy: an (n, height, width) array, as from change_energy.
+        xvec, yvec: the x and y coordinates of each column and row.
+
+    Return:
+        an (n, 2) array of x, y positions; NaN where the image is all zero.
+    """
+    col_sums = energy.sum(axis=1, dtype=np.double)
+    row_sums = energy.sum(axis=2, dtype=np.double)
+    pixel_sum = col_sums.sum(axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.column_stack((col_sums.dot(xvec) / pixel_sum,
+                                row_sums.dot(yvec) / pixel_sum))
+
+
+def bin_centers(n_bins: int, scale: int) -> np.ndarray:
+    """The full resolution coordinate of the center of each bin."""
+    return np.arange(n_bins, dtype=np.double) * scale + (scale - 1) / 2.0
+
+
+def classify_pairs(thumbnails: np.ndarray, pixels_per_bin: int,
+                   weights: Optional[np.ndarray] = None) -> np.ndarray:
+    """Label each consecutive pair of thumbnails as change, static or cut.
+
+    Args:
+        thumbnails: an (n + 1, height, width, bands) array of binned frames.
+        pixels_per_bin: the number of pixels summed into each thumbnail pixel.
+        weights: the fraction of each thumbnail pixel to consider, from a
+            mask.
+
+    Return:
+        an (n,) array of labels.
+    """
+    diff = thumbnails[1:].astype(np.int32)
+    diff -= thumbnails[:-1]
+    change = np.abs(diff).max(axis=-1) / float(pixels_per_bin)
+    if weights is not None:
+        change *= weights
+    static = change.max(axis=(1, 2)) <= static_threshold
+    cut = (change > cut_level).mean(axis=(1, 2)) >= cut_fraction
+    return np.where(cut, label_cut,
+                    np.where(static, label_static, label_change))
+
+
+def changed_positions(frame_batch: np.ndarray, labels: np.ndarray,
+                      xvec: np.ndarray, yvec: np.ndarray,
+                      weights: Optional[np.ndarray] = None) -> np.ndarray:
+    """The center of change of each pair of frames labeled as a change.
+
+    Args:
+        frame_batch: an (n + 1, height, width, bands) array of binned frames.
+        labels: the (n,) labels of the pairs.
+
+    Return:
+        an (n, 2) array of positions, NaN for the pairs not labeled change.
+    """
+    positions = np.full((len(labels), 2), float('NaN'))
+    # Runs of changed pairs are differenced in place, without copying.
+    changed = np.concatenate(([0], labels == label_change, [0]))
+    edges = np.flatnonzero(np.diff(changed))
+    for start, end in zip(edges[::2], edges[1::2]):
+        energy = change_energy(frame_batch[start:end + 1])
+        if weights is not None:
+            energy = energy * weights
+        positions[start:end] = weighted_average_positions(energy, xvec, yvec)
+    return positions
+
+
+def frame_batches(all_frames: Iterable[np.ndarray], batch_size: int,
+                  analysis_scale: int = 1,
+                  thumbnail_factor: Optional[int] = None) -> (
+        Iterator[Tuple[np.ndarray, Optional[np.ndarray]]]):
+    """Bin the frames, and group them into batches of batch_size pairs.
+
+    Frames are copied into a reused buffer as they arrive, so the input frames
+    may themselves be reused buffers; each batch is a view of the buffer, only
+    valid until the next is yielded.  Consecutive batches share a frame, so
+    that no pair is missed.  If thumbnail_factor is given, each batch comes
+    with thumbnails of its frames, binned down by that much more (otherwise,
+    with None).
+    """
+    batch = thumbnails = None
+    n = 0
+    for frame in all_frames:
+        frame = bin_frame(frame, analysis_scale)
+        if batch is None:
+            batch = np.empty((batch_size + 1,) + frame.shape,
+                             dtype=frame.dtype)
+        batch[n] = frame
+        if thumbnail_factor is not None:
+            thumbnail = bin_frame(frame, thumbnail_factor)
+            if thumbnails is None:
+                thumbnails = np.empty((batch_size + 1,) + thumbnail.shape,
+                                      dtype=np.uint16)
+            thumbnails[n] = thumbnail
+        n += 1
+        if n == batch_size + 1:
+            yield (batch, thumbnails)
+            batch[0] = batch[n - 1]
+            if thumbnails is not None:
+                thumbnails[0] = thumbnails[n - 1]
+            n = 1
+    if n > 1:
+        yield (batch[:n], None if thumbnails is None else thumbnails[:n])
+
+
+class _Analysis(object):
+    """What the center of change is found with, for frames of one shape."""
+
+    def __init__(self, frame_shape: Tuple[int, ...], analysis_scale: int,
+                 mask: Optional[np.ndarray], scene_detection: bool) -> None:
+        self.analysis_scale = analysis_scale
+        self.scene_detection = scene_detection
+        self.thumbnail_factor = max(1, thumbnail_scale // analysis_scale)
+        self.xvec = bin_centers(frame_shape[1], analysis_scale)
+        self.yvec = bin_centers(frame_shape[0], analysis_scale)
+        self.weights = self.thumbnail_weights = None
+        if mask is not None:
+            self.weights = bin_mask(mask, analysis_scale)
+            self.thumbnail_weights = bin_mask(
+                mask, analysis_scale * self.thumbnail_factor)
+
+    def labels(self, thumbnail_batch: Optional[np.ndarray],
+               count: int) -> np.ndarray:
+        if not self.scene_detection:
+            return np.full(count, label_change)
+        pixels_per_bin = (self.analysis_scale * self.thumbnail_factor) ** 2
+        return classify_pairs(thumbnail_batch, pixels_per_bin,
+                              self.thumbnail_weights)
+
+
+def labeled_positions(all_frames: Iterable[np.ndarray], batch_size: int = 8,
+                      analysis_scale: int = 1,
+                      mask: Optional[np.ndarray] = None,
+                      scene_detection: bool = True,
+                      adaptive_stride: int = 1) -> (
+        Iterator[Tuple[Tuple[float, float], int]]):
+    """Find the center of change between each pair of frames, and its label.
+
+    This is center_of_change_positions with a cheap pre-pass: each frame is
+    binned down to a thumbnail, and only pairs whose thumbnails show a
+    change that isn't a scene cut get the full computation.  Static pairs
+    and cuts get a NaN position, as if nothing had changed.  If
+    adaptive_stride is more than 1, see adaptive_positions.
+    """
+    if adaptive_stride > 1:
+        yield from adaptive_positions(all_frames, adaptive_stride,
+                                      analysis_scale, mask, scene_detection)
+        return
+    analysis = None  # type: Optional[_Analysis]
+    thumbnail_factor = max(1, thumbnail_scale // analysis_scale)
+    for batch, thumbnails in frame_batches(
+            all_frames, batch_size, analysis_scale,
+            thumbnail_factor if scene_detection else None):
+        if analysis is None:
+            analysis = _Analysis(batch.shape[1:], analysis_scale, mask,
+                                 scene_detection)
+        labels = analysis.labels(thumbnails, len(batch) - 1)
+        positions = changed_positions(batch, labels, analysis.xvec,
+                                      analysis.yvec, analysis.weights)
+        for pos, label in zip(positions, labels):
+            yield ((float(pos[0]), float(pos[1])), int(label))
+
+
+def adaptive_windows(all_frames: Iterable[np.ndarray], stride: int,
+                     analysis_scale: int = 1,
+                     mask: Optional[np.ndarray] = None,
+                     scene_detection: bool = True) -> (
+        Iterator[Tuple[np.ndarray, np.ndarray, Optional[np.ndarray]]]):
+    """Find the center of change a window of stride frame pairs at a time.
+
+    The first and last frames of each window are differenced first.  Every
+    pair in the window is only differenced (as in labeled_positions) if that
+    shows a change over refine_energy per pixel, or a center of change more
+    than refine_distance from the last one found, or nothing at all (a change
+    that was undone), or if the window has a cut.  The pairs are still
+    labeled one by one, from their thumbnails.
+
+    Yield:
+        for each window, the labels of its pairs, and either their positions
+        and None, or if the window wasn't refined, NaN positions and the
+        center of change over the whole window.
+    """
+    analysis = None  # type: Optional[_Analysis]
+    thumbnail_factor = max(1, thumbnail_scale // analysis_scale)
+    last = None  # type: Optional[np.ndarray]
+    for window, thumbnails in frame_batches(
+            all_frames, stride, analysis_scale,
+            thumbnail_factor if scene_detection else None):
+        if analysis is None:
+            analysis = _Analysis(window.shape[1:], analysis_scale, mask,
+                                 scene_detection)
+        count = len(window) - 1
+        labels = analysis.labels(thumbnails, count)
+        changed = labels == label_change
+        if count > 1 and changed.any() and not (labels == label_cut).any():
+            energy = change_energy(window[::count])
+            if analysis.weights is not None:
+                energy = energy * analysis.weights
+            pos = weighted_average_positions(energy, analysis.xvec,
+                                             analysis.yvec)[0]
+            # Binned pixels are sums of pixels_per_bin pixels, so their
+            # differences are too.
+            pixels_per_bin = analysis_scale ** 2
+            if (not np.isnan(pos[0]) and
+                    energy.mean() / pixels_per_bin ** 2 <= refine_energy and
+                    (last is None or
+                     np.hypot(*(pos - last)) <= refine_distance)):
+                last = pos
+                yield (labels, np.full((count, 2), float('NaN')), pos)
+                continue
+        positions = changed_positions(window, labels, analysis.xvec,
+                                      analysis.yvec, analysis.weights)
+        valid = positions[~np.isnan(positions[:, 0])]
+        if len(valid) > 0:
+            last = valid[-1]
+        yield (labels, positions, None)
+
+
+def adaptive_positions(all_frames: Iterable[np.ndarray], stride: int,
+                       analysis_scale: int = 1,
+                       mask: Optional[np.ndarray] = None,
+                       scene_detection: bool = True) -> (
+        Iterator[Tuple[Tuple[float, float], int]]):
+    """labeled_positions, differencing frames stride apart where it can.
 
-    Writes out x,y positions to a csv, one row per frame.
+    Where little changes, the full temporal resolution is wasted: the path
+    is lowpass filtered long before the boxes are chosen.  So the frames are
+    analyzed a window of stride pairs at a time (see adaptive_windows), and
+    in a window that wasn't refined, each changed pair's position is
+    interpolated between the window's center of change, at its middle, and
+    the nearest positions found on either side within the same scene.
+    Static pairs and cuts still get a NaN position.
     """
-    path_data_fn = const.path_data_fn(youtube_id)
+    # The last position found (as the pair index and position), since the
+    # last cut, and a window waiting for the next one: its labels, first
+    # pair index, center of change, and the position found before it.
+    previous = None  # type: Optional[Tuple[float, np.ndarray]]
+    pending = None  # type: Optional[Tuple[np.ndarray, int, np.ndarray, Any]]
+    start = 0
+    for labels, positions, center in adaptive_windows(
+            all_frames, stride, analysis_scale, mask, scene_detection):
+        count = len(labels)
+        if center is not None:
+            anchor = (start + (count - 1) / 2.0, center)
+            after = anchor  # type: Optional[Tuple[float, np.ndarray]]
+        else:
+            after = _first_position(positions, labels, start)
+        if pending is not None:
+            yield from _interpolate_window(*pending, after)
+            pending = None
+        if center is not None:
+            pending = (labels, start, center, previous)
+            previous = anchor
+        else:
+            for pos, label in zip(positions, labels):
+                yield ((float(pos[0]), float(pos[1])), int(label))
+            previous = _last_position(positions, labels, start, previous)
+        start += count
+    if pending is not None:
+        yield from _interpolate_window(*pending, None)
 
-    frames = get_frames(youtube_id,
-                        n_frames(youtube_id))
-    first_frame = next(frames)
-    # next() mutates the Iterable so we need to add the first frame back
-    all_frames = itertools.chain((first_frame,), frames)
 
-    (width, height) = (first_frame.width, first_frame.height)
-    assert width > 0 and height > 0
+def _first_position(positions: np.ndarray, labels: np.ndarray,
+                    start: int) -> Optional[Tuple[float, np.ndarray]]:
+    """The first position in a refined window, if it comes before any cut."""
+    for i, (pos, label) in enumerate(zip(positions, labels)):
+        if label == label_cut:
+            return None
+        if not np.isnan(pos[0]):
+            return (start + i, pos)
+    return None
 
-    if not os.path.exists(path_data_fn) or bust_cache:
-        def weighted_pos(im_bands: Tuple[Image.Image, ...]) -> Tuple[float, float]:
-            return weighted_average_pos(im_bands, width, height)
 
-        positions = fn.rcompose(
-            fn.pairwise,
-            fn.partial(fn.map, image_squared_difference),
-            fn.partial(fn.map, weighted_pos),
-            list
-        )(all_frames)
+def _last_position(positions: np.ndarray, labels: np.ndarray, start: int,
+                   previous: Optional[Tuple[float, np.ndarray]]) -> (
+        Optional[Tuple[float, np.ndarray]]):
+    """The last position found, after a refined window."""
+    for i in range(len(labels) - 1, -1, -1):
+        if labels[i] == label_cut:
+            return None
+        if not np.isnan(positions[i, 0]):
+            return (start + i, positions[i])
+    return previous
 
-        with open(const.path_data_fn(youtube_id), 'w') as f:
-            csv.writer(f).writerows(positions)
-        return (positions, width, height)
+
+def _interpolate_window(labels: np.ndarray, start: int, center: np.ndarray,
+                        before: Optional[Tuple[float, np.ndarray]],
+                        after: Optional[Tuple[float, np.ndarray]]) -> (
+        Iterator[Tuple[Tuple[float, float], int]]):
+    anchors = [a for a in (before, (start + (len(labels) - 1) / 2.0, center),
+                           after) if a is not None]
+    times = [t for t, _ in anchors]
+    pairs = np.arange(start, start + len(labels))
+    xs = np.interp(pairs, times, [pos[0] for _, pos in anchors])
+    ys = np.interp(pairs, times, [pos[1] for _, pos in anchors])
+    for x, y, label in zip(xs.tolist(), ys.tolist(), labels.tolist()):
+        if label == label_change:
+            yield ((x, y), label)
+        else:
+            yield ((float('NaN'), float('NaN')), label)
+
+
+def center_of_change_positions(all_frames: Iterable[np.ndarray],
+                               batch_size: int = 8,
+                               analysis_scale: int = 1,
+                               mask: Optional[np.ndarray] = None,
+                               scene_detection: bool = False,
+                               adaptive_stride: int = 1) -> (
+        Iterator[Tuple[float, float]]):
+    """Find the center of change between each consecutive pair of frames.
+
+    This is the vectorized equivalent of image_squared_difference followed by
+    weighted_average_pos.  Frames are copied into a reused batch buffer as they
+    arrive, so the input frames may themselves be reused buffers, and
+    batch_size pairs are processed at a time.
+
+    If analysis_scale is more than 1, frames are binned down by that factor
+    before differencing; positions are still in full resolution coordinates.
+    If a mask is given, it is a (height, width) array that is false for pixels
+    whose changes should be ignored.  If scene_detection is set, static pairs
+    and cuts are skipped, as in labeled_positions.  If adaptive_stride is
+    more than 1, see adaptive_positions.
+    """
+    for pos, _ in labeled_positions(all_frames, batch_size, analysis_scale,
+                                    mask, scene_detection, adaptive_stride):
+        yield pos
+
+
+def load_mask(width: int, height: int, mask_fn: Optional[str] = None,
+              excluded_boxes: Iterable[const.BoundingBox] = ()) -> (
+        Optional[np.ndarray]):
+    """Build a static mask of the parts of the frame to analyze.
+
+    Args:
+        mask_fn: an image the size of a frame; black pixels are excluded.
+        excluded_boxes: (left, top, right, bottom) regions to exclude, for
+            instance the color palette at the edge of the screen.
+
+    Return:
+        a (height, width) bool array, or None if nothing is excluded.
+    """
+    excluded_boxes = list(excluded_boxes)
+    if mask_fn is None and not excluded_boxes:
+        return None
+    mask = np.ones((height, width), dtype=bool)
+    if mask_fn is not None:
+        from PIL import Image
+        im = Image.open(mask_fn).convert('L').resize((width, height))
+        mask &= np.asarray(im) > 0
+    for left, top, right, bottom in excluded_boxes:
+        mask[top:bottom, left:right] = False
+    return mask
+
+
+def parse_box(box_str: str) -> const.BoundingBox:
+    """Parse a "left,top,right,bottom" string, as given on the command line."""
+    left, top, right, bottom = (int(c) for c in box_str.split(','))
+    return (left, top, right, bottom)
+
+
+def check_analysis_scale(analysis_scale: int) -> int:
+    """Raise ValueError if frames can't be binned down by analysis_scale."""
+    if not 1 <= analysis_scale <= max_analysis_scale:
+        raise ValueError('the analysis scale must be from 1 to %d, not %d' % (
+            max_analysis_scale, analysis_scale))
+    return analysis_scale
+
+
+def parse_analysis_scale(scale_str: str) -> int:
+    """Parse an analysis scale, as given on the command line."""
+    return check_analysis_scale(int(scale_str))
+
+
+def analysis_settings(analysis_scale: int, mask: Optional[np.ndarray],
+                      adaptive_stride: int = 1,
+                      scene_detection: bool = True) -> Dict[str, Any]:
+    """A summary of the analysis options, to check cached path data against."""
+    check_analysis_scale(analysis_scale)
+    settings = {
+        'analysis_scale': analysis_scale,
+        'mask': (None if mask is None else
+                 hashlib.sha1(np.packbits(mask).tobytes()).hexdigest()),
+        'scene_detection': ([thumbnail_scale, static_threshold, cut_level,
+                             cut_fraction] if scene_detection else None),
+    }  # type: Dict[str, Any]
+    # Only adaptive analyses have this, so that other path data stays cached.
+    # Their windows start afresh at each chunk (see stream_chunks).
+    if adaptive_stride > 1:
+        settings['adaptive'] = [adaptive_stride, refine_energy,
+                                refine_distance, chunk_frames]
+    return settings
+
+
+def chunk_positions(youtube_id: str, start_frame: int,
+                    frame_count: Optional[int], analysis_scale: int = 1,
+                    mask: Optional[np.ndarray] = None,
+                    adaptive_stride: int = 1) -> (
+        List[Tuple[float, float]]):
+    """Find the center of change for a range of frames.
+
+    This reads frame_count frames (or to the end of the video, if None), so
+    returns one fewer position than that.
+    """
+    return list(center_of_change_positions(
+        frames.get_frames(youtube_id, frame_count, start_frame),
+        analysis_scale=analysis_scale, mask=mask,
+        adaptive_stride=adaptive_stride))
+
+
+def stream_chunks(youtube_id: str, start_frame: int, analysis_scale: int = 1,
+                  mask: Optional[np.ndarray] = None,
+                  adaptive_stride: int = 1,
+                  scene_detection: bool = True) -> (
+        Iterator[checkpoint.Chunk]):
+    """Find the center of change from start_frame on, chunk_frames at a time.
+
+    The frames are decoded in a single pass, but each chunk is analyzed on
+    its own, as parallel_chunks analyzes them: with an adaptive_stride, the
+    analysis of a window depends on the windows before and after it, so this
+    keeps the path data the same however it was computed (and wherever a
+    checkpoint was resumed).  Each chunk carries the crc of the frame that
+    ends it, for the checkpoint file, and the scene labels of its pairs.
+    """
+    all_frames = frames.get_frames(youtube_id, None, start_frame)
+    first_frame = next(all_frames, None)
+    start = start_frame
+    while first_frame is not None:
+        # Consecutive chunks share a frame.  It is the last frame read, so is
+        # still valid even in a reused buffer.
+        chunk, first_frame = _analyze_chunk(
+            start, itertools.chain([first_frame], itertools.islice(
+                all_frames, chunk_frames)),
+            analysis_scale, mask, adaptive_stride, scene_detection)
+        if not chunk.positions:
+            return
+        yield chunk
+        start += len(chunk.positions)
+
+
+def _analyze_chunk(start_frame: int, all_frames: Iterable[np.ndarray],
+                   analysis_scale: int, mask: Optional[np.ndarray],
+                   adaptive_stride: int, scene_detection: bool) -> (
+        Tuple[checkpoint.Chunk, Optional[np.ndarray]]):
+    """Find the center of change for the frames of one chunk.
+
+    Return the chunk, and its last frame.
+    """
+    last_frame = [None]  # type: List[Optional[np.ndarray]]
+
+    def tracked_frames() -> Iterator[np.ndarray]:
+        for frame in all_frames:
+            last_frame[0] = frame
+            yield frame
+
+    chunk = list(labeled_positions(
+        tracked_frames(), analysis_scale=analysis_scale, mask=mask,
+        scene_detection=scene_detection, adaptive_stride=adaptive_stride))
+    end_crc = checkpoint.frame_crc(last_frame[0]) if chunk else 0
+    return (checkpoint.Chunk(start_frame, [pos for pos, _ in chunk], end_crc,
+                             [label for _, label in chunk]),
+            last_frame[0])
+
+
+def _read_chunk(args: Tuple[Any, ...]) -> checkpoint.Chunk:
+    """Find the center of change for one chunk, reading its own frames."""
+    (youtube_id, start_frame, frame_count, analysis_scale, mask,
+     adaptive_stride, scene_detection) = args
+    chunk, _ = _analyze_chunk(
+        start_frame, frames.get_frames(youtube_id, frame_count, start_frame),
+        analysis_scale, mask, adaptive_stride, scene_detection)
+    return chunk
+
+
+def parallel_chunks(youtube_id: str, start_frame: int, workers: int,
+                    analysis_scale: int = 1,
+                    mask: Optional[np.ndarray] = None,
+                    adaptive_stride: int = 1,
+                    scene_detection: bool = True) -> (
+        Iterator[checkpoint.Chunk]):
+    """Find the center of change from start_frame on using a process pool.
+
+    The video is split into chunks of chunk_frames frame pairs, each of which
+    reads its own frames (seeking into the video, or from the png cache).
+    Consecutive chunks overlap by one frame so that no pair is missed.  The
+    last chunk reads to the end of the video, since the frame count we plan
+    with may be an estimate.  If the estimate runs long, the chunks past the
+    end come back short or empty, and are dropped.  Chunks are yielded in
+    order.
+    """
+    estimated_count = frames.count_frames(youtube_id) or 0
+    starts = list(range(start_frame, max(estimated_count - 1, start_frame + 1),
+                        chunk_frames))
+    tasks = [(youtube_id, start, chunk_frames + 1, analysis_scale, mask,
+              adaptive_stride, scene_detection) for start in starts]
+    tasks[-1] = (youtube_id, starts[-1], None, analysis_scale, mask,
+                 adaptive_stride, scene_detection)
+    with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+        for chunk in executor.map(_read_chunk, tasks):
+            if not chunk.positions:
+                return
+            yield chunk
+            if len(chunk.positions) < chunk_frames:
+                return
+
+
+def verify_checkpoint(youtube_id: str,
+                      path_checkpoint: checkpoint.PathCheckpoint) -> None:
+    """Drop chunks from the end of the checkpoint that don't match the video.
+
+    This assumes that if the video has changed, it has changed at the end (or
+    has had frames added), so stops at the first chunk that still matches.
+    """
+    while path_checkpoint.chunks:
+        last = path_checkpoint.chunks[-1]
+        end_frame = next(frames.get_frames(
+            youtube_id, 1, last.start_frame + len(last.positions)), None)
+        if (end_frame is not None and
+                checkpoint.frame_crc(end_frame) == last.end_frame_crc):
+            break
+        path_checkpoint.drop_last_chunk()
+    path_checkpoint.mark_current()
+
+
+def path_params(youtube_id: str, analysis_scale: int,
+                mask: Optional[np.ndarray], adaptive_stride: int = 1,
+                scene_detection: bool = True) -> Dict[str, Any]:
+    """The cache key parameters for the path data of a video."""
+    params = cache.frame_params(youtube_id)
+    params.update(analysis_settings(analysis_scale, mask, adaptive_stride,
+                                    scene_detection))
+    return params
+
+
+def seed_checkpoint(youtube_id: str, params: Dict[str, Any],
+                    checkpoint_fn: str) -> None:
+    """Start from the checkpoint for an earlier version of the same video.
+
+    If the video has been replaced by one that differs only at the end, or has
+    had frames added, verify_checkpoint keeps everything before the change.
+    Checkpoints from other versions of the path stage are never used.
+    """
+    def same_settings(meta):
+        return (meta['version'] == cache.stage_versions['path'] and
+                all(meta['params'].get(k) == v
+                    for k, v in params.items() if k != 'video'))
+
+    for meta in cache.find_entries('path', youtube_id):
+        previous_fn = os.path.join(cache.entry_dir(meta['key']),
+                                   checkpoint_basename)
+        if same_settings(meta) and os.path.exists(previous_fn):
+            shutil.copyfile(previous_fn, checkpoint_fn)
+            return
+
+
+def compute_path_data(youtube_id: str, entry: str, workers: int = 1,
+                      analysis_scale: int = 1,
+                      mask: Optional[np.ndarray] = None,
+                      adaptive_stride: int = 1,
+                      scene_detection: bool = True) -> np.ndarray:
+    """Find the center of change for every frame, writing into a cache entry.
+
+    Positions are checkpointed as they are computed, so if this is
+    interrupted, or the video changes at the end, a rerun only computes the
+    frames that are missing.
+    """
+    params = path_params(youtube_id, analysis_scale, mask, adaptive_stride,
+                         scene_detection)
+    checkpoint_fn = os.path.join(entry, checkpoint_basename)
+    if not os.path.exists(checkpoint_fn):
+        seed_checkpoint(youtube_id, params, checkpoint_fn)
+    path_checkpoint = checkpoint.PathCheckpoint(
+        checkpoint_fn, const.frame_width, const.frame_height,
+        analysis_settings(analysis_scale, mask, adaptive_stride,
+                          scene_detection),
+        checkpoint.video_stamp(youtube_id))
+    if path_checkpoint.is_stale():
+        verify_checkpoint(youtube_id, path_checkpoint)
+    if adaptive_stride > 1 and path_checkpoint.next_frame() % chunk_frames:
+        # The last chunk was cut short by the end of the video, so its last
+        # window was interpolated without the one after it.  Analyze it again
+        # with whatever follows, as a run from scratch would.
+        path_checkpoint.drop_last_chunk()
+
+    start_frame = path_checkpoint.next_frame()
+    instrument.count('frames_computed', 0)
+    total = frames.count_frames(youtube_id)
+    if workers > 1:
+        chunks = parallel_chunks(youtube_id, start_frame, workers,
+                                 analysis_scale, mask, adaptive_stride,
+                                 scene_detection)
     else:
-        with open(const.path_data_fn(youtube_id), 'r') as f:
-            return ([(float(line[0]), float(line[1])) for line in csv.reader(f)], width, height)
+        chunks = stream_chunks(youtube_id, start_frame, analysis_scale, mask,
+                               adaptive_stride, scene_detection)
+    for chunk in chunks:
+        path_checkpoint.append(*chunk)
+        instrument.count('frames_computed', len(chunk.positions))
+        instrument.progress(path_checkpoint.next_frame(), total)
+    if path_checkpoint.next_frame() > start_frame:
+        instrument.count('bytes_read',
+                         os.path.getsize(const.video_fn(youtube_id)))
+    positions = np.array(path_checkpoint.positions(),
+                         dtype=float).reshape((-1, 2))
+
+    array_file.write_path(os.path.join(entry, path_array_basename), positions,
+                          const.frame_width, const.frame_height)
+    array_file.write_labels(os.path.join(entry, path_labels_basename),
+                            path_checkpoint.labels(),
+                            const.frame_width, const.frame_height)
+    # The csv is only exported for other tools to read.
+    with open(os.path.join(entry, path_data_basename), 'w') as f:
+        csv.writer(f).writerows(positions.tolist())
+    instrument.count('bytes_written', cache._dir_size(entry))
+    return positions
+
+
+def main(youtube_id: str, bust_cache: bool = False, workers: int = 1,
+         analysis_scale: int = 1, mask: Optional[np.ndarray] = None,
+         adaptive_stride: int = 1,
+         scene_detection: bool = True) -> Tuple[np.ndarray, int, int]:
+    """Read in the frames of the video, find the center of change.
+
+    Writes out x,y positions as an array file (and a csv), one row per frame,
+    and the scene label of each row as another array file.
+    If workers is more than 1, the frames are processed in parallel chunks.
+    Unless scene_detection is unset, static pairs and scene cuts are found
+    first, and given NaN positions (see labeled_positions).
+    The path data is cached by the video's contents and the analysis options,
+    and const.path_array_fn, const.path_labels_fn and const.path_data_fn are
+    linked to the current version.
+
+    Return:
+        the (n, 2) array of positions, memory mapped if it was cached, and the
+        video width and height.
+    """
+    params = path_params(youtube_id, analysis_scale, mask, adaptive_stride,
+                         scene_detection)
+    entry = cache.lookup('path', params)
+    if entry is not None and bust_cache:
+        cache.remove(entry)
+        entry = None
+
+    if entry is None:
+        entry = cache.open_entry('path', params, youtube_id)
+        positions = compute_path_data(youtube_id, entry, workers,
+                                      analysis_scale, mask, adaptive_stride,
+                                      scene_detection)
+        cache.finish(entry)
+    else:
+        _, positions = array_file.open_array(
+            os.path.join(entry, path_array_basename), 'path')
+
+    cache.link(os.path.join(entry, path_array_basename),
+               const.path_array_fn(youtube_id))
+    cache.link(os.path.join(entry, path_labels_basename),
+               const.path_labels_fn(youtube_id))
+    cache.link(os.path.join(entry, path_data_basename),
+               const.path_data_fn(youtube_id))
+    return (positions, const.frame_width, const.frame_height)
@@ -0,0 +1,155 @@
+"""Per-stage timing and resource use.
+
+Code marks out the stages of the pipeline with `with instrument.stage(name):`,
+and reports what it has processed with `count` and `progress`.  These do
+nothing unless a Recorder is active (see `recording`), in which case each
+stage records
+
+    wall and cpu time (cpu time includes that of subprocesses, like ffmpeg,
+        that finished during the stage)
+    the peak resident memory of this process, and of the largest
+        subprocess, so far
+    counts like frames processed and bytes read or written
+
+A stage can also be run under cProfile.
+"""
+import contextlib
+import cProfile
+import resource
+import sys
+import time
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional
+
+ProgressCallback = Callable[[str, int, Optional[int]], None]
+
+# The least time between progress callbacks for a stage, in seconds.
+progress_interval = 5.0
+
+_recorder = None  # type: Optional[Recorder]
+
+
+class Recorder(object):
+    """Collects a record of each stage as it finishes."""
+
+    def __init__(self, progress: Optional[ProgressCallback] = None,
+                 profile_stages: Iterable[str] = (),
+                 profile_fn_template: str = '%s.prof') -> None:
+        """
+        Args:
+            progress: called with the stage name, the amount done, and the
+                total (if known) as long stages progress.
+            profile_stages: the names of stages to run under cProfile.  The
+                stats are written to profile_fn_template % the stage name.
+        """
+        self.progress = progress
+        self.profile_stages = set(profile_stages)
+        self.profile_fn_template = profile_fn_template
+        self.stages = []  # type: List[Dict[str, Any]]
+        self._stack = []  # type: List[Dict[str, Any]]
+        self._last_progress = 0.0
+
+    def to_json(self) -> Dict[str, Any]:
+        return {
+            'stages': self.stages,
+            'seconds': sum(s['seconds'] for s in self.stages
+                           if s['parent'] is None),
+            'peak_rss_bytes': max(
+                [s['peak_rss_bytes'] for s in self.stages] or [None]),
+        }
+
+
+@contextlib.contextmanager
+def recording(recorder: Recorder) -> Iterator[Recorder]:
+    """Record the stages run in this block."""
+    global _recorder
+    previous = _recorder
+    _recorder = recorder
+    try:
+        yield recorder
+    finally:
+        _recorder = previous
+
+
+def _peak_rss_bytes(who: int) -> int:
+    # ru_maxrss is in kilobytes on linux, but bytes on macOS.
+    scale = 1 if sys.platform == 'darwin' else 1024
+    return resource.getrusage(who).ru_maxrss * scale
+
+
+def _children_cpu_seconds() -> float:
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+@contextlib.contextmanager
+def stage(name: str) -> Iterator[None]:
+    """Record a stage of the pipeline, if recording."""
+    recorder = _recorder
+    if recorder is None:
+        yield
+        return
+    record = {
+        'stage': name,
+        'parent': recorder._stack[-1]['stage'] if recorder._stack else None,
+        'counts': {},
+    }  # type: Dict[str, Any]
+    recorder._stack.append(record)
+    profile = None
+    if name in recorder.profile_stages:
+        profile = cProfile.Profile()
+        profile.enable()
+    start = time.perf_counter()
+    start_cpu = time.process_time()
+    start_children_cpu = _children_cpu_seconds()
+    try:
+        yield
+    finally:
+        record['seconds'] = time.perf_counter() - start
+        record['cpu_seconds'] = time.process_time() - start_cpu
+        record['subprocess_cpu_seconds'] = (
+            _children_cpu_seconds() - start_children_cpu)
+        record['peak_rss_bytes'] = _peak_rss_bytes(resource.RUSAGE_SELF)
+        record['subprocess_peak_rss_bytes'] = _peak_rss_bytes(
+            resource.RUSAGE_CHILDREN)
+        if profile is not None:
+            profile.disable()
+            record['profile'] = recorder.profile_fn_template % name
+            profile.dump_stats(record['profile'])
+        frames = record['counts'].get('frames')
+        if frames is not None and record['seconds'] > 0:
+            record['frames_per_second'] = frames / record['seconds']
+        recorder._stack.pop()
+        recorder.stages.append(record)
+
+
+def count(key: str, amount: float = 1) -> None:
+    """Add to a count (like 'frames' or 'bytes_read') for the current stage."""
+    if _recorder is None or not _recorder._stack:
+        return
+    counts = _recorder._stack[-1]['counts']
+    counts[key] = counts.get(key, 0) + amount
+
+
+def progress(done: int, total: Optional[int] = None) -> None:
+    """Report how far through the current stage we are.
+
+    The progress callback is called at most every progress_interval seconds.
+    """
+    recorder = _recorder
+    if recorder is None or recorder.progress is None or not recorder._stack:
+        return
+    now = time.time()
+    if now - recorder._last_progress < progress_interval:
+        return
+    recorder._last_progress = now
+    recorder.progress(recorder._stack[-1]['stage'], done, total)
+
+
+def print_progress(stage_name: str, done: int, total: Optional[int]) -> None:
+    """A progress callback that writes a line to stderr."""
+    if total:
+        sys.stderr.write('%s: %d/%d (%.0f%%)\n' % (
+            stage_name, done, total, 100.0 * done / total))
+    else:
+        sys.stderr.write('%s: %d\n' % (stage_name, done))
+    sys.stderr.flush()
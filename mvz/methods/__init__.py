@@ -0,0 +1,27 @@
+"""The methods for choosing boxes from the path data.
+
+Each method is a module with main, boxes_for_path_array and render_boxes
+functions, and a settings context that overrides the module settings named in
+its setting_names.  They are only imported when used, since they pull in heavy
+dependencies (scipy, pandas) that a run with cached boxes doesn't need.
+"""
+import importlib
+from typing import Any, List
+
+# Method name -> module.
+registry = {
+    'bandpass_and_snapping': 'mvz.methods.bandpass_and_snapping',
+    'ewma': 'mvz.methods.ewma',
+}
+
+
+def names() -> List[str]:
+    return sorted(registry)
+
+
+def get(name: str) -> Any:
+    """Import and return the module for a method."""
+    if name not in registry:
+        raise ValueError('unknown method %r (expected one of %s)' % (
+            name, ', '.join(names())))
+    return importlib.import_module(registry[name])
@@ -1,143 +1,234 @@
 """Bandpass filter the positions, then snap to as few shots as possible."""
-from typing import Any, List, Optional, Tuple
+import functools
+import sys
+from typing import (TYPE_CHECKING, Any, ContextManager, List, Optional,
+                    Sequence, Tuple)
 
 import funcy as fn
 import numpy as np
-import pandas as pd
-import scipy.signal as sig
-import scipy.stats as stats
 
+from mvz import array_file
 from mvz import const
 from mvz.methods import shared
 from mvz.methods.shared import FrameSpecOutput
 
+if TYPE_CHECKING:
+    import pandas as pd
+
 anticipation_time = 30
 freq_cutoff = 0.05
 padding = 80
 initial_offset = 0
 
+# The settings above that change the boxes, which settings can override.
+setting_names = ('anticipation_time', 'freq_cutoff', 'padding',
+                 'initial_offset')
+
+
+def scene_bounds(row_count: int,
+                 cuts: Sequence[int] = ()) -> List[Tuple[int, int]]:
+    """The (start, stop) rows of each scene, given the rows that start one."""
+    starts = [0] + [cut for cut in cuts if 0 < cut < row_count]
+    return list(zip(starts, starts[1:] + [row_count]))
+
+
+def settings(**values: Any) -> ContextManager[None]:
+    """Override this module's settings (like padding) within the block.
+
+    See shared.override_settings.
+    """
+    return shared.override_settings(sys.modules[__name__], values)
+
+
+@functools.lru_cache(maxsize=None)
+def filter_coefficients(cutoff: float) -> Tuple[np.ndarray, np.ndarray]:
+    """The (b, a) coefficients of the lowpass filter for a cutoff."""
+    # scipy takes a long time to import, and isn't needed when the boxes are
+    # cached, so it is imported in the functions that use it.
+    import scipy.signal as sig
+    return sig.butter(6, cutoff)
 
-def bandpass_filter_data(data: pd.DataFrame) -> Tuple[np.ndarray, np.ndarray]:
-    """Lowpass filter the supplied x, y data."""
-    b, a = sig.butter(6, freq_cutoff)
-    x_filt = sig.lfilter(b, a, data['x'])
-    y_filt = sig.lfilter(b, a, data['y'])
-    return (x_filt, y_filt)
 
+def bandpass_filter_data(data: 'pd.DataFrame',
+                         cuts: Sequence[int] = ()) -> (
+        Tuple[np.ndarray, np.ndarray]):
+    """Lowpass filter the supplied x, y data.
+
+    The filter starts again at each cut, settled on the first position of the
+    new scene, so the box doesn't drift across from where the last one was.
+    """
+    filtered = filter_positions(
+        np.column_stack([np.asarray(data['x'], dtype=float),
+                         np.asarray(data['y'], dtype=float)]), cuts)
+    return (filtered[:, 0], filtered[:, 1])
+
+
+def filter_positions(positions: np.ndarray,
+                     cuts: Sequence[int] = ()) -> np.ndarray:
+    """Lowpass filter an (n, 2) array of x, y positions, both at once."""
+    import scipy.signal as sig
+    b, a = filter_coefficients(freq_cutoff)
+    if len(cuts) == 0:
+        return sig.lfilter(b, a, positions, axis=0)
+    zi = sig.lfilter_zi(b, a)[:, np.newaxis]
+    out = np.empty_like(positions)
+    for start, stop in scene_bounds(len(positions), cuts):
+        if start == 0:
+            out[start:stop] = sig.lfilter(b, a, positions[start:stop], axis=0)
+        else:
+            out[start:stop], _ = sig.lfilter(
+                b, a, positions[start:stop], axis=0,
+                zi=zi * positions[start])
+    return out
 
-def choose_window(seq: np.ndarray, window_size: int) -> Tuple[float, int]:
+
+def choose_window(seq: np.ndarray, window_size: int,
+                  start: int = 0) -> Tuple[float, int]:
     """Find the maximum length time window until action exits the box.
 
-    Returns a tuple of the minimum value in the box and the number of frames to
-    stay in that box.
+    The window starts at index start of seq.  Returns a tuple of the minimum
+    value in the box and the number of frames to stay in that box.
+
+    NaN values are ignored, and the maximum never drops below zero.  We scan in
+    blocks of doubling size, so the work done is proportional to the length of
+    the window.
     """
-    prev_min = 0.0
+    seq = np.asarray(seq, dtype=float)
     minval = float('Infinity')
     maxval = 0.0
-    index = -1
-    while (maxval - minval) < window_size:
-        index += 1
-        prev_min = minval
-        if index == len(seq):
-            break
-        minval = min(minval, seq[index])
-        maxval = max(maxval, seq[index])
-    return (prev_min, index)
+    block_start = start
+    block_size = 64
+    while block_start < len(seq):
+        block = seq[block_start:block_start + block_size]
+        mins = np.minimum(np.minimum.accumulate(np.fmin(block, np.inf)),
+                          minval)
+        maxes = np.maximum(np.maximum.accumulate(np.fmax(block, 0.0)), maxval)
+        outside = np.flatnonzero(~(maxes - mins < window_size))
+        if len(outside) > 0:
+            index = outside[0]
+            prev_min = mins[index - 1] if index > 0 else minval
+            return (prev_min, block_start + index - start)
+        minval = mins[-1]
+        maxval = maxes[-1]
+        block_start += len(block)
+        block_size *= 2
+    return (minval, len(seq) - start)
 
 
 FrameSpec = List[Tuple[float, int]]
 
 
+def clamp_window_start(start: float, box_size: int, max_size: int) -> float:
+    """Keep a window's box inside the video."""
+    if start < 0:
+        start = 0
+    if start > max_size - box_size:
+        start = max_size - box_size
+    return start
+
+
 def make_frame_specs(x_filt: np.ndarray, y_filt: np.ndarray,
-                     video_width: int, video_height: int) -> (
+                     video_width: int, video_height: int,
+                     cuts: Sequence[int] = (),
+                     box_width: int = const.box_width,
+                     box_height: int = const.box_height) -> (
         Tuple[FrameSpec, FrameSpec]):
+    """Choose the windows for each axis.
+
+    No window spans a cut: each scene gets windows of its own.
+    """
 
     def make_spec(seq: np.ndarray, box_size: int, max_size: int) -> FrameSpec:
+        seq = np.asarray(seq, dtype=float)
         frames = []
-        while len(seq) > 0:
-            start, idx = choose_window(seq, box_size - padding)
-            if start < 0:
-                start = 0
-            if start > max_size - box_size:
-                start = max_size - box_size
-            frames.append((start, idx))
-            seq = seq[idx:]
+        frame = 0
+        while frame < len(seq):
+            start, idx = choose_window(seq, box_size - padding, frame)
+            # A single point can only be too far out for any window if it's
+            # far below zero; take it on its own rather than stalling.
+            idx = max(idx, 1)
+            frames.append((clamp_window_start(start, box_size, max_size),
+                           idx))
+            frame += idx
         return frames
 
-    x_frames = make_spec(x_filt[initial_offset:],
-                         const.box_width,
-                         video_width)
-    y_frames = make_spec(y_filt[initial_offset:],
-                         const.box_height,
-                         video_height)
+    def make_scene_specs(seq: np.ndarray, box_size: int,
+                         max_size: int) -> FrameSpec:
+        return fn.lcat(make_spec(seq[start:stop], box_size, max_size)
+                       for start, stop in scene_bounds(
+                           len(seq), [cut - initial_offset for cut in cuts]))
+
+    x_frames = make_scene_specs(x_filt[initial_offset:],
+                                box_width,
+                                video_width)
+    y_frames = make_scene_specs(y_filt[initial_offset:],
+                                box_height,
+                                video_height)
 
     return x_frames, y_frames
 
 
+def key_frames_for_spec(spec: FrameSpec) -> np.ndarray:
+    """The frame at which each window of the spec starts."""
+    lengths = np.array([length for _, length in spec], dtype=int)
+    return np.concatenate([[0], np.cumsum(lengths)[:-1]]).astype(int)
+
+
+def spec_positions(spec: FrameSpec, frames: np.ndarray,
+                   box_size: int, max_size: int) -> np.ndarray:
+    """The left (or top) edge of the box at each frame, for one axis."""
+    key_frames = key_frames_for_spec(spec)
+    starts = np.array([start for start, _ in spec], dtype=float)
+    return box_edges(
+        starts[np.searchsorted(key_frames, frames, side='right') - 1],
+        box_size, max_size)
+
+
+def box_edges(starts: np.ndarray, box_size: int,
+              max_size: int) -> np.ndarray:
+    """The left (or top) edge of the padded box for each window start."""
+    pos = np.round(starts)
+    half_padding = padding / 2
+    pos = np.where(
+        pos - half_padding < 0, half_padding,
+        np.where(pos - half_padding + box_size > max_size,
+                 max_size - box_size + half_padding, pos))
+    return np.round(pos - half_padding).astype(int)
+
+
 def make_boxes_from_frame_spec(min_frame: int, max_frame: int,
                                xspec: FrameSpec, yspec: FrameSpec,
                                video_width: int, video_height: int,
-                               keyframes_only: bool = False) -> (
+                               keyframes_only: bool = False,
+                               box_width: int = const.box_width,
+                               box_height: int = const.box_height) -> (
                                    FrameSpecOutput):
-    key_frames_x = [0] + list(fn.sums([frame for _, frame in xspec]))[:-1]
-    key_frames_y = [0] + list(fn.sums([frame for _, frame in yspec]))[:-1]
-
-    all_keyframes = list(sorted(list(
-        set(key_frames_x).union(set(key_frames_y)))))
-
-    @fn.autocurry
-    def key_frame_index(key_frames, frame):
-        for ki, k in enumerate(key_frames):
-            if k > frame:
-                return ki - 1
-        return len(key_frames) - 1
-
-    @fn.autocurry
-    def ensure_in_range(size, maxval, pos):
-        if pos - padding/2 < 0:
-            pos = padding/2
-        elif pos - padding/2 + size > maxval:
-            pos = maxval - size + padding/2
-        return pos
-
-    frame_pos_x_fn = fn.rcompose(
-        fn.partial(fn.map,
-                   key_frame_index(key_frames_x)),
-        fn.partial(fn.map, lambda key_idx: int(round(xspec[key_idx][0]))),
-        fn.partial(fn.map,
-                   ensure_in_range(const.box_width, video_width)))
-
-    frame_pos_y_fn = fn.rcompose(
-        fn.partial(fn.map,
-                   key_frame_index(key_frames_y)),
-        fn.partial(fn.map, lambda key_idx: int(round(yspec[key_idx][0]))),
-        fn.partial(fn.map,
-                   ensure_in_range(const.box_height, video_height)))
+    if keyframes_only:
+        frames = np.union1d(key_frames_for_spec(xspec),
+                            key_frames_for_spec(yspec))
+    else:
+        frames = np.arange(min_frame, max_frame)
+
+    boxes = box_array_for_frames(frames, xspec, yspec, video_width,
+                                 video_height, box_width, box_height).tolist()
 
     if keyframes_only:
-        frame_pos_x = frame_pos_x_fn(all_keyframes)
-        frame_pos_y = frame_pos_y_fn(all_keyframes)
-        return [
-            (float(frame) / len(range(min_frame, max_frame)),) +
-            shared.tuple4(tuple(
-                int(round(coord))
-                for coord in (pos_x - padding/2,
-                              pos_y - padding/2,
-                              pos_x - padding/2 + const.box_width,
-                              pos_y - padding/2 + const.box_height)
-            )) for frame, pos_x, pos_y in zip(all_keyframes, frame_pos_x,
-                                              frame_pos_y)]
+        times = (frames / len(range(min_frame, max_frame))).tolist()
+        return [(time,) + shared.tuple4(box)
+                for time, box in zip(times, boxes)]
     else:
-        frame_pos_x = frame_pos_x_fn(range(min_frame, max_frame))
-        frame_pos_y = frame_pos_y_fn(range(min_frame, max_frame))
+        return [shared.tuple4(box) for box in boxes]
+
 
-        return [shared.tuple4(tuple(
-            int(round(coord))
-            for coord in (pos_x - padding/2,
-                          pos_y - padding/2,
-                          pos_x - padding/2 + const.box_width,
-                          pos_y - padding/2 + const.box_height)
-            )) for pos_x, pos_y in zip(frame_pos_x, frame_pos_y)]
+def box_array_for_frames(frames: np.ndarray, xspec: FrameSpec,
+                         yspec: FrameSpec, video_width: int,
+                         video_height: int,
+                         box_width: int = const.box_width,
+                         box_height: int = const.box_height) -> np.ndarray:
+    """The (len(frames), 4) array of the box for each of frames."""
+    left = spec_positions(xspec, frames, box_width, video_width)
+    top = spec_positions(yspec, frames, box_height, video_height)
+    return np.stack([left, top, left + box_width, top + box_height], axis=1)
 
 
 def distance_to_next_change(boxes: List[Any], idx: int) -> Optional[int]:
@@ -152,6 +243,7 @@ def distance_to_next_change(boxes: List[Any], idx: int) -> Optional[int]:
 
 
 def _interpolate1(start_coord: int, finish_coord: int, distance: int) -> int:
+    import scipy.stats as stats
     mean = float(anticipation_time) / 2
     scale = anticipation_time / 6
     frac = stats.norm.cdf(anticipation_time - distance, loc=mean, scale=scale)
@@ -165,38 +257,136 @@ def interpolate(start_box: const.BoundingBox, finish_box: const.BoundingBox,
         for start_coord, final_coord in zip(start_box, finish_box)))
 
 
+def anticipation_ramp() -> np.ndarray:
+    """The fraction of the way to the next box, indexed by frames elapsed.
+
+    Entry anticipation_time - distance is what _interpolate1 uses for a frame
+    distance frames before the change.
+    """
+    import scipy.stats as stats
+    mean = float(anticipation_time) / 2
+    scale = anticipation_time / 6
+    return stats.norm.cdf(np.arange(anticipation_time), loc=mean, scale=scale)
+
+
 def anticipate_changes(
-        boxes: List[const.BoundingBox]) -> List[const.BoundingBox]:
-    should_anticipate = [
-        idx < len(boxes) - anticipation_time and
-        boxes[idx] != boxes[idx + anticipation_time]
-        for idx in range(len(boxes))]
-
-    new_boxes = []
-    for i, box in enumerate(boxes):
-        if should_anticipate[i]:
-            dist = distance_to_next_change(boxes, i)
-            result = interpolate(
-                box, boxes[i + dist], dist)
-        else:
-            result = box
-        new_boxes.append(result)
+        boxes: List[const.BoundingBox],
+        cuts: Sequence[int] = ()) -> List[const.BoundingBox]:
+    """Pan smoothly towards each new box in the frames leading up to it.
+
+    A change at a cut (a frame that starts a new scene) is not anticipated:
+    the box jumps with the scene.
+    """
+    if len(boxes) == 0:
+        return []
+    return [shared.tuple4(box) for box in anticipate_box_array(
+        np.array(boxes, dtype=np.int64), cuts).tolist()]
+
+
+def anticipate_box_array(box_array: np.ndarray,
+                         cuts: Sequence[int] = ()) -> np.ndarray:
+    """anticipate_changes, for an (n, 4) array of boxes."""
+    count = len(box_array)
+    # A box never differs from itself, so no anticipation_time means no ramps.
+    if count == 0 or anticipation_time == 0:
+        return box_array.copy()
+    index = np.arange(count)
+
+    # The next frame whose box differs from this one's, from a reverse scan.
+    change_frames = np.full(count + 1, count)
+    changed = np.any(box_array[1:] != box_array[:-1], axis=1)
+    change_frames[1:-1][changed] = index[1:][changed]
+    next_change = np.minimum.accumulate(change_frames[:0:-1])[::-1]
+
+    should_anticipate = np.zeros(count, dtype=bool)
+    if count > anticipation_time:
+        should_anticipate[:-anticipation_time] = np.any(
+            box_array[anticipation_time:] != box_array[:-anticipation_time],
+            axis=1)
+    if len(cuts) > 0:
+        at_cut = np.zeros(count + 1, dtype=bool)
+        at_cut[[cut for cut in cuts if 0 < cut < count]] = True
+        should_anticipate &= ~at_cut[next_change]
+
+    start = box_array[should_anticipate]
+    finish = box_array[next_change[should_anticipate]]
+    distance = next_change[should_anticipate] - index[should_anticipate]
+    frac = anticipation_ramp()[anticipation_time - distance]
+    new_boxes = box_array.copy()
+    new_boxes[should_anticipate] = np.round(
+        start + (finish - start) * frac[:, np.newaxis])
     return new_boxes
 
 
+def boxes_for_path_data(data: 'pd.DataFrame', frame_count: int,
+                        video_width: int, video_height: int,
+                        keyframes_only: bool = False,
+                        cuts: Sequence[int] = (),
+                        box_size: const.BoxSize = const.box_size) -> (
+        FrameSpecOutput):
+    """Compute the boxes for already loaded path data.
+
+    cuts are the rows of data that start a new scene.
+    """
+    return boxes_for_sizes(data, frame_count, video_width, video_height,
+                           [box_size], keyframes_only, cuts)[0]
+
+
+def boxes_for_sizes(data: 'pd.DataFrame', frame_count: int,
+                    video_width: int, video_height: int,
+                    box_sizes: Sequence[const.BoxSize],
+                    keyframes_only: bool = False,
+                    cuts: Sequence[int] = ()) -> List[FrameSpecOutput]:
+    """Compute the boxes at each of several box sizes.
+
+    The path is only filtered once; only the snapping depends on the size.
+    """
+    x_filt, y_filt = bandpass_filter_data(data, cuts)
+    all_boxes = []
+    for box_width, box_height in box_sizes:
+        x_frames, y_frames = make_frame_specs(
+            x_filt, y_filt, video_width, video_height, cuts,
+            box_width, box_height)
+        all_boxes.append(make_boxes_from_frame_spec(
+            -initial_offset, frame_count - initial_offset,
+            x_frames, y_frames,
+            video_width, video_height,
+            keyframes_only=keyframes_only,
+            box_width=box_width, box_height=box_height))
+    return all_boxes
+
+
+def boxes_for_path_array(positions: np.ndarray, frame_count: int,
+                         video_width: int, video_height: int,
+                         keyframes_only: bool = False,
+                         box_sizes: Sequence[const.BoxSize] = (
+                             const.box_size,),
+                         cuts: Sequence[int] = ()) -> List[FrameSpecOutput]:
+    """Compute the boxes at each of box_sizes from (n, 2) raw path data."""
+    import pandas as pd
+    data = shared.clean_path_data(
+        pd.DataFrame(np.array(positions, dtype=float), columns=['x', 'y']),
+        cuts)
+    return boxes_for_sizes(data, frame_count, video_width, video_height,
+                           box_sizes, keyframes_only=keyframes_only,
+                           cuts=cuts)
+
+
 def main(youtube_id: str, frame_count: int,
          video_width: int, video_height: int,
-         keyframes_only: bool = False) -> FrameSpecOutput:
-    data = shared.read_path_data(const.path_data_fn(youtube_id))
-    x_filt, y_filt = bandpass_filter_data(data)
-    x_frames, y_frames = make_frame_specs(x_filt, y_filt, video_width, video_height)
-    boxes = make_boxes_from_frame_spec(
-        -initial_offset, frame_count - initial_offset,
-        x_frames, y_frames,
-        video_width, video_height,
-        keyframes_only=keyframes_only)
-    if not keyframes_only:
-        boxes_with_smoothing = anticipate_changes(boxes)
-        shared.crop_to_bounding_boxes(youtube_id, frame_count, boxes_with_smoothing)
-
-    return boxes
+         keyframes_only: bool = False,
+         box_sizes: Sequence[const.BoxSize] = (const.box_size,)) -> (
+        List[FrameSpecOutput]):
+    """Compute the boxes at each of box_sizes from the current path data."""
+    _, positions = array_file.open_array(const.path_array_fn(youtube_id),
+                                         'path')
+    return boxes_for_path_array(
+        positions, frame_count, video_width, video_height, keyframes_only,
+        box_sizes, shared.read_cuts(const.path_labels_fn(youtube_id)))
+
+
+def render_boxes(boxes: List[const.BoundingBox],
+                 cuts: Sequence[int] = ()) -> List[const.BoundingBox]:
+    """The per-frame boxes to crop the video to: we pan ahead of each cut
+    from one box to the next, but not of a scene cut in the video."""
+    return anticipate_changes(boxes, cuts)
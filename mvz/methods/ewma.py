@@ -1,44 +1,233 @@
-from typing import Tuple
+"""Follow the center of change with an exponentially weighted moving average.
 
-import pandas as pd
+This is a much cheaper alternative to bandpass_and_snapping: the box is
+centered on the smoothed position at every frame, rather than snapped to as
+few shots as possible, so it drifts along with the action.
 
+The path data is read and smoothed a chunk at a time, carrying the smoother's
+state from one chunk to the next, so memory use doesn't grow with the length
+of the video (see stream_boxes and write_boxes).
+"""
+import sys
+from typing import Any, ContextManager, Iterator, List, Optional, Sequence
+
+import numpy as np
+
+from mvz import array_file
 from mvz import const
 from mvz.methods import shared
+from mvz.methods.shared import FrameSpecOutput
+
+# The span of the average, in frames: the weight of each position falls off as
+# (1 - 2 / (smoothing_span + 1)) per frame.
+smoothing_span = 2 * const.frame_rate
+
+# The number of rows of path data to smooth at a time.
+chunk_frames = 1 << 16
+
+# The settings above that change the boxes, which settings can override.
+setting_names = ('smoothing_span',)
+
+
+def settings(**values: Any) -> ContextManager[None]:
+    """Override this module's settings within the block.
+
+    See shared.override_settings.
+    """
+    return shared.override_settings(sys.modules[__name__], values)
+
+
+def smoothing_factor(span: float) -> float:
+    """The weight of the newest position, as for pandas' ewm(span=span)."""
+    return 2.0 / (span + 1)
+
 
-smoothing_span = 1
+def first_valid_position(positions: np.ndarray, start: int,
+                         stop: int) -> Optional[np.ndarray]:
+    """The first position in rows start to stop that survives cleaning."""
+    for chunk_start in range(start, stop, chunk_frames):
+        chunk = clean_positions(
+            positions[chunk_start:min(chunk_start + chunk_frames, stop)])
+        valid = np.flatnonzero(~np.isnan(chunk[:, 0]))
+        if len(valid) > 0:
+            return chunk[valid[0]]
+    return None
 
 
-def smooth_with_ewma(data: pd.DataFrame, window: int) -> pd.DataFrame:
-    return pd.ewma(data, span=window)
+def clean_positions(chunk: np.ndarray) -> np.ndarray:
+    """Drop outlying points, as shared.clean_path_data does."""
+    chunk = np.array(chunk, dtype=float)
+    chunk[chunk[:, 0] < shared.min_value_x] = float('NaN')
+    return chunk
 
 
-def box_for_position(pos: Tuple[int, int])-> Tuple[int, int, int, int]:
-    """Given a position, get a bounding box centered at that position.
+def fill_forward(chunk: np.ndarray, last: np.ndarray) -> np.ndarray:
+    """Replace NaN rows with the last valid row before them.
 
-    Bounding box is [left, top, right, bottom].
+    last is the row to use for NaNs at the start of the chunk.
     """
-    origin = [max(pos[0] - const.box_width/2, 0),
-              max(pos[1] - const.box_height/2, 0)]
-    if origin[0] + const.box_width > const.max_width:
-        origin[0] = const.max_width - const.box_width
-    if origin[1] + const.box_height > const.max_height:
-        origin[1] = const.max_height - const.box_height
+    valid = ~np.isnan(chunk[:, 0])
+    index = np.where(valid, np.arange(len(chunk)), -1)
+    index = np.maximum.accumulate(index)
+    return np.where((index >= 0)[:, np.newaxis], chunk[np.maximum(index, 0)],
+                    last)
 
-    return shared.tuple4(tuple(
-        int(round(coord))
-        for coord in (origin[0], origin[1],
-                      origin[0] + const.box_width,
-                      origin[1] + const.box_height)))
 
+def smooth_positions(positions: np.ndarray, cuts: Sequence[int] = (),
+                     span: Optional[float] = None) -> Iterator[np.ndarray]:
+    """Clean and smooth the path data, yielding a chunk of rows at a time.
+
+    NaNs are filled with the last position in the same scene, or at the
+    start of a scene, the first.  The average starts afresh at each cut.
+    The span defaults to smoothing_span.
+    """
+    import scipy.signal as sig
+    if span is None:
+        span = smoothing_span
+    alpha = smoothing_factor(span)
+    b, a = [alpha], [1, alpha - 1]
+    count = len(positions)
+    scene_starts = set(cut for cut in cuts if 0 < cut < count)
+    bounds = sorted(scene_starts | set(range(0, count, chunk_frames)))
+    # The last position seen, for filling NaNs, and the smoother's state.
+    last = np.array([const.frame_width / 2, const.frame_height / 2])
+    state = None  # type: Optional[np.ndarray]
+    for start, stop in zip(bounds, bounds[1:] + [count]):
+        if start == 0 or start in scene_starts:
+            first = first_valid_position(
+                positions, start,
+                min([cut for cut in scene_starts if cut > start] + [count]))
+            # If nothing changes in the whole scene, hold the last position.
+            if first is not None:
+                last = first
+            # Start the average settled on the first position.
+            state = (1 - alpha) * last
+        chunk = fill_forward(clean_positions(positions[start:stop]), last)
+        last = chunk[-1]
+        smoothed, zf = sig.lfilter(b, a, chunk, axis=0,
+                                   zi=state[np.newaxis, :])
+        state = zf[0]
+        yield smoothed
 
-def crop_all_to_bounding_box(frame_count: int) -> None:
-    smoothed_np = smooth_with_ewma(
-        shared.read_path_data(const.path_data_fn),
-        smoothing_span).values
 
-    boxes = (box_for_position(smoothed_np[i])
-             for i in range(0, frame_count))
+def boxes_for_positions(smoothed: np.ndarray, video_width: int,
+                        video_height: int,
+                        box_size: const.BoxSize = const.box_size) -> (
+        np.ndarray):
+    """The (n, 4) boxes of box_size centered on each position.
+
+    The boxes are moved as little as possible to keep them in the video.
+    """
+    box_width, box_height = box_size
+    left = np.round(np.clip(smoothed[:, 0] - box_width / 2, 0,
+                            video_width - box_width))
+    top = np.round(np.clip(smoothed[:, 1] - box_height / 2, 0,
+                           video_height - box_height))
+    return np.stack([left, top, left + box_width, top + box_height],
+                    axis=1).astype(int)
+
+
+def stream_boxes(positions: np.ndarray, frame_count: int,
+                 video_width: int, video_height: int,
+                 box_size: const.BoxSize = const.box_size,
+                 keyframes_only: bool = False,
+                 cuts: Sequence[int] = ()) -> Iterator[np.ndarray]:
+    """Compute the boxes for frame_count frames, a chunk at a time.
+
+    Each row of path data gives the box for the first frame of its pair; the
+    last box holds for any frames past the end of the path data.
+
+    Yield:
+        (n, 4) arrays of per-frame boxes, or if keyframes_only is set,
+        (n, 5) arrays of (frame, box) rows for each frame whose box differs
+        from the last one.
+    """
+    previous = None  # type: Optional[np.ndarray]
+    frame = 0
+    for smoothed in smooth_positions(positions[:frame_count], cuts):
+        boxes = boxes_for_positions(smoothed, video_width, video_height,
+                                    box_size)
+        yield _chunk_output(boxes, frame, previous, keyframes_only)
+        previous = boxes[-1]
+        frame += len(boxes)
+    if frame < frame_count:
+        if previous is None:
+            previous = boxes_for_positions(
+                np.array([[video_width / 2, video_height / 2]]),
+                video_width, video_height, box_size)[0]
+        yield _chunk_output(np.tile(previous, (frame_count - frame, 1)),
+                            frame, None if frame == 0 else previous,
+                            keyframes_only)
+
+
+def _chunk_output(boxes: np.ndarray, start_frame: int,
+                  previous: Optional[np.ndarray],
+                  keyframes_only: bool) -> np.ndarray:
+    if not keyframes_only:
+        return boxes
+    changed = np.ones(len(boxes), dtype=bool)
+    changed[1:] = np.any(boxes[1:] != boxes[:-1], axis=1)
+    if previous is not None:
+        changed[0] = np.any(boxes[0] != previous)
+    frames = np.flatnonzero(changed)
+    return np.column_stack([frames + start_frame, boxes[frames]])
+
+
+def main(youtube_id: str, frame_count: int,
+         video_width: int, video_height: int,
+         keyframes_only: bool = False,
+         box_sizes: Sequence[const.BoxSize] = (const.box_size,)) -> (
+        List[FrameSpecOutput]):
+    """Compute the boxes at each of box_sizes from the current path data."""
+    _, positions = array_file.open_array(const.path_array_fn(youtube_id),
+                                         'path')
+    return boxes_for_path_array(
+        positions, frame_count, video_width, video_height, keyframes_only,
+        box_sizes, shared.read_cuts(const.path_labels_fn(youtube_id)))
+
+
+def boxes_for_path_array(positions: np.ndarray, frame_count: int,
+                         video_width: int, video_height: int,
+                         keyframes_only: bool = False,
+                         box_sizes: Sequence[const.BoxSize] = (
+                             const.box_size,),
+                         cuts: Sequence[int] = ()) -> List[FrameSpecOutput]:
+    """Compute the boxes at each of box_sizes from (n, 2) raw path data."""
+    all_boxes = []
+    for box_size in box_sizes:
+        chunks = list(stream_boxes(positions, frame_count, video_width,
+                                   video_height, box_size, keyframes_only,
+                                   cuts))
+        rows = np.concatenate(chunks).tolist()
+        if keyframes_only:
+            all_boxes.append([(frame / frame_count,) + shared.tuple4(box)
+                              for frame, *box in rows])
+        else:
+            all_boxes.append([shared.tuple4(box) for box in rows])
+    return all_boxes
+
+
+def write_boxes(youtube_id: str, output_fn: str, frame_count: int,
+                video_width: int, video_height: int,
+                box_size: const.BoxSize = const.box_size,
+                keyframes_only: bool = False) -> int:
+    """Write the boxes straight to an array file, in constant memory.
+
+    This is for recordings too long to hold every box in memory; the file is
+    the same as array_file.write_boxes would write.  Return the number of
+    boxes written.
+    """
+    _, positions = array_file.open_array(const.path_array_fn(youtube_id),
+                                         'path')
+    cuts = shared.read_cuts(const.path_labels_fn(youtube_id))
+    return array_file.write_chunks(
+        output_fn, 'keyboxes' if keyframes_only else 'boxes',
+        stream_boxes(positions, frame_count, video_width, video_height,
+                     box_size, keyframes_only, cuts),
+        5 if keyframes_only else 4, video_width, video_height, frame_count)
 
-    shared.crop_to_bounding_boxes(boxes)
 
-main = crop_all_to_bounding_box
+def render_boxes(boxes: List[const.BoundingBox],
+                 cuts: Sequence[int] = ()) -> List[const.BoundingBox]:
+    """The per-frame boxes to crop the video to, which are already smooth."""
+    return boxes
@@ -1,9 +1,23 @@
-from typing import Iterable, Tuple, Union, List
+import collections
+import concurrent.futures
+import contextlib
+import os
+from typing import (TYPE_CHECKING, Any, Callable, Deque, Dict, Iterable,
+                    Iterator, List, Optional, Sequence, Tuple, Union)
 
-import pandas as pd
-from PIL import Image
+import numpy as np
 
+from mvz import array_file
 from mvz import const
+from mvz import frames
+from mvz import generate_video
+from mvz import instrument
+from mvz.image_processing import label_cut
+
+if TYPE_CHECKING:
+    # pandas is slow to import, and not needed to write out cached boxes, so
+    # it is imported by the functions that use it.
+    import pandas as pd
 
 # If the x value dips below this, we remove the point.  This helps deal with
 # when Sal goes to change colors in the video and the cursor moves all the way
@@ -18,42 +32,289 @@ FrameSpecOutput = Union[List[const.BoundingBox],
 NormalizedFrame = Tuple[float, float, float, float, float]
 NormalizedFrames = List[Tuple[float, float, float, float, float]]
 
-def read_path_data(path_data_fn: str) -> pd.DataFrame:
+# The formats crop_to_bounding_boxes can write cropped frames in: the file
+# extension, and the options to save the image with, or None to write the raw
+# rgb24 bytes.  png-fast trades bigger files for much quicker compression.
+frame_formats = {
+    'png': ('png', {}),
+    'png-fast': ('png', {'compress_level': 1}),
+    'jpeg': ('jpg', {'quality': 95}),
+    'raw': ('rgb', None),
+}  # type: Dict[str, Tuple[str, Optional[Dict[str, Any]]]]
+
+
+def read_path_data(path_data_fn: str) -> 'pd.DataFrame':
     """Read the path data output by the image processing step.
 
     Return a pandas dataframe with NaN values filled with the previous value.
     """
-    data = pd.read_csv(path_data_fn, header=None, names=['x', 'y'])
+    import pandas as pd
+    return clean_path_data(
+        pd.read_csv(path_data_fn, header=None, names=['x', 'y']))
+
+
+def read_path_array(path_array_fn: str, start: int = 0,
+                    stop: Optional[int] = None,
+                    cuts: Sequence[int] = ()) -> 'pd.DataFrame':
+    """Read (a range of) the path data from its array file.
+
+    Only the rows in the range are read.  NaN values are filled as in
+    read_path_data, but only from within the range (and the scene; see
+    clean_path_data).
+    """
+    import pandas as pd
+    _, positions = array_file.open_array(path_array_fn, 'path')
+    return clean_path_data(
+        pd.DataFrame(np.array(positions[start:stop]), columns=['x', 'y']),
+        cuts)
+
+
+def read_cuts(path_labels_fn: str, start: int = 0,
+              stop: Optional[int] = None) -> List[int]:
+    """The rows of (a range of) the path data that start a new scene.
+
+    Rows are counted from start.  If there is no labels file (it was written
+    by an older version), there are no cuts.
+    """
+    if not os.path.exists(path_labels_fn):
+        return []
+    _, labels = array_file.open_array(path_labels_fn, 'labels')
+    labels = labels[start:stop, 0]
+    return [int(i) + 1 for i in np.flatnonzero(labels == label_cut)
+            if i + 1 < len(labels)]
+
+
+def scene_ids(row_count: int, cuts: Sequence[int]) -> np.ndarray:
+    """The number of the scene each row is in."""
+    return np.searchsorted(np.asarray(cuts, dtype=int), np.arange(row_count),
+                           side='right')
+
+
+def clean_path_data(data: 'pd.DataFrame',
+                    cuts: Sequence[int] = ()) -> 'pd.DataFrame':
+    """Remove outlying points from x, y path data and fill in NaN values.
+
+    NaN values are filled with the previous value in the same scene, or if
+    there is none, the next one.  (cuts are the rows that start new scenes.)
+    """
     data['y'][data['x'] < min_value_x] = float('NaN')
     data['x'][data['x'] < min_value_x] = float('NaN')
-    return data.fillna(method='pad')
+    if len(cuts) > 0:
+        scenes = data.groupby(scene_ids(len(data), cuts))
+        data = scenes.ffill().groupby(scene_ids(len(data), cuts)).bfill()
+    # Anything left is a scene with no positions at all.
+    return data.fillna(method='pad').fillna(method='backfill')
+
+
+@contextlib.contextmanager
+def override_settings(module: Any, values: Dict[str, Any]) -> Iterator[None]:
+    """Override a method's settings (those in its setting_names) in a block.
+
+    This changes the module for every thread, so run different settings side
+    by side in processes of their own (as mvz.sweep does), or one at a time
+    (as mvz.service does), not in threads.
+    """
+    unknown = set(values) - set(module.setting_names)
+    if unknown:
+        raise ValueError('unknown settings: %s' % ', '.join(sorted(unknown)))
+    previous = {name: getattr(module, name) for name in values}
+    for name, value in values.items():
+        setattr(module, name, value)
+    try:
+        yield
+    finally:
+        for name, value in previous.items():
+            setattr(module, name, value)
 
 
 def crop_to_bounding_boxes(youtube_id: str,
                            frame_count: int,
-                           boxes: Iterable[const.BoundingBox]):
-    for i, box in zip(range(0, frame_count), boxes):
-        im = Image.open(const.frame_fn_template(youtube_id) % (i + 1))
-        cropped = im.crop(box=box)
-        cropped.save(const.output_frame_template(youtube_id) % (i + 1))
+                           boxes: Iterable[const.BoundingBox],
+                           frame_format: str = 'png',
+                           box_size: const.BoxSize = const.box_size,
+                           decode_threads: int = 1,
+                           encode_threads: Optional[int] = None,
+                           queue_frames: int = 16) -> int:
+    """Crop each frame of the video to its box, writing it to output_dir.
+
+    This runs as a pipeline of stages connected by bounded queues, each
+    holding at most queue_frames frames, so memory use doesn't grow with the
+    video:
+
+        decoding and cropping, in a single thread reading the ffmpeg pipe,
+            or in decode_threads threads reading the png frame cache
+        encoding and writing, in encode_threads threads (by default, one per
+            cpu)
+
+    PIL releases the GIL while it decodes and encodes, so the threads do run
+    in parallel.  Frames are cropped as soon as they are decoded, since
+    frames read from ffmpeg are only valid until the next few are read (and
+    the crops are much smaller).
+
+    This decodes the video for one box size; to write frames while the
+    cropped videos are rendered, from the same decoding pass, give a
+    FrameWriter for each size to generate_video.render_sizes.
+
+    Args:
+        frame_format: one of frame_formats.
+        box_size: the size of the boxes, which names the output files (see
+            const.output_frame_template).
+
+    Return:
+        the number of frames written.
+    """
+    if encode_threads is None:
+        encode_threads = os.cpu_count() or 1
+
+    with concurrent.futures.ThreadPoolExecutor(decode_threads) as decoders, \
+            concurrent.futures.ThreadPoolExecutor(encode_threads) as encoders:
+        if frames.has_frame_cache(youtube_id):
+            fns = frames.cached_frame_fns(youtube_id)[:frame_count]
+            cropped_frames = bounded_map(decoders, _read_cropped_frame,
+                                         zip(fns, boxes), queue_frames)
+        else:
+            cropped_frames = (
+                crop_frame(frame, box) for frame, box in zip(
+                    frames.read_video_frames(const.video_fn(youtube_id),
+                                             frame_count=frame_count),
+                    boxes))
+        writer = FrameWriter(youtube_id, encoders, frame_format, box_size,
+                             queue_frames)
+        for i, cropped in enumerate(cropped_frames):
+            writer.write(cropped)
+            instrument.count('frames')
+            instrument.progress(i + 1, frame_count)
+        return writer.finish()
+
+
+class FrameWriter(object):
+    """Writes the cropped frames of one box size on a thread pool, in order.
+
+    Frames are given to write one at a time, and written as
+    crop_to_bounding_boxes writes them.  At most queue_frames of them wait to
+    be written, so a slow disk holds up the caller rather than filling
+    memory.  An error writing a frame is raised by a later write, or finish.
+    """
+
+    def __init__(self, youtube_id: str,
+                 executor: concurrent.futures.Executor,
+                 frame_format: str = 'png',
+                 box_size: const.BoxSize = const.box_size,
+                 queue_frames: int = 16) -> None:
+        extension, self.save_options = frame_formats[frame_format]
+        self.template = const.output_frame_template(youtube_id, extension,
+                                                    box_size)
+        self.executor = executor
+        self.queue_frames = queue_frames
+        self.submitted = 0
+        self.written = 0
+        self._pending = (
+            collections.deque())  # type: Deque[concurrent.futures.Future]
+
+    def write(self, cropped: np.ndarray) -> None:
+        """Write the next frame; cropped mustn't change until it's written."""
+        self.submitted += 1
+        self._pending.append(self.executor.submit(
+            _write_frame, self.template % self.submitted, cropped,
+            self.save_options))
+        while len(self._pending) >= self.queue_frames:
+            self._wait_oldest()
+
+    def write_copy(self, cropped: np.ndarray) -> None:
+        """Write a copy of the next frame, for a buffer that gets reused."""
+        self.write(cropped.copy())
+
+    def finish(self) -> int:
+        """Wait for every frame to be written; return how many were."""
+        while self._pending:
+            self._wait_oldest()
+        return self.written
+
+    def _wait_oldest(self) -> None:
+        self._pending.popleft().result()
+        self.written += 1
+
+
+def crop_frame(frame: np.ndarray, box: const.BoundingBox) -> np.ndarray:
+    """A copy of the part of frame inside box, as PIL's crop would give."""
+    left, top, right, bottom = box
+    return generate_video.crop_frame(
+        frame, box, np.empty((bottom - top, right - left, 3), dtype=np.uint8))
+
 
+def _read_cropped_frame(item: Tuple[str, const.BoundingBox]) -> np.ndarray:
+    from PIL import Image
+    frame_fn, box = item
+    return crop_frame(np.asarray(Image.open(frame_fn).convert('RGB')), box)
 
-def normalize_boxes(boxes: Frames,
-                    video_width: int, video_height: int) -> NormalizedFrames:
-    def normalize_box(box: Frame) -> NormalizedFrame:
+
+def _write_frame(frame_fn: str, cropped: np.ndarray,
+                 save_options: Optional[Dict[str, Any]]) -> None:
+    if save_options is None:
+        with open(frame_fn, 'wb') as f:
+            f.write(cropped.tobytes())
+        return
+    from PIL import Image
+    Image.fromarray(cropped).save(frame_fn, **save_options)
+
+
+def bounded_map(executor: concurrent.futures.Executor,
+                function: Callable[[Any], Any], items: Iterable[Any],
+                limit: int) -> Iterator[Any]:
+    """Like executor.map, but with at most limit items in flight.
+
+    executor.map submits every item up front, which for the frames of a
+    video means holding them all in memory.  Here, the next item is only
+    taken once the oldest result has been yielded.  Results are in order,
+    and an exception in function is raised when its result is reached.
+    """
+    pending = collections.deque()  # type: Deque[concurrent.futures.Future]
+    for item in items:
+        pending.append(executor.submit(function, item))
+        if len(pending) >= limit:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def normalize_boxes(boxes: FrameSpecOutput,
+                    video_width: int, video_height: int) -> (
+        List[Tuple[float, ...]]):
+    """Scale box coordinates to fractions of the video size.
+
+    Keyframe boxes keep their leading frame time; per-frame boxes (from
+    --all-frames) have none.
+    """
+    def normalize_box(box: Tuple[Any, ...]) -> Tuple[float, ...]:
         def normalize_horizontal_dimension(d: int) -> float:
             return d / video_width
 
         def normalize_vertical_dimension(d: int) -> float:
             return d / video_height
 
-        (frame, x, y, w, h) = box
+        (x, y, w, h) = box[-4:]
 
-        return (frame,
+        return tuple(box[:-4]) + (
                 normalize_horizontal_dimension(x), normalize_vertical_dimension(y),
                 normalize_horizontal_dimension(w), normalize_vertical_dimension(h))
 
-    return map(normalize_box, boxes)
+    return [normalize_box(box) for box in boxes]
+
+
+def frame_boxes_from_keyframes(keyframe_boxes: FrameSpecOutput,
+                               frame_count: int) -> List[const.BoundingBox]:
+    """Expand (time, box) keyframe boxes to one box per frame.
+
+    Each keyframe's box holds until the next keyframe.  Keyframe times are
+    fractions of frame_count, as make_boxes_from_frame_spec writes them.
+    """
+    if len(keyframe_boxes) == 0:
+        return []
+    keyframes = np.array(keyframe_boxes, dtype=float)
+    starts = np.round(keyframes[:, 0] * frame_count).astype(int)
+    boxes = keyframes[:, 1:].astype(int)
+    index = np.searchsorted(starts, np.arange(frame_count), side='right') - 1
+    return [tuple4(box) for box in boxes[np.maximum(index, 0)].tolist()]
 
 
 def tuple4(tuple_n: Tuple[int, ...]) -> Tuple[int, int, int, int]:
@@ -0,0 +1,277 @@
+"""Run the whole process for a video, decoding it at most twice.
+
+The first pass over the frames finds the center of change (and is skipped if
+the path data is cached).  The boxes are computed from the path data alone.
+If per-frame output is wanted, a second pass crops each frame to its box and
+pipes it into the encoder.  Both passes stream frames through a small ring of
+buffers, so memory use doesn't grow with the length of the video.
+"""
+import concurrent.futures
+import csv
+import json
+import os.path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import funcy as fn
+import numpy as np
+
+from mvz import array_file
+from mvz import cache
+from mvz import const
+from mvz import downloader
+from mvz import filter_script
+from mvz import generate_video
+from mvz import image_processing
+from mvz import instrument
+from mvz import methods
+from mvz.methods import shared
+from mvz.methods.shared import FrameSpecOutput
+
+
+boxes_basename = 'boxes.array'
+
+output_formats = ('csv', 'json', 'array', 'ffmpeg')
+
+
+def method_module(method_name: str) -> Any:
+    return methods.get(method_name)
+
+
+def parse_box_size(size_str: str) -> const.BoxSize:
+    """Parse a "WIDTHxHEIGHT" box size, or a "WIDTH:HEIGHT" aspect ratio.
+
+    An aspect ratio gets the box of that shape whose shorter side is as long
+    as the default box's shorter side, rounded to even sizes.  The encoder
+    needs both sides to be even.
+    """
+    if ':' in size_str:
+        ratio_width, ratio_height = (float(c) for c in size_str.split(':'))
+        if not (ratio_width > 0 and ratio_height > 0):
+            raise ValueError('aspect ratio %s is not positive' % size_str)
+        short_side = min(const.box_size)
+        scale = short_side / min(ratio_width, ratio_height)
+        width, height = (2 * int(round(ratio_width * scale / 2)),
+                         2 * int(round(ratio_height * scale / 2)))
+    else:
+        width, height = (int(c) for c in size_str.lower().split('x'))
+    if width % 2 or height % 2:
+        raise ValueError('box size %dx%d is not even' % (width, height))
+    if not (0 < width <= const.frame_width and
+            0 < height <= const.frame_height):
+        raise ValueError('box size %dx%d does not fit in the %dx%d video' % (
+            width, height, const.frame_width, const.frame_height))
+    return (width, height)
+
+
+def compute_boxes(youtube_id: str, method_name: str, path_key: str,
+                  video_width: int, video_height: int,
+                  keyframes_only: bool = True,
+                  box_sizes: Sequence[const.BoxSize] = (const.box_size,)) -> (
+        List[FrameSpecOutput]):
+    """Run the method on the current path data, caching the boxes.
+
+    Return the boxes for each of box_sizes.  The method is run once, for all
+    the sizes that aren't cached.
+    """
+    method = method_module(method_name)
+
+    def params(box_size):
+        return {
+            'path': path_key,
+            'method': method_name,
+            'keyframes_only': keyframes_only,
+            'method_settings': cache.module_params(method),
+            'shared_settings': cache.module_params(shared),
+            'box_size': list(box_size),
+        }
+
+    all_boxes = {}  # type: Dict[const.BoxSize, FrameSpecOutput]
+    for box_size in box_sizes:
+        entry = cache.lookup('boxes', params(box_size))
+        if entry is not None:
+            all_boxes[box_size] = array_file.read_boxes(
+                os.path.join(entry, boxes_basename))[0]
+
+    missing = [box_size for box_size in fn.distinct(box_sizes)
+               if box_size not in all_boxes]
+    if missing:
+        frame_count = image_processing.n_frames(youtube_id)
+        computed = method.main(
+            youtube_id,
+            frame_count=frame_count,
+            keyframes_only=keyframes_only,
+            video_width=video_width,
+            video_height=video_height,
+            box_sizes=missing
+        )
+        for box_size, boxes in zip(missing, computed):
+            entry = cache.open_entry('boxes', params(box_size), youtube_id)
+            array_file.write_boxes(os.path.join(entry, boxes_basename), boxes,
+                                   frame_count, video_width, video_height)
+            cache.finish(entry)
+            all_boxes[box_size] = boxes
+    return [all_boxes[box_size] for box_size in box_sizes]
+
+
+def run(youtube_id: str, method_name: str = 'bandpass_and_snapping',
+        all_frames: bool = False, bust_cache: bool = False,
+        cache_frames: bool = False, workers: int = 1,
+        analysis_scale: int = 1, mask: Optional[np.ndarray] = None,
+        adaptive_stride: int = 1,
+        scene_detection: bool = True) -> Tuple[FrameSpecOutput, int, int]:
+    """Download, analyze and compute boxes for a video, at the default size.
+
+    If all_frames is set, also write the cropped video.
+
+    Return:
+        the boxes (keyframe boxes, or one per frame if all_frames is set),
+        and the video width and height.
+    """
+    ([boxes], video_width, video_height) = run_sizes(
+        youtube_id, [const.box_size], method_name, all_frames=all_frames,
+        bust_cache=bust_cache, cache_frames=cache_frames, workers=workers,
+        analysis_scale=analysis_scale, mask=mask,
+        adaptive_stride=adaptive_stride, scene_detection=scene_detection)
+    return (boxes, video_width, video_height)
+
+
+def run_sizes(youtube_id: str, box_sizes: Sequence[const.BoxSize],
+              method_name: str = 'bandpass_and_snapping',
+              all_frames: bool = False, bust_cache: bool = False,
+              cache_frames: bool = False, workers: int = 1,
+              analysis_scale: int = 1,
+              mask: Optional[np.ndarray] = None,
+              frame_format: Optional[str] = None,
+              adaptive_stride: int = 1,
+              scene_detection: bool = True) -> (
+        Tuple[List[FrameSpecOutput], int, int]):
+    """Like run, but compute boxes for each of several box sizes.
+
+    The video is analyzed once for all the sizes.  If all_frames is set, a
+    cropped video is written for each size, from a single decoding pass, and
+    if frame_format is also set (see shared.frame_formats), each cropped
+    frame is written as well, from the same pass.
+
+    Return:
+        the boxes for each size, and the video width and height.
+    """
+    with instrument.stage('download'):
+        downloader.download(youtube_id, bust_cache=bust_cache,
+                            cache_frames=cache_frames)
+    with instrument.stage('center_of_change'):
+        (positions, video_width, video_height) = image_processing.main(
+            youtube_id, bust_cache=bust_cache, workers=workers,
+            analysis_scale=analysis_scale, mask=mask,
+            adaptive_stride=adaptive_stride, scene_detection=scene_detection)
+        instrument.count('frames', len(positions) + 1)
+    path_key = cache.entry_key('path', image_processing.path_params(
+        youtube_id, analysis_scale, mask, adaptive_stride, scene_detection))
+    with instrument.stage('boxes'):
+        all_boxes = compute_boxes(youtube_id, method_name, path_key,
+                                  video_width, video_height,
+                                  keyframes_only=not all_frames,
+                                  box_sizes=box_sizes)
+        instrument.count('frames', len(positions) + 1)
+    if all_frames:
+        with instrument.stage('render'):
+            cuts = shared.read_cuts(const.path_labels_fn(youtube_id))
+            render = method_module(method_name).render_boxes
+            sized_boxes = [(box_size, render(boxes, cuts))
+                           for box_size, boxes in zip(box_sizes, all_boxes)]
+            render_sizes(youtube_id, method_name, sized_boxes, frame_format)
+    return (all_boxes, video_width, video_height)
+
+
+def render_sizes(youtube_id: str, method_name: str,
+                 sized_boxes: Sequence[Tuple[const.BoxSize,
+                                             List[const.BoundingBox]]],
+                 frame_format: Optional[str] = None) -> None:
+    """Write the cropped video for each size, and maybe each cropped frame.
+
+    The frames are written on a thread pool while the videos are encoded, so
+    the video is only decoded once for all of it.
+    """
+    if frame_format is None:
+        generate_video.render_sizes(youtube_id, method_name, 'auto',
+                                    sized_boxes)
+        return
+    with concurrent.futures.ThreadPoolExecutor(os.cpu_count() or 1) as (
+            encoders):
+        writers = [shared.FrameWriter(youtube_id, encoders, frame_format,
+                                      box_size)
+                   for box_size, _ in sized_boxes]
+        generate_video.render_sizes(
+            youtube_id, method_name, 'auto', sized_boxes,
+            [writer.write_copy for writer in writers])
+        for writer in writers:
+            instrument.count('frames_written', writer.finish())
+
+
+def box_output_fn(youtube_id: str, method_name: str, extension: str,
+                  box_size: const.BoxSize = const.box_size) -> str:
+    return os.path.join(const.output_dir, '%s_%s_auto%s_boxes.%s' % (
+        youtube_id, method_name, const.size_suffix(box_size), extension))
+
+
+def stats_output_fn(youtube_id: str, method_name: str) -> str:
+    return os.path.join(const.output_dir, '%s_%s_auto_stats.json' % (
+        youtube_id, method_name))
+
+
+def profile_fn_template(youtube_id: str) -> str:
+    """Where the cProfile stats for each stage go, % the stage name."""
+    return os.path.join(const.output_dir, '%s_%%s.prof' % youtube_id)
+
+
+def write_boxes(youtube_id: str, method_name: str, boxes: FrameSpecOutput,
+                video_width: int, video_height: int,
+                output_format: str = 'csv',
+                box_size: const.BoxSize = const.box_size) -> str:
+    """Write the boxes to the output directory.
+
+    csv and json output is normalized to the video size.  array output is an
+    array_file in pixels, with the video size and frame count in its header,
+    for consumers that load many of them.  ffmpeg output is a filter script
+    that crops the video as --all-frames would (see filter_script), which
+    render_filter_script runs.
+
+    Return the filename written.
+    """
+    output_fn = box_output_fn(youtube_id, method_name, output_format,
+                              box_size)
+    if output_format == 'ffmpeg':
+        if boxes and len(boxes[0]) == 5:
+            boxes = shared.frame_boxes_from_keyframes(
+                boxes, image_processing.n_frames(youtube_id))
+        cuts = shared.read_cuts(const.path_labels_fn(youtube_id))
+        filter_script.write(
+            output_fn, method_module(method_name).render_boxes(boxes, cuts),
+            video_width, video_height)
+        return output_fn
+    if output_format == 'array':
+        array_file.write_boxes(output_fn, boxes,
+                               image_processing.n_frames(youtube_id),
+                               video_width, video_height)
+        return output_fn
+    normalized_boxes = shared.normalize_boxes(boxes, video_width, video_height)
+    with open(output_fn, 'w') as f:
+        if output_format == 'json':
+            f.write(json.dumps(normalized_boxes))
+        else:
+            csv.writer(f).writerows(normalized_boxes)
+    return output_fn
+
+
+def render_filter_script(youtube_id: str, method_name: str,
+                         box_size: const.BoxSize = const.box_size) -> str:
+    """Render the cropped video from the filter script write_boxes wrote.
+
+    Return the filename of the video.
+    """
+    output_fn = const.output_video_fn(youtube_id, method_name, 'auto',
+                                      box_size)
+    filter_script.render(
+        const.video_fn(youtube_id),
+        box_output_fn(youtube_id, method_name, 'ffmpeg', box_size),
+        output_fn, image_processing.n_frames(youtube_id))
+    return output_fn
@@ -0,0 +1,103 @@
+"""Compare center-of-change analysis at reduced scales with full resolution.
+
+For each analysis scale, this times the path extraction and reports how far
+the positions, and more importantly the resulting crop boxes, are from the
+full resolution ones.  The cheapest scale that keeps the same boxes is the one
+to use.
+"""
+import json
+import os.path
+import time
+from typing import Any, Dict, Iterable, List, Optional
+
+import funcy as fn
+import numpy as np
+import pandas as pd
+
+from mvz import const
+from mvz import frames
+from mvz import image_processing
+from mvz.methods import bandpass_and_snapping
+from mvz.methods import shared
+
+
+def report_fn(youtube_id: str) -> str:
+    return os.path.join(const.output_dir, '%s_scale_report.json' % youtube_id)
+
+
+def boxes_for_positions(positions: List[Any], video_width: int,
+                        video_height: int) -> np.ndarray:
+    data = shared.clean_path_data(
+        pd.DataFrame(positions, columns=['x', 'y'], dtype=float))
+    return np.array(bandpass_and_snapping.boxes_for_path_data(
+        data, len(positions) + 1, video_width, video_height))
+
+
+def compare_scales(youtube_id: str, scales: Iterable[int] = (1, 2, 4, 8),
+                   frame_count: Optional[int] = None,
+                   mask: Optional[np.ndarray] = None) -> (
+        List[Dict[str, Any]]):
+    """Run the analysis at each scale and compare it to full resolution.
+
+    Args:
+        frame_count: only analyze this many frames from the start of the
+            video, to keep the report quick.
+
+    Return:
+        one dict of timings and differences per scale.
+    """
+    for scale in scales:
+        image_processing.check_analysis_scale(scale)
+    video_width, video_height = const.frame_width, const.frame_height
+
+    start = time.time()
+    fn.ilen(frames.get_frames(youtube_id, frame_count))
+    decode_seconds = time.time() - start
+
+    results = []
+    reference = reference_boxes = None
+    for scale in [1] + [s for s in scales if s != 1]:
+        start = time.time()
+        positions = image_processing.chunk_positions(
+            youtube_id, 0, frame_count, scale, mask)
+        seconds = time.time() - start
+        boxes = boxes_for_positions(positions, video_width, video_height)
+        if reference is None:
+            reference = np.array(positions)
+            reference_boxes = boxes
+        error = np.abs(np.array(positions) - reference)
+        results.append({
+            'analysis_scale': scale,
+            'frames': len(positions) + 1,
+            'seconds': seconds,
+            'seconds_excluding_decode': seconds - decode_seconds,
+            'mean_position_error': float(np.nanmean(error)),
+            'max_position_error': float(np.nanmax(error)),
+            'fraction_same_boxes': float(np.mean(
+                np.all(boxes == reference_boxes, axis=1))),
+            'max_box_offset': int(np.max(np.abs(boxes - reference_boxes))),
+        })
+    return results
+
+
+def format_report(results: List[Dict[str, Any]]) -> str:
+    columns = ['analysis_scale', 'seconds', 'seconds_excluding_decode',
+               'mean_position_error', 'max_position_error',
+               'fraction_same_boxes', 'max_box_offset']
+    lines = ['\t'.join(columns)]
+    for result in results:
+        lines.append('\t'.join(
+            ('%.3f' % result[c]) if isinstance(result[c], float)
+            else str(result[c])
+            for c in columns))
+    return '\n'.join(lines)
+
+
+def main(youtube_id: str, scales: Iterable[int] = (1, 2, 4, 8),
+         frame_count: Optional[int] = None,
+         mask: Optional[np.ndarray] = None) -> List[Dict[str, Any]]:
+    """Compare the scales, and write the results out as json."""
+    results = compare_scales(youtube_id, scales, frame_count, mask)
+    with open(report_fn(youtube_id), 'w') as f:
+        json.dump(results, f, indent=2)
+    return results
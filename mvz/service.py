@@ -0,0 +1,330 @@
+"""A long-lived local service that computes boxes over HTTP.
+
+Each run of bin/run_mvz.py pays to start python, import pandas and scipy, and
+read the path data from disk.  The service does all of that once: it imports
+every method when it starts, and keeps the most recently used path data and
+boxes in memory, so asking for a video's boxes again, with other settings,
+only runs the method (and asking with the same settings does nothing).
+
+    GET /boxes?youtube_id=<id>[&method=<name>][&box_size=<WxH>]
+            [&all_frames=1][&<setting>=<value>...]
+
+returns a json object with the youtube_id, method, settings (every one of the
+method's setting_names, whether given or not), box_size, video_width,
+video_height, frame_count, and the boxes, in pixels: (time, left, top, right,
+bottom) keyframe boxes, or with all_frames, a (left, top, right, bottom) box
+for each frame, as pipeline.run gives.
+
+    GET /status
+
+returns the number of entries in, and hits and misses of, each cache.
+
+The path data must already have been computed (by bin/run_mvz.py); the
+service notices when it is recomputed.  Errors are returned as
+{"error": <message>}, with status 400 for a bad request, or 404 if the video
+has no path data, or 500 if computing the boxes fails.
+"""
+import collections
+import http.server
+import json
+import os
+import socketserver
+import threading
+import urllib.error
+import urllib.parse
+import urllib.request
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+import numpy as np
+
+from mvz import array_file
+from mvz import const
+from mvz import methods
+from mvz import pipeline
+from mvz.methods import shared
+from mvz.methods.shared import FrameSpecOutput
+
+default_port = 8765
+
+# The most videos' path data, and sets of boxes, to keep in memory.
+path_entries = 16
+box_entries = 256
+
+# The values the service accepts for methods' settings, beyond their types:
+# a test, and what it asks for.
+setting_checks = {
+    'anticipation_time': (lambda value: value >= 1, 'at least 1'),
+    'freq_cutoff': (lambda value: 0 < value < 1, 'between 0 and 1'),
+    'initial_offset': (lambda value: value >= 0, 'not negative'),
+    'padding': (lambda value: value >= 0, 'not negative'),
+    'smoothing_span': (lambda value: value >= 1, 'at least 1'),
+}  # type: Dict[str, Tuple[Callable[[Any], bool], str]]
+
+PathData = collections.namedtuple(
+    'PathData', ['positions', 'cuts', 'frame_count', 'video_width',
+                 'video_height'])
+
+
+class RequestError(Exception):
+    """A request the service can't answer, with the http status to send."""
+
+    def __init__(self, message: str, status: int = 400) -> None:
+        super().__init__(message)
+        self.status = status
+
+
+class LRUCache(object):
+    """Keeps the values of the max_entries most recently used keys.
+
+    It can be shared between threads.
+    """
+
+    def __init__(self, max_entries: int) -> None:
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()  # type: Dict[Hashable, Any]
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable, compute: Callable[[], Any]) -> Any:
+        """The value for key, calling compute to make it if it isn't here.
+
+        compute runs outside the lock, so two threads missing the same key at
+        once may both compute it.
+        """
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+        value = compute()
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return value
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {'entries': len(self._entries), 'hits': self.hits,
+                    'misses': self.misses}
+
+
+def warm_imports() -> None:
+    """Import every method, and what they import, before the first request."""
+    for name in methods.names():
+        methods.get(name)
+    import pandas  # noqa: F401
+    import scipy.signal  # noqa: F401
+    import scipy.stats  # noqa: F401
+
+
+def path_version(youtube_id: str) -> Tuple[Any, ...]:
+    """What changes when a video's path data is recomputed."""
+    version = []  # type: List[Any]
+    for fn in (const.path_array_fn(youtube_id),
+               const.path_labels_fn(youtube_id)):
+        try:
+            stat = os.stat(fn)
+        except FileNotFoundError:
+            version.append(None)
+        else:
+            version.append((stat.st_mtime_ns, stat.st_size))
+    return tuple(version)
+
+
+def read_path(youtube_id: str) -> PathData:
+    path_array_fn = const.path_array_fn(youtube_id)
+    if not os.path.exists(path_array_fn):
+        raise RequestError('no path data for %s; run bin/run_mvz.py on it '
+                           'first' % youtube_id, 404)
+    header, positions = array_file.open_array(path_array_fn, 'path')
+    return PathData(np.array(positions, dtype=float),
+                    shared.read_cuts(const.path_labels_fn(youtube_id)),
+                    header.frame_count, const.frame_width, const.frame_height)
+
+
+def default_settings(method: Any) -> Dict[str, Any]:
+    """The current values of the method's settings."""
+    return {name: getattr(method, name) for name in method.setting_names}
+
+
+def parse_settings(defaults: Dict[str, Any],
+                   query: Dict[str, str]) -> Dict[str, Any]:
+    """Every one of a method's settings, from the query or its defaults.
+
+    Values are parsed as the type of the default, and checked against
+    setting_checks.
+    """
+    values = {}  # type: Dict[str, Any]
+    for name, default in defaults.items():
+        if name not in query:
+            values[name] = default
+            continue
+        try:
+            value = type(default)(query[name])
+        except ValueError:
+            raise RequestError('bad value for %s: %r' % (name, query[name]))
+        if name in setting_checks:
+            check, description = setting_checks[name]
+            if not check(value):
+                raise RequestError('%s must be %s, not %r' % (
+                    name, description, query[name]))
+        values[name] = value
+    return values
+
+
+class Service(object):
+    """Computes boxes, keeping recent path data and boxes in memory.
+
+    Methods are run one at a time, since their settings are module globals
+    (see shared.override_settings); cached boxes are served concurrently.
+    For the same reason, the defaults for settings a request leaves out are
+    read once, here, rather than while another request overrides them.
+    """
+
+    def __init__(self, max_paths: int = path_entries,
+                 max_boxes: int = box_entries) -> None:
+        self.paths = LRUCache(max_paths)
+        self.boxes = LRUCache(max_boxes)
+        self.defaults = {name: default_settings(methods.get(name))
+                         for name in methods.names()}
+        self._method_lock = threading.Lock()
+
+    def path(self, youtube_id: str, version: Tuple[Any, ...]) -> PathData:
+        return self.paths.get((youtube_id, version),
+                              lambda: read_path(youtube_id))
+
+    def get_boxes(self, query: Dict[str, str]) -> Dict[str, Any]:
+        """Answer a /boxes request, given its query parameters."""
+        if 'youtube_id' not in query:
+            raise RequestError('youtube_id is required')
+        youtube_id = query['youtube_id']
+        method_name = query.get('method', 'bandpass_and_snapping')
+        try:
+            method = methods.get(method_name)
+            box_size = pipeline.parse_box_size(
+                query.get('box_size', '%dx%d' % const.box_size))
+        except ValueError as e:
+            raise RequestError(str(e))
+        all_frames = query.get('all_frames', '0') not in ('', '0', 'false')
+        known = set(method.setting_names) | {
+            'youtube_id', 'method', 'box_size', 'all_frames'}
+        unknown = sorted(set(query) - known)
+        if unknown:
+            raise RequestError('unknown parameters: %s' % ', '.join(unknown))
+        settings = parse_settings(self.defaults[method_name], query)
+        version = path_version(youtube_id)
+        path = self.path(youtube_id, version)
+        key = (youtube_id, version, method_name,
+               tuple(sorted(settings.items())), box_size, all_frames)
+        boxes = self.boxes.get(key, lambda: self.compute_boxes(
+            path, method, settings, box_size, all_frames))
+        return {
+            'youtube_id': youtube_id,
+            'method': method_name,
+            'settings': settings,
+            'box_size': list(box_size),
+            'video_width': path.video_width,
+            'video_height': path.video_height,
+            'frame_count': path.frame_count,
+            'boxes': boxes,
+        }
+
+    def compute_boxes(self, path: PathData, method: Any,
+                      settings: Dict[str, Any], box_size: const.BoxSize,
+                      all_frames: bool) -> FrameSpecOutput:
+        with self._method_lock, method.settings(**settings):
+            return method.boxes_for_path_array(
+                path.positions, path.frame_count, path.video_width,
+                path.video_height, keyframes_only=not all_frames,
+                box_sizes=[box_size], cuts=path.cuts)[0]
+
+    def status(self) -> Dict[str, Any]:
+        return {'paths': self.paths.stats(), 'boxes': self.boxes.stats()}
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    service = None  # type: Service
+    quiet = False
+
+    def do_GET(self) -> None:
+        url = urllib.parse.urlsplit(self.path)
+        query = dict(urllib.parse.parse_qsl(url.query,
+                                            keep_blank_values=True))
+        try:
+            if url.path == '/boxes':
+                self.send_json(200, self.service.get_boxes(query))
+            elif url.path == '/status':
+                self.send_json(200, self.service.status())
+            else:
+                raise RequestError('no such endpoint: %s' % url.path, 404)
+        except RequestError as e:
+            self.send_json(e.status, {'error': str(e)})
+        except Exception as e:
+            self.log_error('%s failed: %r', self.path, e)
+            self.send_json(500, {'error': '%s: %s' % (type(e).__name__, e)})
+
+    def send_json(self, status: int, value: Any) -> None:
+        body = json.dumps(value).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args: Any) -> None:
+        if not self.quiet:
+            super().log_message(format, *args)
+
+
+class Server(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+
+
+def make_server(service: Service, host: str = '127.0.0.1',
+                port: int = default_port, quiet: bool = False) -> Server:
+    """An http server for service; port 0 picks a free port."""
+    handler = type('BoundHandler', (Handler,),
+                   {'service': service, 'quiet': quiet})
+    return Server((host, port), handler)
+
+
+def fetch_boxes(url: str, youtube_id: str,
+                method_name: Optional[str] = None,
+                box_size: Optional[const.BoxSize] = None,
+                all_frames: bool = False,
+                settings: Optional[Dict[str, Any]] = None,
+                timeout: float = 60) -> Dict[str, Any]:
+    """Ask the service at url (like http://127.0.0.1:8765) for boxes.
+
+    Raise RequestError if the service can't answer.
+    """
+    query = [('youtube_id', youtube_id)]  # type: List[Tuple[str, Any]]
+    if method_name is not None:
+        query.append(('method', method_name))
+    if box_size is not None:
+        query.append(('box_size', '%dx%d' % tuple(box_size)))
+    if all_frames:
+        query.append(('all_frames', 1))
+    query.extend(sorted((settings or {}).items()))
+    return _get_json('%s/boxes?%s' % (url.rstrip('/'),
+                                      urllib.parse.urlencode(query)), timeout)
+
+
+def fetch_status(url: str, timeout: float = 60) -> Dict[str, Any]:
+    return _get_json('%s/status' % url.rstrip('/'), timeout)
+
+
+def _get_json(url: str, timeout: float) -> Dict[str, Any]:
+    try:
+        with urllib.request.urlopen(url, timeout=timeout) as response:
+            return json.loads(response.read().decode('utf-8'))
+    except urllib.error.HTTPError as e:
+        raise RequestError(json.loads(e.read().decode('utf-8'))['error'],
+                           e.code)
@@ -0,0 +1,196 @@
+"""Sweep the settings of bandpass_and_snapping over a video's path data.
+
+Trying a setting used to mean editing the module and rerunning
+bin/run_mvz.py.  A sweep instead loads the path data once, filters it once
+per freq_cutoff (x and y together), and snaps and pans for every combination
+of the other settings in a pool of processes.  Each setting is scored with
+measures that are cheap to compute from the path data:
+
+    shots: the number of times a new box is chosen, plus one
+    mean_shot_seconds: how long each box is held, on average
+    change_inside: the fraction of frames with any change whose center of
+        change is inside the (panned) box
+    motion_per_second: how far the box moves, in pixels per second
+"""
+import collections
+import concurrent.futures
+import itertools
+from typing import Any, Dict, List, Mapping, Optional, Sequence, Tuple
+
+import numpy as np
+
+from mvz import array_file
+from mvz import const
+from mvz import image_processing
+from mvz import instrument
+from mvz.methods import bandpass_and_snapping
+from mvz.methods import shared
+
+Setting = Dict[str, Any]
+
+# What every setting is scored on: the positions filtered at each
+# freq_cutoff, the raw positions, the cuts, the frame count, the video size
+# and the box size.
+SweepData = collections.namedtuple(
+    'SweepData', ['filtered', 'raw', 'cuts', 'frame_count', 'video_width',
+                  'video_height', 'box_size'])
+
+# The data evaluate scores settings on in this process.  It is sent to each
+# worker process once, when it starts, so that each task only carries its
+# setting.
+_data = None  # type: Optional[SweepData]
+
+
+def grid(values: Mapping[str, Sequence[Any]]) -> List[Setting]:
+    """Every combination of the values given for each setting.
+
+    Settings that aren't given keep their current value.
+    """
+    names = sorted(values)
+    current = current_setting()
+    return [dict(current, **dict(zip(names, combination)))
+            for combination in itertools.product(
+                *[values[name] for name in names])]
+
+
+def current_setting() -> Setting:
+    return {name: getattr(bandpass_and_snapping, name)
+            for name in bandpass_and_snapping.setting_names}
+
+
+def load_path(youtube_id: str) -> Tuple[np.ndarray, np.ndarray, List[int]]:
+    """Read a video's path data.
+
+    Return:
+        the raw positions, which are NaN where nothing changed, the positions
+        cleaned as the method cleans them, and the rows that start a scene.
+    """
+    cuts = shared.read_cuts(const.path_labels_fn(youtube_id))
+    _, raw = array_file.open_array(const.path_array_fn(youtube_id), 'path')
+    cleaned = shared.read_path_array(const.path_array_fn(youtube_id),
+                                     cuts=cuts)
+    return (np.array(raw, dtype=float),
+            np.asarray(cleaned[['x', 'y']], dtype=float), cuts)
+
+
+def boxes_for_setting(filtered: np.ndarray, frame_count: int,
+                      video_width: int, video_height: int,
+                      cuts: Sequence[int], box_size: const.BoxSize,
+                      setting: Setting) -> Tuple[np.ndarray, np.ndarray]:
+    """Snap already filtered positions to boxes, as the method would.
+
+    Return:
+        (frame_count, 4) arrays of the boxes for each frame, and of those
+        boxes with the pans between them (as render_boxes gives).
+    """
+    box_width, box_height = box_size
+    method = bandpass_and_snapping
+    with method.settings(**setting):
+        x_frames, y_frames = method.make_frame_specs(
+            filtered[:, 0], filtered[:, 1], video_width, video_height, cuts,
+            box_width, box_height)
+        boxes = method.box_array_for_frames(
+            np.arange(-method.initial_offset,
+                      frame_count - method.initial_offset),
+            x_frames, y_frames, video_width, video_height, box_width,
+            box_height)
+        panned = method.anticipate_box_array(boxes, cuts)
+    return (boxes, panned)
+
+
+def score(raw: np.ndarray, boxes: np.ndarray,
+          panned: np.ndarray) -> Dict[str, float]:
+    """The measures of a setting's boxes (see the module docstring).
+
+    Each row of the raw path data is the center of change from its frame to
+    the next, so is scored against its frame's box.
+    """
+    frame_count = len(boxes)
+    seconds = frame_count / const.frame_rate
+    shots = 1 + int(np.count_nonzero(np.any(boxes[1:] != boxes[:-1],
+                                            axis=1)))
+    rows = min(len(raw), frame_count)
+    x, y = raw[:rows, 0], raw[:rows, 1]
+    box = panned[:rows]
+    changed = ~np.isnan(x) & (x >= shared.min_value_x)
+    inside = changed & (x >= box[:, 0]) & (x < box[:, 2]) & (
+        y >= box[:, 1]) & (y < box[:, 3])
+    motion = np.hypot(*np.diff(panned[:, :2], axis=0).T).sum()
+    return {
+        'shots': shots,
+        'mean_shot_seconds': seconds / shots if frame_count else 0.0,
+        'change_inside': float(np.count_nonzero(inside) /
+                               max(np.count_nonzero(changed), 1)),
+        'motion_per_second': float(motion) / seconds if seconds else 0.0,
+    }
+
+
+def set_data(data: Optional[SweepData]) -> None:
+    """Set the data evaluate uses; the initializer of each worker."""
+    global _data
+    _data = data
+
+
+def evaluate(setting: Setting) -> Dict[str, Any]:
+    """Score one setting: the setting, with its measures added."""
+    data = _data
+    assert data is not None, 'set_data has not been called'
+    boxes, panned = boxes_for_setting(
+        data.filtered[setting['freq_cutoff']], data.frame_count,
+        data.video_width, data.video_height, data.cuts, data.box_size,
+        setting)
+    return dict(setting, **score(data.raw, boxes, panned))
+
+
+def sweep(youtube_id: str, settings: Sequence[Setting],
+          box_size: const.BoxSize = const.box_size,
+          workers: int = 1) -> List[Dict[str, Any]]:
+    """Score each of settings on a video whose path data has been computed.
+
+    The settings are run in a pool of workers processes, which are each sent
+    the path data once.
+
+    Return:
+        each setting (with every setting filled in, as grid does), with its
+        measures added, in the order given.
+    """
+    settings = [dict(current_setting(), **setting) for setting in settings]
+    raw, cleaned, cuts = load_path(youtube_id)
+    frame_count = image_processing.n_frames(youtube_id)
+    with instrument.stage('filter'):
+        filtered = {}  # type: Dict[float, np.ndarray]
+        for cutoff in sorted(set(s['freq_cutoff'] for s in settings)):
+            with bandpass_and_snapping.settings(freq_cutoff=cutoff):
+                filtered[cutoff] = bandpass_and_snapping.filter_positions(
+                    cleaned, cuts)
+        instrument.count('frames', len(cleaned) * len(filtered))
+    data = SweepData(filtered, raw, cuts, frame_count, const.frame_width,
+                     const.frame_height, box_size)
+    with instrument.stage('evaluate'):
+        if workers == 1:
+            set_data(data)
+            try:
+                results = [evaluate(setting) for setting in settings]
+            finally:
+                set_data(None)
+        else:
+            with concurrent.futures.ProcessPoolExecutor(
+                    workers, initializer=set_data,
+                    initargs=(data,)) as executor:
+                results = list(executor.map(evaluate, settings))
+        instrument.count('frames', frame_count * len(settings))
+    return results
+
+
+def parse_values(text: str) -> List[float]:
+    """Parse a comma-separated list of numbers, like '60,80,100'.
+
+    Whole numbers are ints, since the settings other than freq_cutoff are
+    counts of frames or pixels.
+    """
+    values = []  # type: List[float]
+    for part in text.split(','):
+        number = float(part)
+        values.append(int(number) if number.is_integer() and
+                      '.' not in part else number)
+    return values
@@ -0,0 +1,260 @@
+"""Track the crop box online, for live streams.
+
+The offline pipeline filters the whole path at once and snaps to windows that
+can depend on the entire future of the video.  StreamingTracker instead takes
+frames (or center of change positions) one at a time and emits each frame's
+box once `lookahead` more frames have arrived, so the latency is bounded.
+
+It uses the same filter and snapping rules as bandpass_and_snapping, keeping
+the Butterworth filter's state between positions.  A snapping window that is
+still open when its first frame must be emitted is committed to the box it
+has so far, and closes as soon as the path leaves that box.  With enough
+lookahead every window closes before it is needed, and the boxes are exactly
+those of the offline method.
+"""
+import collections
+from typing import Deque, Iterator, List, Optional, Tuple
+
+import numpy as np
+import scipy.signal as sig
+
+from mvz import const
+from mvz import frames
+from mvz import image_processing
+from mvz.methods import bandpass_and_snapping as bas
+from mvz.methods import shared
+
+default_lookahead = 2 * bas.anticipation_time
+
+
+class _Window(object):
+    """A snapping window along one axis."""
+
+    def __init__(self, first_frame: int) -> None:
+        self.first_frame = first_frame
+        self.minval = float('Infinity')
+        self.maxval = 0.0
+        self.committed = None  # type: Optional[float]
+        self.closed = False
+
+    def add(self, value: float, window_size: int) -> bool:
+        """Extend the window by a value; return False if it doesn't fit.
+
+        This follows bas.choose_window: NaNs are ignored and the maximum is
+        never below zero. A closed window takes nothing more.
+        """
+        if self.closed:
+            return False
+        minval = self.minval if self.committed is None else self.committed
+        maxval = max(self.maxval, value) if value == value else self.maxval
+        if value == value and value < minval:
+            if self.committed is not None:
+                return False
+            minval = value
+        if not (maxval - minval < window_size):
+            return False
+        self.maxval = maxval
+        if self.committed is None:
+            self.minval = minval
+        return True
+
+    def start(self) -> float:
+        return self.committed if self.committed is not None else self.minval
+
+
+class _AxisSnapper(object):
+    """Online snapping windows for one axis."""
+
+    def __init__(self, box_size: int, max_size: int) -> None:
+        self.box_size = box_size
+        self.max_size = max_size
+        self.windows = collections.deque()  # type: Deque[_Window]
+        self.frame_count = 0
+
+    def add(self, value: float) -> None:
+        if not self.windows or not self.windows[-1].add(
+                value, self.box_size - bas.padding):
+            if self.windows:
+                self.windows[-1].closed = True
+            window = _Window(self.frame_count)
+            if not window.add(value, self.box_size - bas.padding):
+                # As in make_frame_specs, a point no window can hold gets a
+                # window of its own.
+                window.closed = True
+            self.windows.append(window)
+        self.frame_count += 1
+
+    def edge(self, frame: int) -> int:
+        """Commit to the box edge for a frame; frames must come in order."""
+        while len(self.windows) > 1 and self.windows[1].first_frame <= frame:
+            self.windows.popleft()
+        window = self.windows[0]
+        if not window.closed and window.committed is None:
+            window.committed = window.minval
+        start = bas.clamp_window_start(window.start(), self.box_size,
+                                       self.max_size)
+        return int(bas.box_edges(np.array([start]), self.box_size,
+                                 self.max_size)[0])
+
+
+class StreamingTracker(object):
+    """Turn a stream of frames or positions into a stream of crop boxes.
+
+    Each push returns the boxes that are now final, as (frame index, box)
+    pairs.  Call flush at the end of the stream for the rest.
+    """
+
+    def __init__(self, video_width: int = const.frame_width,
+                 video_height: int = const.frame_height,
+                 lookahead: int = default_lookahead,
+                 anticipate: bool = True, analysis_scale: int = 1,
+                 mask: Optional[np.ndarray] = None) -> None:
+        """
+        Args:
+            lookahead: the number of frames after a frame to wait for before
+                emitting its box.  If anticipate is set, anticipation_time of
+                those are used to pan ahead of changes, and the rest to see
+                where the snapping windows end.
+        """
+        self.anticipation = bas.anticipation_time if anticipate else 0
+        if lookahead < self.anticipation:
+            raise ValueError('lookahead must be at least %d frames to '
+                             'anticipate changes' % self.anticipation)
+        self.video_width = video_width
+        self.video_height = video_height
+        self.snap_lookahead = lookahead - self.anticipation
+        self.analysis_scale = image_processing.check_analysis_scale(
+            analysis_scale)
+        self.mask = mask
+
+        self.b, self.a = sig.butter(6, bas.freq_cutoff)
+        # Zero initial state, as when filtering the whole path at once.
+        self.zi_x = np.zeros(max(len(self.a), len(self.b)) - 1)
+        self.zi_y = np.zeros_like(self.zi_x)
+        self.last_position = None  # type: Optional[Tuple[float, float]]
+
+        self.x_snapper = _AxisSnapper(const.box_width, video_width)
+        self.y_snapper = _AxisSnapper(const.box_height, video_height)
+        self.snapped = 0
+        self.last_box = None  # type: Optional[const.BoundingBox]
+        self.pending = collections.deque()  # type: Deque[const.BoundingBox]
+        self.emitted = 0
+
+        self.frame_batch = None  # type: Optional[np.ndarray]
+        self.xvec = self.yvec = None  # type: Optional[np.ndarray]
+        self.weights = None  # type: Optional[np.ndarray]
+
+    def _clean(self, x: float, y: float) -> Tuple[float, float]:
+        """Drop outlying points, as shared.clean_path_data does.
+
+        Unlike offline, a missing position before any real one is taken to be
+        the center of the video, so that the filter state stays finite.
+        """
+        if x != x or y != y or x < shared.min_value_x:
+            if self.last_position is None:
+                return (self.video_width / 2, self.video_height / 2)
+            return self.last_position
+        self.last_position = (x, y)
+        return self.last_position
+
+    def push_position(self, x: float, y: float) -> (
+            List[Tuple[int, const.BoundingBox]]):
+        """Add the center of change between the next pair of frames."""
+        x, y = self._clean(x, y)
+        x_filt, self.zi_x = sig.lfilter(self.b, self.a, [x], zi=self.zi_x)
+        y_filt, self.zi_y = sig.lfilter(self.b, self.a, [y], zi=self.zi_y)
+        self.x_snapper.add(x_filt[0])
+        self.y_snapper.add(y_filt[0])
+        ready = self.x_snapper.frame_count - self.snap_lookahead
+        return self._snap_until(ready)
+
+    def push_frame(self, frame: np.ndarray) -> (
+            List[Tuple[int, const.BoundingBox]]):
+        """Add the next frame, as a (height, width, 3) uint8 array."""
+        frame = image_processing.bin_frame(frame, self.analysis_scale)
+        if self.frame_batch is None:
+            self.frame_batch = np.empty((2,) + frame.shape, dtype=frame.dtype)
+            self.xvec = image_processing.bin_centers(frame.shape[1],
+                                                     self.analysis_scale)
+            self.yvec = image_processing.bin_centers(frame.shape[0],
+                                                     self.analysis_scale)
+            if self.mask is not None:
+                self.weights = image_processing.bin_mask(
+                    self.mask, self.analysis_scale)
+            self.frame_batch[0] = frame
+            return []
+        self.frame_batch[1] = frame
+        energy = image_processing.change_energy(self.frame_batch)
+        if self.weights is not None:
+            energy = energy * self.weights
+        (x, y), = image_processing.weighted_average_positions(
+            energy, self.xvec, self.yvec)
+        self.frame_batch[0] = self.frame_batch[1]
+        return self.push_position(float(x), float(y))
+
+    def flush(self) -> List[Tuple[int, const.BoundingBox]]:
+        """Emit the boxes for the rest of the frames.
+
+        n positions describe n + 1 frames, so this includes one box more than
+        there were positions.
+        """
+        if self.x_snapper.frame_count == 0:
+            return []
+        boxes = self._snap_until(self.x_snapper.frame_count)
+        # The last frame has no position of its own; it keeps the last box.
+        boxes.extend(self._push_box(self.last_box))
+        # As in anticipate_changes, there's no anticipating past the end.
+        while self.pending:
+            boxes.append((self.emitted, self.pending.popleft()))
+            self.emitted += 1
+        return boxes
+
+    def _snap_until(self, frame_count: int) -> (
+            List[Tuple[int, const.BoundingBox]]):
+        boxes = []
+        while self.snapped < frame_count:
+            left = self.x_snapper.edge(self.snapped)
+            top = self.y_snapper.edge(self.snapped)
+            self.snapped += 1
+            boxes.extend(self._push_box((left, top, left + const.box_width,
+                                         top + const.box_height)))
+        return boxes
+
+    def _push_box(self, box: const.BoundingBox) -> (
+            List[Tuple[int, const.BoundingBox]]):
+        self.last_box = box
+        self.pending.append(box)
+        if len(self.pending) <= self.anticipation:
+            return []
+        result = (self.emitted, self._anticipated())
+        self.pending.popleft()
+        self.emitted += 1
+        return [result]
+
+    def _anticipated(self) -> const.BoundingBox:
+        """The first pending box, panning ahead of any change in view.
+
+        This is anticipate_changes for one frame, given the
+        anticipation_time boxes after it.
+        """
+        box = self.pending[0]
+        if self.anticipation == 0 or box == self.pending[-1]:
+            return box
+        upcoming = list(self.pending)
+        distance = bas.distance_to_next_change(upcoming, 0)
+        return bas.interpolate(box, upcoming[distance], distance)
+
+
+def track_video(video_fn: str, lookahead: int = default_lookahead,
+                realtime: bool = False, analysis_scale: int = 1,
+                mask: Optional[np.ndarray] = None) -> (
+        Iterator[Tuple[int, const.BoundingBox]]):
+    """Track a video file or stream url, yielding boxes as they are final.
+
+    With realtime set, a file is replayed at its frame rate, as if live.
+    """
+    tracker = StreamingTracker(lookahead=lookahead,
+                               analysis_scale=analysis_scale, mask=mask)
+    for frame in frames.read_video_frames(video_fn, realtime=realtime):
+        yield from tracker.push_frame(frame)
+    yield from tracker.flush()
@@ -0,0 +1,77 @@
+import contextlib
+import os.path
+import shutil
+import tempfile
+
+import nose.tools as n
+import numpy as np
+
+from mvz import array_file
+from mvz.methods import shared
+
+
+@contextlib.contextmanager
+def _temp_dir():
+    dirname = tempfile.mkdtemp()
+    try:
+        yield dirname
+    finally:
+        shutil.rmtree(dirname)
+
+
+def path_round_trip_test():
+    positions = np.random.RandomState(0).uniform(100, 700, (1000, 2))
+    positions[10] = float('NaN')
+    with _temp_dir() as dirname:
+        fn = os.path.join(dirname, 'path.array')
+        array_file.write_path(fn, positions, 1280, 720)
+        n.eq_(os.path.getsize(fn), array_file.header_size + 16 * 1000)
+        header, data = array_file.open_array(fn, 'path')
+        n.eq_((header.rows, header.frame_count, header.video_width),
+              (1000, 1001, 1280))
+        np.testing.assert_array_equal(data, positions)
+
+        sliced = shared.read_path_array(fn, 500, 600)
+        np.testing.assert_array_equal(sliced.values, positions[500:600])
+
+
+def boxes_round_trip_test():
+    boxes = [(0, 0, 400, 400), (10, 20, 410, 420), (880, 320, 1280, 720)]
+    keyframe_boxes = [(i / 301, left, top, right, bottom)
+                      for i, (left, top, right, bottom) in zip(
+                          (0, 17, 300), boxes)]
+    with _temp_dir() as dirname:
+        fn = os.path.join(dirname, 'boxes.array')
+        for expected in (boxes, keyframe_boxes):
+            array_file.write_boxes(fn, expected, 301, 1280, 720)
+            actual, header = array_file.read_boxes(fn)
+            n.eq_(actual, expected)
+            n.eq_(header.frame_count, 301)
+        n.eq_(array_file.read_header(fn).kind, 'keyboxes')
+
+
+def empty_and_wrong_kind_test():
+    with _temp_dir() as dirname:
+        fn = os.path.join(dirname, 'path.array')
+        array_file.write_path(fn, [], 1280, 720)
+        n.eq_(array_file.open_array(fn)[1].shape, (0, 2))
+        with n.assert_raises(ValueError):
+            array_file.read_boxes(fn)
+        with open(fn, 'wb') as f:
+            f.write(b'0,0\n' * 100)
+        with n.assert_raises(ValueError):
+            array_file.open_array(fn)
+
+
+def write_chunks_test():
+    boxes = np.random.RandomState(1).randint(0, 880, (1000, 4))
+    with _temp_dir() as dirname:
+        fn = os.path.join(dirname, 'boxes.array')
+        rows = array_file.write_chunks(
+            fn, 'boxes', (boxes[i:i + 300] for i in range(0, 1000, 300)), 4,
+            1280, 720, 1000)
+        n.eq_(rows, 1000)
+        header, data = array_file.open_array(fn, 'boxes')
+        n.eq_((header.rows, header.columns, header.frame_count),
+              (1000, 4, 1000))
+        np.testing.assert_array_equal(data, boxes)
@@ -1,6 +1,11 @@
+import funcy as fn
 import nose.tools as n
+import numpy as np
+import pandas as pd
 
+from mvz import const
 import mvz.methods.bandpass_and_snapping as bas
+from mvz.methods import shared
 
 
 def distance_to_next_change_test():
@@ -8,3 +13,226 @@ def distance_to_next_change_test():
     n.eq_(bas.distance_to_next_change(subject, 0), 3)
     n.eq_(bas.distance_to_next_change(subject, 1), 2)
     n.eq_(bas.distance_to_next_change(subject, 3), None)
+
+
+# The original implementations of the snapping stage, which the vectorized
+# ones must match exactly.
+
+def _reference_choose_window(seq, window_size):
+    prev_min = 0.0
+    minval = float('Infinity')
+    maxval = 0.0
+    index = -1
+    while (maxval - minval) < window_size:
+        index += 1
+        prev_min = minval
+        if index == len(seq):
+            break
+        minval = min(minval, seq[index])
+        maxval = max(maxval, seq[index])
+    return (prev_min, index)
+
+
+def _reference_make_frame_specs(x_filt, y_filt, video_width, video_height):
+    def make_spec(seq, box_size, max_size):
+        frames = []
+        while len(seq) > 0:
+            start, idx = _reference_choose_window(seq, box_size - bas.padding)
+            if start < 0:
+                start = 0
+            if start > max_size - box_size:
+                start = max_size - box_size
+            frames.append((start, idx))
+            seq = seq[idx:]
+        return frames
+
+    return (make_spec(x_filt, const.box_width, video_width),
+            make_spec(y_filt, const.box_height, video_height))
+
+
+def _reference_make_boxes(min_frame, max_frame, xspec, yspec,
+                          video_width, video_height, keyframes_only=False):
+    padding = bas.padding
+    key_frames_x = [0] + list(fn.sums([frame for _, frame in xspec]))[:-1]
+    key_frames_y = [0] + list(fn.sums([frame for _, frame in yspec]))[:-1]
+    all_keyframes = list(sorted(list(
+        set(key_frames_x).union(set(key_frames_y)))))
+
+    def key_frame_index(key_frames, frame):
+        for ki, k in enumerate(key_frames):
+            if k > frame:
+                return ki - 1
+        return len(key_frames) - 1
+
+    def ensure_in_range(size, maxval, pos):
+        if pos - padding/2 < 0:
+            pos = padding/2
+        elif pos - padding/2 + size > maxval:
+            pos = maxval - size + padding/2
+        return pos
+
+    def positions(frames, key_frames, spec, size, maxval):
+        return [ensure_in_range(size, maxval, int(round(
+            spec[key_frame_index(key_frames, frame)][0])))
+            for frame in frames]
+
+    def box(pos_x, pos_y):
+        return tuple(int(round(coord)) for coord in (
+            pos_x - padding/2, pos_y - padding/2,
+            pos_x - padding/2 + const.box_width,
+            pos_y - padding/2 + const.box_height))
+
+    frames = all_keyframes if keyframes_only else range(min_frame, max_frame)
+    frame_pos_x = positions(frames, key_frames_x, xspec, const.box_width,
+                            video_width)
+    frame_pos_y = positions(frames, key_frames_y, yspec, const.box_height,
+                            video_height)
+    if keyframes_only:
+        return [(float(frame) / len(range(min_frame, max_frame)),) +
+                box(pos_x, pos_y)
+                for frame, pos_x, pos_y in zip(frames, frame_pos_x,
+                                               frame_pos_y)]
+    return [box(pos_x, pos_y) for pos_x, pos_y in zip(frame_pos_x,
+                                                      frame_pos_y)]
+
+
+def _random_path(count, seed, nan_fraction=0.0):
+    rng = np.random.RandomState(seed)
+    x = 640 + np.cumsum(rng.normal(0, 15, count))
+    y = 360 + np.cumsum(rng.normal(0, 10, count))
+    # Occasional jumps, like moving to a new part of the board.
+    jumps = rng.rand(count) < 0.01
+    x[jumps] = rng.uniform(0, 1280, jumps.sum())
+    y[jumps] = rng.uniform(0, 720, jumps.sum())
+    data = pd.DataFrame({'x': np.clip(x, 0, 1280), 'y': np.clip(y, 0, 720)})
+    data[rng.rand(count) < nan_fraction] = float('NaN')
+    return data
+
+
+def choose_window_matches_reference_test():
+    rng = np.random.RandomState(1)
+    for _ in range(50):
+        seq = rng.uniform(-50, 1000, rng.randint(1, 400)).cumsum() % 1200
+        seq[rng.rand(len(seq)) < 0.1] = float('NaN')
+        n.eq_(bas.choose_window(seq, 320), _reference_choose_window(seq, 320))
+        n.eq_(bas.choose_window(seq, 320, 1),
+              _reference_choose_window(seq[1:], 320))
+
+
+def make_frame_specs_matches_reference_test():
+    for seed, nan_fraction in [(0, 0.0), (1, 0.0), (2, 0.05), (3, 0.3)]:
+        data = shared.clean_path_data(_random_path(3000, seed, nan_fraction))
+        x_filt, y_filt = bas.bandpass_filter_data(data)
+        n.eq_(bas.make_frame_specs(x_filt, y_filt, 1280, 720),
+              _reference_make_frame_specs(x_filt, y_filt, 1280, 720))
+
+
+def make_boxes_matches_reference_test():
+    for seed in range(3):
+        data = shared.clean_path_data(_random_path(2000, seed))
+        x_filt, y_filt = bas.bandpass_filter_data(data)
+        xspec, yspec = bas.make_frame_specs(x_filt, y_filt, 1280, 720)
+        for keyframes_only in (True, False):
+            actual = bas.make_boxes_from_frame_spec(
+                0, 2001, xspec, yspec, 1280, 720, keyframes_only)
+            expected = _reference_make_boxes(
+                0, 2001, xspec, yspec, 1280, 720, keyframes_only)
+            n.eq_(actual, expected)
+            n.eq_([type(c) for c in actual[-1]],
+                  [type(c) for c in expected[-1]])
+
+
+def _reference_anticipate_changes(boxes):
+    should_anticipate = [
+        idx < len(boxes) - bas.anticipation_time and
+        boxes[idx] != boxes[idx + bas.anticipation_time]
+        for idx in range(len(boxes))]
+
+    new_boxes = []
+    for i, box in enumerate(boxes):
+        if should_anticipate[i]:
+            dist = bas.distance_to_next_change(boxes, i)
+            result = bas.interpolate(box, boxes[i + dist], dist)
+        else:
+            result = box
+        new_boxes.append(result)
+    return new_boxes
+
+
+def _random_boxes(count, seed):
+    rng = np.random.RandomState(seed)
+    boxes = []
+    while len(boxes) < count:
+        left, top = rng.randint(0, 880), rng.randint(0, 320)
+        box = (left, top, left + const.box_width, top + const.box_height)
+        boxes.extend([box] * rng.randint(1, 80))
+    return boxes[:count]
+
+
+def anticipate_changes_matches_reference_test():
+    for count in (0, 1, bas.anticipation_time - 5, bas.anticipation_time,
+                  bas.anticipation_time + 1, 500, 3000):
+        for seed in range(3):
+            boxes = _random_boxes(count, seed)
+            n.eq_(bas.anticipate_changes(boxes),
+                  _reference_anticipate_changes(boxes))
+
+
+def anticipate_changes_zero_time_test():
+    boxes = _random_boxes(500, 7)
+    with bas.settings(anticipation_time=0):
+        n.eq_(bas.anticipate_changes(boxes), boxes)
+        n.eq_(bas.anticipate_changes(boxes),
+              _reference_anticipate_changes(boxes))
+
+
+def anticipate_changes_real_boxes_test():
+    data = shared.clean_path_data(_random_path(2000, 4))
+    boxes = bas.boxes_for_path_data(data, 2001, 1280, 720)
+    n.eq_(bas.anticipate_changes(boxes), _reference_anticipate_changes(boxes))
+
+
+def clean_path_data_cuts_test():
+    nan = float('NaN')
+    data = pd.DataFrame([[nan, nan], [200.0, 300.0], [nan, nan], [nan, nan],
+                         [500.0, 100.0], [nan, nan]], columns=['x', 'y'])
+    cleaned = shared.clean_path_data(data.copy(), cuts=[3])
+    n.eq_(cleaned['x'].tolist(), [200.0, 200.0, 200.0, 500.0, 500.0, 500.0])
+    cleaned = shared.clean_path_data(data.copy())
+    n.eq_(cleaned['x'].tolist(), [200.0, 200.0, 200.0, 200.0, 500.0, 500.0])
+
+
+def cuts_split_windows_test():
+    data = pd.DataFrame([[300.0, 200.0]] * 100 + [[900.0, 500.0]] * 100,
+                        columns=['x', 'y'])
+    x_filt, y_filt = bas.bandpass_filter_data(data, cuts=[100])
+    # The filter settles at once on the new scene, rather than ringing.
+    np.testing.assert_allclose(x_filt[100:], 900.0)
+    np.testing.assert_allclose(y_filt[100:], 500.0)
+    xspec, yspec = bas.make_frame_specs(x_filt, y_filt, 1280, 720, cuts=[100])
+    n.eq_(fn.lpluck(1, xspec)[-1], 100)
+    boxes = bas.boxes_for_path_data(data, 201, 1280, 720, cuts=[100])
+    n.eq_(len(set(boxes[100:200])), 1)
+    # The box jumps at the cut, rather than panning ahead of it.
+    rendered = bas.render_boxes(boxes, cuts=[100])
+    n.eq_(rendered[60:100], [rendered[60]] * 40)
+    n.assert_not_equal(rendered[99], rendered[100])
+    n.assert_not_equal(bas.render_boxes(boxes)[99], rendered[99])
+
+
+def boxes_for_sizes_test():
+    data = shared.clean_path_data(_random_path(1000, 5))
+    default, tall = bas.boxes_for_sizes(data, 1001, 1280, 720,
+                                        [const.box_size, (200, 600)])
+    n.eq_(default, bas.boxes_for_path_data(data, 1001, 1280, 720))
+    n.eq_({(right - left, bottom - top) for left, top, right, bottom in tall},
+          {(200, 600)})
+    assert all(0 <= box[0] and box[2] <= 1280 + bas.padding for box in tall)
+
+
+def frame_boxes_from_keyframes_test():
+    data = shared.clean_path_data(_random_path(1000, 6))
+    keyframes = bas.boxes_for_path_data(data, 1001, 1280, 720,
+                                        keyframes_only=True)
+    n.eq_(shared.frame_boxes_from_keyframes(keyframes, 1001),
+          bas.boxes_for_path_data(data, 1001, 1280, 720))
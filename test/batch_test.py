@@ -0,0 +1,64 @@
+import json
+import os
+import shutil
+import tempfile
+
+import nose.tools as n
+
+from mvz import batch
+from mvz import benchmark
+from mvz import const
+
+
+def read_ids_test():
+    tmpdir = tempfile.mkdtemp()
+    try:
+        ids_fn = os.path.join(tmpdir, 'ids.txt')
+        with open(ids_fn, 'w') as f:
+            f.write('abc\n# a comment\n\n  def  # and another\n')
+        n.eq_(batch.read_ids(ids_fn), ['abc', 'def'])
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def run_test():
+    tmpdir = tempfile.mkdtemp()
+    old_url = const.url_for_youtube_id
+    # Nothing is fetched: videos already in the cache are taken as
+    # downloaded, and anything else fails to download.
+    const.url_for_youtube_id = 'file:///nonexistent/%(yt_id)s.mp4'
+    try:
+        with benchmark.working_dir(tmpdir):
+            for seed, youtube_id in enumerate(['good1', 'good2']):
+                benchmark.write_video(const.video_fn(youtube_id), 320, 180,
+                                      1, seed)
+            with open(const.video_fn('corrupt'), 'wb') as f:
+                f.write(b'not a video' * 100)
+
+            manifest = batch.run(
+                ['good1', 'missing', 'corrupt', 'good2', 'good1'],
+                processes=2, output_format='json')
+
+            # One entry per video, in the order given, and the failures
+            # don't stop the others.
+            n.eq_([(entry['youtube_id'], entry['status'], entry.get('stage'))
+                   for entry in manifest],
+                  [('good1', 'ok', None), ('missing', 'failed', 'download'),
+                   ('corrupt', 'failed', 'process'), ('good2', 'ok', None)])
+            n.ok_('Traceback' in manifest[1]['error'])
+            n.ok_('Traceback' in manifest[2]['error'])
+            for entry in (manifest[0], manifest[3]):
+                n.eq_(entry['outputs'], [entry['output']])
+                with open(entry['output']) as f:
+                    n.eq_(len(json.load(f)), entry['boxes'])
+                n.ok_(entry['boxes'] > 0)
+
+            with open(batch.manifest_fn()) as f:
+                written = json.load(f)
+            n.eq_(written['videos'], manifest)
+            n.eq_((written['succeeded'], written['failed']), (2, 2))
+            n.eq_(written['method'], 'bandpass_and_snapping')
+            n.eq_(written['box_sizes'], [list(const.box_size)])
+    finally:
+        const.url_for_youtube_id = old_url
+        shutil.rmtree(tmpdir)
@@ -0,0 +1,45 @@
+import nose.tools as n
+import numpy as np
+
+from mvz import benchmark
+from mvz import image_processing as ip
+
+
+def _copies(width, height, frame_count, seed):
+    return [frame.copy() for frame in benchmark.blackboard_frames(
+        width, height, frame_count, seed)]
+
+
+def blackboard_frames_test():
+    frames = _copies(160, 90, 60, seed=3)
+    n.eq_(frames[0].shape, (90, 160, 3))
+    n.eq_(frames[0].dtype, np.uint8)
+    # The same seed gives the same video, and a different one doesn't.
+    np.testing.assert_array_equal(np.array(frames),
+                                  np.array(_copies(160, 90, 60, seed=3)))
+    assert not np.array_equal(np.array(frames),
+                              np.array(_copies(160, 90, 60, seed=4)))
+    # The cursor keeps moving, so there is nearly always a center of change.
+    positions = list(ip.center_of_change_positions(frames))
+    assert np.mean(np.isnan(positions)) < 0.1
+
+
+def time_stage_test():
+    result, stage = benchmark.time_stage(lambda: np.ones(1000).sum(), 10,
+                                         repeat=2)
+    n.eq_(result, 1000)
+    n.eq_(stage['frames'], 10)
+    assert stage['peak_bytes'] >= 8000
+    assert stage['frames_per_second'] > 0
+    _, stage = benchmark.time_stage(lambda: None, 10, memory=False)
+    n.eq_(stage['peak_bytes'], None)
+
+
+def compare_test():
+    old = {'stages': {'a': {'seconds': 2.0, 'peak_bytes': 100},
+                      'b': {'seconds': 1.0, 'peak_bytes': 100}}}
+    new = {'stages': {'a': {'seconds': 1.0, 'peak_bytes': 200},
+                      'c': {'seconds': 1.0, 'peak_bytes': 100}}}
+    n.eq_(benchmark.compare(old, new), [{
+        'stage': 'a', 'old_seconds': 2.0, 'new_seconds': 1.0,
+        'speedup': 2.0, 'memory_ratio': 2.0}])
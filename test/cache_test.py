@@ -0,0 +1,68 @@
+import contextlib
+import os
+import shutil
+import tempfile
+
+import nose.tools as n
+
+from mvz import cache
+
+
+@contextlib.contextmanager
+def _store_dir():
+    old_store_dir = cache.store_dir
+    cache.store_dir = tempfile.mkdtemp()
+    try:
+        yield cache.store_dir
+    finally:
+        shutil.rmtree(cache.store_dir)
+        cache.store_dir = old_store_dir
+
+
+def _add_entry(params, size, last_access):
+    entry = cache.open_entry('path', params, 'abc')
+    with open(os.path.join(entry, 'data'), 'wb') as f:
+        f.write(b'x' * size)
+    cache.finish(entry)
+    meta = cache.read_meta(entry)
+    meta['last_access'] = last_access
+    cache._write_meta(entry, meta)
+    return entry
+
+
+def lookup_test():
+    with _store_dir():
+        params = {'video': 'abc', 'analysis_scale': 1}
+        entry = cache.open_entry('path', params, 'abc')
+        n.eq_(cache.lookup('path', params), None)
+        cache.finish(entry)
+        n.eq_(cache.lookup('path', params), entry)
+        n.eq_(cache.lookup('path', dict(params, analysis_scale=2)), None)
+        n.eq_(cache.lookup('boxes', params), None)
+
+
+def evict_test():
+    with _store_dir():
+        oldest = _add_entry({'n': 1}, 1000, 1.0)
+        newest = _add_entry({'n': 2}, 1000, 3.0)
+        least_recent = _add_entry({'n': 3}, 1000, 0.5)
+        removed = cache.evict(2500, keep_since=None)
+        n.eq_(removed, [os.path.basename(least_recent)])
+        removed = cache.evict(1500, keep_since=2.0)
+        n.eq_(removed, [os.path.basename(oldest)])
+        assert os.path.exists(newest)
+
+
+def evict_incomplete_test():
+    with _store_dir():
+        # Another process is still writing this entry, which it created long
+        # before the current run started.
+        writing = cache.open_entry('path', {'n': 1}, 'abc')
+        with open(os.path.join(writing, 'data'), 'wb') as f:
+            f.write(b'x' * 1000)
+        meta = cache.read_meta(writing)
+        meta['last_access'] = 0.5
+        cache._write_meta(writing, meta)
+        old = _add_entry({'n': 2}, 1000, 1.0)
+        n.eq_(cache.evict(0, keep_since=2.0), [os.path.basename(old)])
+        assert os.path.exists(writing)
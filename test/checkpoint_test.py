@@ -0,0 +1,73 @@
+import contextlib
+import os
+import shutil
+import tempfile
+
+import nose.tools as n
+
+from mvz import checkpoint
+
+
+@contextlib.contextmanager
+def _checkpoint_fn():
+    tmpdir = tempfile.mkdtemp()
+    try:
+        yield os.path.join(tmpdir, 'path_data.bin')
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def _open(fn, settings=None, stamp=(1, 2)):
+    return checkpoint.PathCheckpoint(
+        fn, 64, 48, settings or {'analysis_scale': 1}, stamp)
+
+
+def resume_test():
+    with _checkpoint_fn() as fn:
+        ckpt = _open(fn)
+        ckpt.append(0, [(1.0, 2.0), (3.0, 4.0)], 7)
+        ckpt.append(2, [(5.0, 6.0)], 8)
+        reopened = _open(fn)
+        n.eq_(reopened.positions(), [(1.0, 2.0), (3.0, 4.0), (5.0, 6.0)])
+        n.eq_(reopened.next_frame(), 3)
+        n.eq_(reopened.chunks[-1].end_frame_crc, 8)
+        assert not reopened.is_stale()
+
+
+def partial_chunk_test():
+    with _checkpoint_fn() as fn:
+        ckpt = _open(fn)
+        ckpt.append(0, [(1.0, 2.0)], 7)
+        ckpt.append(1, [(3.0, 4.0)], 8)
+        with open(fn, 'r+b') as f:
+            f.truncate(os.path.getsize(fn) - 3)
+        reopened = _open(fn)
+        n.eq_(reopened.positions(), [(1.0, 2.0)])
+        reopened.append(1, [(5.0, 6.0)], 9)
+        n.eq_(_open(fn).positions(), [(1.0, 2.0), (5.0, 6.0)])
+
+
+def changed_settings_test():
+    with _checkpoint_fn() as fn:
+        _open(fn).append(0, [(1.0, 2.0)], 7)
+        n.eq_(_open(fn, {'analysis_scale': 2}).positions(), [])
+
+
+def stale_test():
+    with _checkpoint_fn() as fn:
+        _open(fn).append(0, [(1.0, 2.0)], 7)
+        ckpt = _open(fn, stamp=(1, 3))
+        assert ckpt.is_stale()
+        ckpt.drop_last_chunk()
+        # Dropping chunks doesn't make the rest trusted until marked current.
+        assert _open(fn, stamp=(1, 3)).is_stale()
+        ckpt.mark_current()
+        assert not _open(fn, stamp=(1, 3)).is_stale()
+
+
+def labels_test():
+    with _checkpoint_fn() as fn:
+        ckpt = _open(fn)
+        ckpt.append(0, [(1.0, 2.0), (3.0, 4.0)], 7, [0, 2])
+        ckpt.append(2, [(5.0, 6.0)], 8)
+        n.eq_(_open(fn).labels(), [0, 2, 0])
@@ -0,0 +1,113 @@
+import contextlib
+import http.server
+import os
+import re
+import shutil
+import tempfile
+import threading
+
+import nose.tools as n
+
+from mvz import downloader
+
+_video = bytes(range(256)) * 4096
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    """Serves _video, with support for Range and If-Range requests.
+
+    The server's `fail_after` list gives, for each request in turn, a number
+    of bytes after which to drop the connection.
+    """
+    etag = '"v1"'
+
+    def do_GET(self):
+        self.server.requests.append(dict(self.headers))
+        start = 0
+        match = re.match(r'bytes=(\d+)-', self.headers.get('Range', ''))
+        if match and self.headers.get('If-Range') == self.etag:
+            start = int(match.group(1))
+        body = _video[start:]
+        self.send_response(206 if start else 200)
+        self.send_header('ETag', self.etag)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        fail_after = (self.server.fail_after.pop(0)
+                      if self.server.fail_after else None)
+        if fail_after is not None:
+            self.wfile.write(body[:fail_after])
+            self.wfile.flush()
+            self.close_connection = True
+            return
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@contextlib.contextmanager
+def _server(fail_after=()):
+    server = http.server.HTTPServer(('127.0.0.1', 0), _Handler)
+    server.requests = []
+    server.fail_after = list(fail_after)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    tmpdir = tempfile.mkdtemp()
+    old_retry_delay = downloader.retry_delay
+    downloader.retry_delay = 0
+    try:
+        yield ('http://127.0.0.1:%d/video.mp4' % server.server_port,
+               os.path.join(tmpdir, 'video.mp4'), server)
+    finally:
+        downloader.retry_delay = old_retry_delay
+        server.shutdown()
+        server.server_close()
+        shutil.rmtree(tmpdir)
+
+
+def _read(fn):
+    with open(fn, 'rb') as f:
+        return f.read()
+
+
+def fetch_test():
+    with _server() as (url, fn, server):
+        downloader.fetch(url, fn)
+        assert _read(fn) == _video
+        assert not os.path.exists(fn + '.part')
+        n.eq_(len(server.requests), 1)
+
+
+def fetch_retries_and_resumes_test():
+    with _server(fail_after=[100000, 50000]) as (url, fn, server):
+        downloader.fetch(url, fn)
+        assert _read(fn) == _video
+        n.eq_(len(server.requests), 3)
+        # Only whole chunks are written, so some of each failed attempt is
+        # fetched again.
+        n.eq_(server.requests[1]['Range'],
+              'bytes=%d-' % (100000 // downloader.chunk_size *
+                             downloader.chunk_size))
+        assert 'Range' in server.requests[2]
+
+
+def fetch_resumes_partial_file_test():
+    with _server() as (url, fn, server):
+        with open(fn + '.part', 'wb') as f:
+            f.write(_video[:1000])
+        with open(fn + '.part.validator', 'w') as f:
+            f.write(_Handler.etag)
+        downloader.fetch(url, fn)
+        assert _read(fn) == _video
+        n.eq_(server.requests[0]['Range'], 'bytes=1000-')
+
+
+def fetch_restarts_changed_file_test():
+    with _server() as (url, fn, server):
+        with open(fn + '.part', 'wb') as f:
+            f.write(b'x' * 1000)
+        with open(fn + '.part.validator', 'w') as f:
+            f.write('"old"')
+        downloader.fetch(url, fn)
+        assert _read(fn) == _video
@@ -0,0 +1,61 @@
+import numpy as np
+import nose.tools as n
+import pandas as pd
+
+from mvz import const
+from mvz.methods import ewma
+from mvz.methods import shared
+
+
+def _random_positions(count, seed):
+    rng = np.random.RandomState(seed)
+    positions = rng.uniform(50, 700, (count, 2))
+    positions[rng.rand(count) < 0.3] = float('NaN')
+    positions[:5] = float('NaN')
+    return positions
+
+
+def _reference_smooth(positions, cuts):
+    data = shared.clean_path_data(
+        pd.DataFrame(positions.copy(), columns=['x', 'y']), cuts)
+    return data.groupby(shared.scene_ids(len(data), cuts)).transform(
+        lambda s: s.ewm(span=ewma.smoothing_span, adjust=False).mean()).values
+
+
+def smooth_positions_matches_pandas_test():
+    positions = _random_positions(5000, 0)
+    chunk_frames = ewma.chunk_frames
+    try:
+        for chunk_size in (chunk_frames, 1000, 7):
+            ewma.chunk_frames = chunk_size
+            for cuts in ([], [1200, 1201, 4999]):
+                smoothed = np.concatenate(list(
+                    ewma.smooth_positions(positions, cuts)))
+                np.testing.assert_allclose(
+                    smoothed, _reference_smooth(positions, cuts), atol=1e-9)
+    finally:
+        ewma.chunk_frames = chunk_frames
+
+
+def stream_boxes_test():
+    positions = _random_positions(3000, 1)
+    boxes = np.concatenate(list(ewma.stream_boxes(positions, 3001, 1280, 720)))
+    n.eq_(boxes.shape, (3001, 4))
+    assert boxes[:, :2].min() >= 0
+    assert boxes[:, 2].max() <= 1280 and boxes[:, 3].max() <= 720
+    n.eq_(set(map(tuple, boxes[:, 2:] - boxes[:, :2])), {const.box_size})
+    np.testing.assert_array_equal(boxes[-1], boxes[-2])
+
+    keyboxes = np.concatenate(list(ewma.stream_boxes(
+        positions, 3001, 1280, 720, keyframes_only=True)))
+    assert len(keyboxes) < len(boxes)
+    expanded = shared.frame_boxes_from_keyframes(
+        [(frame / 3001,) + tuple(box) for frame, *box in keyboxes.tolist()],
+        3001)
+    n.eq_(expanded, [tuple(box) for box in boxes.tolist()])
+
+
+def stream_boxes_without_positions_test():
+    boxes = np.concatenate(list(ewma.stream_boxes(
+        np.full((10, 2), float('NaN')), 11, 1280, 720, (200, 100))))
+    n.eq_(boxes.tolist(), [[540, 310, 740, 410]] * 11)
@@ -0,0 +1,54 @@
+import os
+import shutil
+import subprocess
+import tempfile
+
+import nose.tools as n
+import numpy as np
+
+from mvz import benchmark
+from mvz import const
+from mvz import filter_script
+from mvz import frames
+from mvz import generate_video
+
+
+def crop_commands_test():
+    boxes = [(0, 0, 4, 4)] * 3 + [(2, 1, 6, 5), (3, 1, 7, 5)] + [
+        (3, 1, 7, 5)] * 2
+    n.eq_(filter_script.crop_commands(boxes), [
+        '%.6f crop x 2, crop y 1;' % (2.5 / const.frame_rate),
+        '%.6f crop x 3, crop y 1;' % (3.5 / const.frame_rate),
+    ])
+    n.eq_(filter_script.crop_commands(boxes[:1]), [])
+
+
+def filter_graph_matches_crop_frame_test():
+    width, height = 128, 96
+    tmpdir = tempfile.mkdtemp()
+    try:
+        video_fn = os.path.join(tmpdir, 'board.mp4')
+        frame_count = benchmark.write_video(video_fn, width, height, 2)
+        rng = np.random.RandomState(0)
+        boxes = []
+        while len(boxes) < frame_count:
+            left, top = rng.randint(0, width - 32), rng.randint(0, height - 24)
+            boxes.extend([(left, top, left + 32, top + 24)] *
+                         rng.randint(1, 6))
+        boxes = boxes[:frame_count]
+        script_fn = os.path.join(tmpdir, 'crop.ffmpeg')
+        filter_script.write(script_fn, boxes, width, height)
+        output = subprocess.check_output([
+            'ffmpeg', '-v', 'error', '-copyts', '-i', video_fn,
+            '-filter_script:v', script_fn, '-f', 'rawvideo',
+            '-pix_fmt', 'rgb24', '-'])
+        cropped = np.frombuffer(output, dtype=np.uint8).reshape(
+            (-1, 24, 32, 3))
+        n.eq_(len(cropped), frame_count)
+        out = np.empty((24, 32, 3), dtype=np.uint8)
+        for i, (frame, box) in enumerate(zip(
+                frames.read_video_frames(video_fn, width, height), boxes)):
+            np.testing.assert_array_equal(
+                cropped[i], generate_video.crop_frame(frame, box, out))
+    finally:
+        shutil.rmtree(tmpdir)
@@ -0,0 +1,75 @@
+import contextlib
+
+import funcy as fn
+import nose.tools as n
+import numpy as np
+
+from mvz import benchmark
+from mvz import const
+from mvz import downloader
+from mvz import frames
+
+
+@contextlib.contextmanager
+def _video(seconds):
+    """A downloaded synthetic video, 'abc'; yield its number of frames."""
+    with benchmark.temporary_video('abc', seconds, 640, 360) as frame_count:
+        downloader.download('abc')
+        yield frame_count
+
+
+def _decode(**kwargs):
+    return [frame.copy() for frame in frames.read_video_frames(
+        const.video_fn('abc'), 320, 180, **kwargs)]
+
+
+def read_video_frames_seek_test():
+    with _video(3) as frame_count:
+        all_frames = _decode()
+        n.eq_(len(all_frames), frame_count)
+        # Frames differ from one another, so a frame out of place shows.
+        n.ok_(all(np.any(a != b) for a, b in fn.pairwise(all_frames)))
+        # Within seek_margin of the start, past it, and at and past the end.
+        for start_frame in (1, 7, 16, 31, frame_count - 1, frame_count):
+            for frame_count_arg in (None, 5):
+                expected = all_frames[start_frame:][:frame_count_arg]
+                actual = _decode(start_frame=start_frame,
+                                 frame_count=frame_count_arg)
+                n.eq_(len(actual), len(expected))
+                for a, b in zip(actual, expected):
+                    np.testing.assert_array_equal(a, b)
+
+
+def read_video_frames_ring_buffer_test():
+    with _video(1) as frame_count:
+        all_frames = _decode()
+        for n_buffers in (2, 3):
+            stream = frames.read_video_frames(
+                const.video_fn('abc'), 320, 180, n_buffers=n_buffers)
+            window = []
+            buffer_ids = set()
+            for i, frame in enumerate(stream):
+                buffer_ids.add(id(frame))
+                window = (window + [frame])[-n_buffers:]
+                # The last n_buffers frames are all still intact.
+                for j, kept in enumerate(window, i + 1 - len(window)):
+                    np.testing.assert_array_equal(kept, all_frames[j])
+            n.eq_(i + 1, frame_count)
+            n.eq_(len(buffer_ids), n_buffers)
+
+
+def frame_cache_matches_decoding_test():
+    with _video(2) as frame_count:
+        n.ok_(not frames.has_frame_cache('abc'))
+        decoded = [frame.copy() for frame in frames.get_frames('abc')]
+        n.eq_(frames.count_frames('abc'), frame_count)
+        downloader.download('abc', cache_frames=True)
+        n.ok_(frames.has_frame_cache('abc'))
+        n.eq_(frames.count_frames('abc'), frame_count)
+        for start_frame, count in ((0, None), (5, 10), (frame_count - 3,
+                                                        None)):
+            cached = list(frames.get_frames('abc', count, start_frame))
+            expected = decoded[start_frame:][:count]
+            n.eq_(len(cached), len(expected))
+            for a, b in zip(cached, expected):
+                np.testing.assert_array_equal(a, b)
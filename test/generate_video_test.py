@@ -0,0 +1,40 @@
+import os
+import shutil
+import tempfile
+
+import nose.tools as n
+import numpy as np
+from PIL import Image
+
+from mvz import frames as frames_module
+from mvz import generate_video
+
+
+def crop_frame_matches_pil_test():
+    rng = np.random.RandomState(0)
+    frame = rng.randint(0, 256, (48, 64, 3)).astype(np.uint8)
+    out = np.empty((20, 30, 3), dtype=np.uint8)
+    for box in [(0, 0, 30, 20), (34, 28, 64, 48), (-5, -3, 25, 17),
+                (50, 40, 80, 60)]:
+        expected = np.asarray(Image.fromarray(frame).crop(box))
+        np.testing.assert_array_equal(
+            generate_video.crop_frame(frame, box, out), expected)
+
+
+def encode_cropped_sizes_test():
+    frames = [np.full((48, 64, 3), i * 20, dtype=np.uint8) for i in range(5)]
+    tmpdir = tempfile.mkdtemp()
+    try:
+        outputs = [([(0, 0, 32, 16)] * 5, os.path.join(tmpdir, 'a.mp4'),
+                    (32, 16)),
+                   ([(10, 4, 26, 36)] * 5, os.path.join(tmpdir, 'b.mp4'),
+                    (16, 32))]
+        generate_video.encode_cropped_sizes(iter(frames), outputs)
+        for _, video_fn, (width, height) in outputs:
+            decoded = [frame.copy() for frame in
+                       frames_module.read_video_frames(video_fn, width,
+                                                       height)]
+            n.eq_(len(decoded), 5)
+            n.eq_(decoded[0].shape, (height, width, 3))
+    finally:
+        shutil.rmtree(tmpdir)
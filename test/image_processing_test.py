@@ -0,0 +1,350 @@
+import contextlib
+import os
+import shutil
+import subprocess
+import tempfile
+
+import funcy as fn
+import nose.tools as n
+import numpy as np
+from PIL import Image
+
+from mvz import array_file
+from mvz import benchmark
+from mvz import cache
+from mvz import const
+from mvz import downloader
+from mvz import frames as mvz_frames
+from mvz import generate_video
+from mvz import image_processing as ip
+
+
+def _random_frames(count, width=64, height=48, seed=0):
+    rng = np.random.RandomState(seed)
+    return [rng.randint(0, 256, (height, width, 3)).astype(np.uint8)
+            for _ in range(count)]
+
+
+def _reference_positions(frames):
+    height, width = frames[0].shape[:2]
+    return [ip.weighted_average_pos(ip.image_squared_difference(pair),
+                                    width, height)
+            for pair in fn.pairwise(map(Image.fromarray, frames))]
+
+
+def center_of_change_matches_reference_test():
+    frames = _random_frames(12)
+    expected = _reference_positions(frames)
+    for batch_size in (1, 4, 11, 32):
+        actual = list(ip.center_of_change_positions(frames, batch_size))
+        n.eq_(len(actual), len(expected))
+        np.testing.assert_allclose(actual, expected, rtol=1e-9)
+
+
+def center_of_change_no_change_test():
+    frames = _random_frames(1) * 3
+    positions = list(ip.center_of_change_positions(frames))
+    n.eq_(len(positions), 2)
+    assert np.all(np.isnan(positions))
+
+
+def center_of_change_reused_buffer_test():
+    frames = _random_frames(6)
+    buf = np.empty_like(frames[0])
+
+    def reuse_buffer():
+        for frame in frames:
+            buf[:] = frame
+            yield buf
+
+    np.testing.assert_allclose(
+        list(ip.center_of_change_positions(reuse_buffer(), batch_size=2)),
+        list(ip.center_of_change_positions(frames)))
+
+
+def bin_frame_test():
+    frame = np.arange(4 * 6 * 3).reshape((4, 6, 3)).astype(np.uint8)
+    binned = ip.bin_frame(frame, 2)
+    n.eq_(binned.shape, (2, 3, 3))
+    n.eq_(binned[1, 2, 0], frame[2:4, 4:6, 0].sum())
+    # The largest scale still holds a block of all 255s.
+    scale = ip.max_analysis_scale
+    white = np.full((scale, scale, 3), 255, dtype=np.uint8)
+    n.eq_(ip.bin_frame(white, scale)[0, 0, 0], 255 * scale * scale)
+
+
+def analysis_scale_range_test():
+    n.eq_(ip.parse_analysis_scale('16'), 16)
+    for scale in ('0', '17'):
+        n.assert_raises(ValueError, ip.parse_analysis_scale, scale)
+    n.assert_raises(ValueError, ip.analysis_settings, 17, None)
+
+
+def center_of_change_mask_test():
+    frames = [np.zeros((32, 64, 3), dtype=np.uint8) for _ in range(2)]
+    frames[1][4:8, 2:6] = 255
+    frames[1][20:24, 40:48] = 255
+    mask = ip.load_mask(64, 32, excluded_boxes=[(0, 0, 10, 32)])
+    for scale in (1, 2, 4):
+        [(x, y)] = ip.center_of_change_positions(
+            frames, analysis_scale=scale, mask=mask)
+        n.assert_almost_equal(x, 43.5)
+        n.assert_almost_equal(y, 21.5)
+
+
+def _blackboard_frames():
+    board = np.full((48, 64, 3), 30, dtype=np.uint8)
+    frames = [board.copy() for _ in range(6)]
+    frames[2][10:14, 20:24] = 255  # the cursor appears...
+    frames[3][10:14, 20:24] = 255  # ...and stays
+    frames[3][30:34, 40:44] = 255  # and something is drawn
+    frames[4][:] = 200  # a cut to a new scene
+    frames[5][:] = 200
+    return frames
+
+
+def classify_pairs_test():
+    thumbnails = np.stack([ip.bin_frame(frame, 8)
+                           for frame in _blackboard_frames()])
+    n.eq_(ip.classify_pairs(thumbnails, 64).tolist(),
+          [ip.label_static, ip.label_change, ip.label_change, ip.label_cut,
+           ip.label_static])
+
+
+def labeled_positions_test():
+    frames = _blackboard_frames()
+    expected = list(ip.center_of_change_positions(frames))
+    for batch_size in (1, 3, 8):
+        positions, labels = zip(*ip.labeled_positions(frames, batch_size))
+        n.eq_(list(labels), [ip.label_static, ip.label_change,
+                             ip.label_change, ip.label_cut, ip.label_static])
+        np.testing.assert_allclose(positions[1:3], expected[1:3])
+        assert np.all(np.isnan([positions[i] for i in (0, 3, 4)]))
+
+
+def labeled_positions_no_detection_test():
+    frames = _random_frames(5)
+    positions, labels = zip(*ip.labeled_positions(frames,
+                                                  scene_detection=False))
+    n.eq_(set(labels), {ip.label_change})
+    np.testing.assert_allclose(positions,
+                               list(ip.center_of_change_positions(frames)))
+
+
+def _moving_square_frames(count, jump_at=None):
+    board = np.full((48, 64, 3), 30, dtype=np.uint8)
+    frames = []
+    for i in range(count):
+        frame = board.copy()
+        x = 10 + i + (24 if jump_at is not None and i >= jump_at else 0)
+        # Faint enough that the windows without a jump aren't refined.
+        frame[20:24, x:x + 4] = 70
+        frames.append(frame)
+    return frames
+
+
+def adaptive_positions_interpolates_test():
+    frames = _moving_square_frames(13)
+    expected = list(ip.labeled_positions(frames))
+    for stride in (2, 4):
+        positions, labels = zip(*ip.labeled_positions(
+            frames, adaptive_stride=stride))
+        n.eq_(list(labels), [label for _, label in expected])
+        np.testing.assert_allclose(positions, [pos for pos, _ in expected],
+                                   atol=2)
+
+
+def adaptive_positions_refines_jump_test():
+    frames = _moving_square_frames(13, jump_at=6)
+    expected = [pos for pos, _ in ip.labeled_positions(frames)]
+    old_refine_distance = ip.refine_distance
+    ip.refine_distance = 8.0
+    try:
+        positions = [pos for pos, _ in ip.labeled_positions(
+            frames, adaptive_stride=4)]
+    finally:
+        ip.refine_distance = old_refine_distance
+    # The window with the jump is differenced pair by pair.
+    np.testing.assert_allclose(positions[4:8], expected[4:8])
+
+
+def adaptive_positions_cut_test():
+    frames = _blackboard_frames()
+    positions, labels = zip(*ip.labeled_positions(frames, adaptive_stride=3))
+    n.eq_(list(labels), [ip.label_static, ip.label_change, ip.label_change,
+                         ip.label_cut, ip.label_static])
+    np.testing.assert_allclose(
+        positions[1:3], list(ip.center_of_change_positions(frames))[1:3])
+    assert np.all(np.isnan([positions[i] for i in (0, 3, 4)]))
+
+
+def adaptive_boxes_match_full_rate_test():
+    frames = [frame.copy() for frame in benchmark.blackboard_frames(
+        const.frame_width, const.frame_height, 300)]
+    full = list(ip.center_of_change_positions(frames, analysis_scale=4))
+    adaptive = list(ip.center_of_change_positions(
+        frames, analysis_scale=4, adaptive_stride=3))
+    n.eq_(len(adaptive), len(full))
+    assert benchmark.box_agreement(full, adaptive, len(frames)) >= 0.98
+
+
+def _write_lecture(video_fn):
+    """Encode a short video that holds still, changes, and then cuts."""
+    width, height = 320, 180
+    proc = subprocess.Popen(generate_video.encode_command(video_fn, width,
+                                                          height),
+                            stdin=subprocess.PIPE)
+    try:
+        for i in range(45):
+            frame = np.full((height, width, 3), 30 if i < 30 else 180,
+                            dtype=np.uint8)
+            if 10 <= i < 30:
+                x = 40 + 4 * min(i, 20)
+                frame[60:80, x:x + 20] = 255
+            elif i >= 36:
+                frame[100:110, 4 * i - 100:4 * i - 90] = 0
+            proc.stdin.write(frame.tobytes())
+    finally:
+        proc.stdin.close()
+        proc.wait()
+
+
+@contextlib.contextmanager
+def _video(seconds, chunk_frames, write=None):
+    """A downloaded synthetic video, 'abc', analyzed chunk_frames at a time.
+
+    write, if given, writes the video.
+    """
+    old_chunk_frames = ip.chunk_frames
+    ip.chunk_frames = chunk_frames
+    try:
+        with benchmark.temporary_video('abc', seconds, write=write):
+            downloader.download('abc')
+            yield
+    finally:
+        ip.chunk_frames = old_chunk_frames
+
+
+def _path_data(**kwargs):
+    """Compute the path data of 'abc' afresh; return positions and labels."""
+    positions, _, _ = ip.main('abc', bust_cache=True, **kwargs)
+    _, labels = array_file.open_array(const.path_labels_fn('abc'), 'labels')
+    return np.array(positions), np.array(labels)
+
+
+def seed_checkpoint_test():
+    tmpdir = tempfile.mkdtemp()
+    old_store_dir = cache.store_dir
+    cache.store_dir = os.path.join(tmpdir, 'store')
+    try:
+        params = {'video': 'old', 'analysis_scale': 1}
+        entry = cache.open_entry('path', params, 'abc')
+        with open(os.path.join(entry, ip.checkpoint_basename), 'wb') as f:
+            f.write(b'positions')
+        checkpoint_fn = os.path.join(tmpdir, ip.checkpoint_basename)
+        # The same settings for a new version of the video.
+        ip.seed_checkpoint('abc', dict(params, video='new'), checkpoint_fn)
+        with open(checkpoint_fn, 'rb') as f:
+            n.eq_(f.read(), b'positions')
+        os.remove(checkpoint_fn)
+        ip.seed_checkpoint('abc', dict(params, video='new', analysis_scale=2),
+                           checkpoint_fn)
+        n.ok_(not os.path.exists(checkpoint_fn))
+        # The same settings, from an older version of the path stage.
+        meta = cache.read_meta(entry)
+        meta['version'] -= 1
+        cache._write_meta(entry, meta)
+        ip.seed_checkpoint('abc', dict(params, video='new'), checkpoint_fn)
+        n.ok_(not os.path.exists(checkpoint_fn))
+    finally:
+        cache.store_dir = old_store_dir
+        shutil.rmtree(tmpdir)
+
+
+def parallel_matches_serial_test():
+    # Chunks much shorter than the video, and not dividing it evenly.
+    with _video(3, 7):
+        positions, labels = _path_data()
+        n.eq_(len(positions), 3 * const.frame_rate - 1)
+        for workers in (2, 3):
+            parallel_positions, parallel_labels = _path_data(workers=workers)
+            np.testing.assert_array_equal(parallel_positions, positions)
+            np.testing.assert_array_equal(parallel_labels, labels)
+
+
+def parallel_overestimated_count_test():
+    # The frame count is estimated from the container duration, which can
+    # run past the last frame; chunks planned past the end come back empty.
+    with _video(3, 7):
+        positions, labels = _path_data()
+        count_frames = mvz_frames.count_frames
+        mvz_frames.count_frames = lambda youtube_id: (
+            count_frames(youtube_id) + 10)
+        try:
+            parallel_positions, parallel_labels = _path_data(workers=2)
+        finally:
+            mvz_frames.count_frames = count_frames
+        np.testing.assert_array_equal(parallel_positions, positions)
+        np.testing.assert_array_equal(parallel_labels, labels)
+
+
+def adaptive_chunks_match_test():
+    # Chunks that aren't a whole number of windows.
+    with _video(3, 7):
+        positions, labels = _path_data(adaptive_stride=3)
+        parallel_positions, parallel_labels = _path_data(adaptive_stride=3,
+                                                         workers=2)
+        np.testing.assert_array_equal(parallel_positions, positions)
+        np.testing.assert_array_equal(parallel_labels, labels)
+        # As resuming from a checkpoint does.
+        for start_frame in (7, 21):
+            resumed = [pos for chunk in ip.stream_chunks(
+                'abc', start_frame, adaptive_stride=3)
+                for pos in chunk.positions]
+            np.testing.assert_array_equal(resumed, positions[start_frame:])
+
+
+def adaptive_refine_energy_scale_test():
+    # Over the window, nearly every pixel changes by 3 in each band, for an
+    # energy of just under 27 per pixel at every analysis_scale.
+    frames = [np.full((48, 64, 3), value, dtype=np.uint8)
+              for value in (30, 31, 32, 33)]
+    frames[0][20:24, 20:24] = 31  # somewhere for the centers to be
+    old_refine_energy = ip.refine_energy
+    try:
+        for refine_energy, refined in ((24.0, True), (30.0, False)):
+            ip.refine_energy = refine_energy
+            for scale in (1, 2, 4):
+                [(_, _, center)] = ip.adaptive_windows(
+                    frames, 3, scale, scene_detection=False)
+                n.eq_(center is None, refined)
+    finally:
+        ip.refine_energy = old_refine_energy
+
+
+def scene_detection_setting_test():
+    with _video(None, 10, _write_lecture):
+        with_detection = _path_data()
+        without_detection = _path_data(scene_detection=False)
+        labels = with_detection[1][:, 0]
+        n.ok_(ip.label_static in labels)
+        n.eq_(labels.tolist().count(ip.label_cut), 1)
+        n.eq_(set(without_detection[1][:, 0].tolist()), {ip.label_change})
+        # Without it, every pair's position is found, as it always was.
+        np.testing.assert_array_equal(
+            without_detection[0],
+            list(ip.center_of_change_positions(mvz_frames.get_frames('abc'))))
+        changed = labels == ip.label_change
+        np.testing.assert_array_equal(with_detection[0][changed],
+                                      without_detection[0][changed])
+        assert np.all(np.isnan(with_detection[0][~changed]))
+
+        # Each setting's path data is cached on its own.
+        n.assert_not_equal(ip.path_params('abc', 1, None),
+                           ip.path_params('abc', 1, None,
+                                          scene_detection=False))
+        for kwargs, (positions, _) in [({}, with_detection),
+                                       ({'scene_detection': False},
+                                        without_detection)]:
+            cached, _, _ = ip.main('abc', **kwargs)
+            np.testing.assert_array_equal(cached, positions)
@@ -0,0 +1,66 @@
+import os.path
+import shutil
+import tempfile
+
+import nose.tools as n
+
+from mvz import instrument
+
+
+def no_recorder_test():
+    with instrument.stage('nothing'):
+        instrument.count('frames', 10)
+        instrument.progress(1, 2)
+
+
+def recording_test():
+    progress = []
+    recorder = instrument.Recorder(
+        progress=lambda *args: progress.append(args))
+    old_interval = instrument.progress_interval
+    instrument.progress_interval = 0
+    try:
+        with instrument.recording(recorder):
+            with instrument.stage('outer'):
+                with instrument.stage('inner'):
+                    instrument.count('frames', 3)
+                    instrument.count('frames', 2)
+                    instrument.progress(5, 10)
+                instrument.count('bytes_written', 100)
+    finally:
+        instrument.progress_interval = old_interval
+
+    inner, outer = recorder.stages
+    n.eq_((inner['stage'], inner['parent']), ('inner', 'outer'))
+    n.eq_((outer['stage'], outer['parent']), ('outer', None))
+    n.eq_(inner['counts'], {'frames': 5})
+    n.eq_(outer['counts'], {'bytes_written': 100})
+    assert inner['frames_per_second'] > 0
+    assert outer['seconds'] >= inner['seconds']
+    assert outer['peak_rss_bytes'] > 0
+    n.eq_(progress, [('inner', 5, 10)])
+    n.eq_(recorder.to_json()['seconds'], outer['seconds'])
+
+    # Nothing is recorded once the block ends.
+    with instrument.stage('after'):
+        pass
+    n.eq_(len(recorder.stages), 2)
+
+
+def profile_test():
+    dirname = tempfile.mkdtemp()
+    try:
+        recorder = instrument.Recorder(
+            profile_stages=['profiled'],
+            profile_fn_template=os.path.join(dirname, '%s.prof'))
+        with instrument.recording(recorder):
+            with instrument.stage('profiled'):
+                sum(range(1000))
+            with instrument.stage('not_profiled'):
+                pass
+        n.eq_(recorder.stages[0]['profile'],
+              os.path.join(dirname, 'profiled.prof'))
+        assert os.path.exists(recorder.stages[0]['profile'])
+        assert 'profile' not in recorder.stages[1]
+    finally:
+        shutil.rmtree(dirname)
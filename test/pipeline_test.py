@@ -0,0 +1,121 @@
+import contextlib
+import os
+import re
+import subprocess
+import sys
+
+import funcy as fn
+import nose.tools as n
+import numpy as np
+
+from mvz import array_file
+from mvz import benchmark
+from mvz import const
+from mvz import frames
+from mvz import image_processing
+from mvz import methods
+from mvz import pipeline
+from mvz.methods import bandpass_and_snapping
+from mvz.methods import shared
+
+
+def startup_imports_test():
+    # Writing out cached boxes shouldn't need the heavy dependencies.
+    script = ('import sys, mvz.pipeline; '
+              'mvz.pipeline.method_module("bandpass_and_snapping"); '
+              'print(" ".join(sorted(sys.modules)))')
+    modules = set(subprocess.check_output(
+        [sys.executable, '-c', script]).decode().split())
+    for heavy in ('scipy', 'pandas', 'PIL', 'requests', 'matplotlib'):
+        assert heavy not in modules, heavy
+
+
+def method_registry_test():
+    n.eq_(methods.names(), ['bandpass_and_snapping', 'ewma'])
+    n.eq_(pipeline.method_module('bandpass_and_snapping').__name__,
+          'mvz.methods.bandpass_and_snapping')
+    n.assert_raises(ValueError, methods.get, 'shared')
+
+
+def parse_box_size_test():
+    n.eq_(pipeline.parse_box_size('640x360'), (640, 360))
+    n.eq_(pipeline.parse_box_size('16:9'), (712, 400))
+    n.eq_(pipeline.parse_box_size('1:1'), const.box_size)
+    n.assert_raises(ValueError, pipeline.parse_box_size, '401x400')
+    n.assert_raises(ValueError, pipeline.parse_box_size, '2000x400')
+    for ratio in ('0:9', '16:0', '-16:9'):
+        n.assert_raises(ValueError, pipeline.parse_box_size, ratio)
+
+
+@contextlib.contextmanager
+def _counting_decodes():
+    """Count the times the video is decoded, in a list of one count."""
+    decodes = [0]
+    decode_command = frames.decode_command
+
+    def counting_decode_command(*args, **kwargs):
+        decodes[0] += 1
+        return decode_command(*args, **kwargs)
+
+    frames.decode_command = counting_decode_command
+    try:
+        yield decodes
+    finally:
+        frames.decode_command = decode_command
+
+
+def run_all_frames_test():
+    with benchmark.temporary_video('abc', 2) as frame_count:
+        with _counting_decodes() as decodes:
+            boxes, video_width, video_height = pipeline.run(
+                'abc', all_frames=True)
+        n.eq_(decodes[0], 2)
+        n.eq_((video_width, video_height),
+              (const.frame_width, const.frame_height))
+
+        # The same as running the analysis and the method by hand.
+        positions, labels = zip(*image_processing.labeled_positions(
+            frames.get_frames('abc')))
+        _, path = array_file.open_array(const.path_array_fn('abc'), 'path')
+        np.testing.assert_array_equal(path, positions)
+        cuts = [i + 1 for i, label in enumerate(labels)
+                if label == image_processing.label_cut and i + 1 < len(labels)]
+        n.eq_(shared.read_cuts(const.path_labels_fn('abc')), cuts)
+        n.eq_(len(boxes), frame_count)
+        n.eq_(boxes, bandpass_and_snapping.boxes_for_path_array(
+            np.array(positions), frame_count, video_width, video_height,
+            cuts=cuts)[0])
+
+        video_fn = const.output_video_fn('abc', 'bandpass_and_snapping',
+                                         'auto')
+        probe = subprocess.run(['ffmpeg', '-i', video_fn],
+                               stderr=subprocess.PIPE).stderr.decode()
+        n.eq_(re.search(r'Video: .*?, (\d+)x(\d+)[ ,]', probe).groups(),
+              ('%d' % const.box_width, '%d' % const.box_height))
+        n.eq_(fn.ilen(frames.read_video_frames(
+            video_fn, const.box_width, const.box_height)), frame_count)
+
+
+def run_sizes_write_frames_test():
+    with benchmark.temporary_video('abc', 2) as frame_count:
+        sizes = [const.box_size, (200, 300), (640, 360)]
+        with _counting_decodes() as decodes:
+            all_boxes, _, _ = pipeline.run_sizes('abc', sizes,
+                                                 all_frames=True,
+                                                 frame_format='raw')
+        # Once to find the center of change, and once for every size's
+        # video and frames.
+        n.eq_(decodes[0], 2)
+        cuts = shared.read_cuts(const.path_labels_fn('abc'))
+        for (width, height), boxes in zip(sizes, all_boxes):
+            n.ok_(os.path.exists(const.output_video_fn(
+                'abc', 'bandpass_and_snapping', 'auto', (width, height))))
+            template = const.output_frame_template('abc', 'rgb',
+                                                   (width, height))
+            rendered = bandpass_and_snapping.render_boxes(boxes, cuts)
+            for i, frame in enumerate(frames.get_frames('abc', frame_count)):
+                written = np.fromfile(template % (i + 1), dtype=np.uint8)
+                np.testing.assert_array_equal(
+                    written.reshape((height, width, 3)),
+                    shared.crop_frame(frame, rendered[i]))
+            n.ok_(not os.path.exists(template % (frame_count + 1)))
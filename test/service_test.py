@@ -0,0 +1,112 @@
+import shutil
+import tempfile
+import threading
+
+import nose.tools as n
+import numpy as np
+
+from mvz import array_file
+from mvz import const
+from mvz import service
+from mvz.methods import bandpass_and_snapping
+from mvz.methods import ewma
+
+
+def lru_cache_test():
+    cache = service.LRUCache(2)
+    n.eq_(cache.get('a', lambda: 1), 1)
+    n.eq_(cache.get('b', lambda: 2), 2)
+    n.eq_(cache.get('a', lambda: None), 1)
+    # b is now the least recently used, so makes way for c.
+    n.eq_(cache.get('c', lambda: 3), 3)
+    n.eq_(cache.get('b', lambda: 4), 4)
+    n.eq_(cache.get('a', lambda: 5), 5)
+    n.eq_(len(cache), 2)
+    n.eq_(cache.stats(), {'entries': 2, 'hits': 1, 'misses': 5})
+
+
+def _write_path(youtube_id, count, seed):
+    rng = np.random.RandomState(seed)
+    positions = np.repeat(rng.uniform(200, 600, (count // 50 + 1, 2)), 50,
+                          axis=0)[:count]
+    positions[rng.rand(count) < 0.3] = float('NaN')
+    array_file.write(const.path_array_fn(youtube_id), 'path', positions,
+                     const.frame_width, const.frame_height, count + 1)
+    return positions
+
+
+def service_test():
+    tmpdir = tempfile.mkdtemp()
+    old_cache_dir = const.cache_dir
+    const.cache_dir = tmpdir
+    server = service.make_server(service.Service(), port=0, quiet=True)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    try:
+        url = 'http://127.0.0.1:%d' % server.server_address[1]
+        positions = _write_path('abc', 600, 0)
+
+        result = service.fetch_boxes(url, 'abc')
+        n.eq_(result['frame_count'], 601)
+        n.eq_(result['settings']['padding'], bandpass_and_snapping.padding)
+        expected = bandpass_and_snapping.boxes_for_path_array(
+            positions, 601, const.frame_width, const.frame_height,
+            keyframes_only=True)[0]
+        n.eq_(result['boxes'], [list(box) for box in expected])
+        n.eq_(service.fetch_boxes(url, 'abc'), result)
+
+        result = service.fetch_boxes(url, 'abc', 'ewma', (200, 300),
+                                     all_frames=True,
+                                     settings={'smoothing_span': 5})
+        with ewma.settings(smoothing_span=5):
+            expected = ewma.boxes_for_path_array(
+                positions, 601, const.frame_width, const.frame_height,
+                box_sizes=[(200, 300)])[0]
+        n.eq_(result['boxes'], [list(box) for box in expected])
+        n.eq_(ewma.smoothing_span, 2 * const.frame_rate)
+
+        status = service.fetch_status(url)
+        n.eq_(status['paths'], {'entries': 1, 'hits': 2, 'misses': 1})
+        n.eq_(status['boxes'], {'entries': 2, 'hits': 1, 'misses': 2})
+
+        # Recomputed path data replaces what the service has cached.
+        _write_path('abc', 300, 1)
+        n.eq_(service.fetch_boxes(url, 'abc')['frame_count'], 301)
+
+        for kwargs, status_code in [
+                ({'youtube_id': 'nope'}, 404),
+                ({'youtube_id': 'abc', 'method_name': 'nope'}, 400),
+                ({'youtube_id': 'abc', 'settings': {'padding': 'wide'}}, 400),
+                ({'youtube_id': 'abc', 'settings': {'box_width': 3}}, 400),
+                ({'youtube_id': 'abc', 'box_size': (401, 400)}, 400),
+                ({'youtube_id': 'abc', 'settings': {'freq_cutoff': 1.5}},
+                 400),
+                ({'youtube_id': 'abc', 'settings': {'freq_cutoff': 0}}, 400),
+                ({'youtube_id': 'abc',
+                  'settings': {'anticipation_time': 0}}, 400),
+                ({'youtube_id': 'abc', 'settings': {'padding': -1}}, 400),
+                ({'youtube_id': 'abc',
+                  'settings': {'initial_offset': -20}}, 400),
+                ({'youtube_id': 'abc', 'method_name': 'ewma',
+                  'settings': {'smoothing_span': 0}}, 400),
+                # Passes the checks, but starts past the end of the video.
+                ({'youtube_id': 'abc',
+                  'settings': {'initial_offset': 1000}}, 500)]:
+            with n.assert_raises(service.RequestError) as context:
+                service.fetch_boxes(url, **kwargs)
+            n.eq_(context.exception.status, status_code)
+            assert str(context.exception)
+        # The service still answers after a failure.
+        n.eq_(service.fetch_boxes(url, 'abc')['frame_count'], 301)
+
+        # Settings a request leaves out take the defaults from startup, not
+        # whatever a method is running with at the time.
+        with bandpass_and_snapping.settings(padding=5):
+            result = service.fetch_boxes(url, 'abc', box_size=(500, 400))
+        n.eq_(result['settings']['padding'], bandpass_and_snapping.padding)
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
+        const.cache_dir = old_cache_dir
+        shutil.rmtree(tmpdir)
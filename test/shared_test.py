@@ -0,0 +1,84 @@
+import concurrent.futures
+import os
+import shutil
+import tempfile
+
+import nose.tools as n
+import numpy as np
+from PIL import Image
+
+from mvz import benchmark
+from mvz import const
+from mvz import frames
+from mvz.methods import shared
+
+
+def bounded_map_test():
+    taken = []
+    results = []
+
+    def items():
+        for i in range(100):
+            # Never more than the limit ahead of what's been yielded.
+            n.ok_(len(taken) - len(results) <= 4)
+            taken.append(i)
+            yield i
+
+    with concurrent.futures.ThreadPoolExecutor(3) as executor:
+        for result in shared.bounded_map(executor, lambda x: x * x, items(),
+                                         4):
+            results.append(result)
+    n.eq_(results, [i * i for i in range(100)])
+
+
+@n.raises(ZeroDivisionError)
+def bounded_map_raises_test():
+    with concurrent.futures.ThreadPoolExecutor(2) as executor:
+        list(shared.bounded_map(executor, lambda x: 1 // x, [2, 1, 0, 3], 2))
+
+
+def crop_to_bounding_boxes_test():
+    width, height = const.frame_width, const.frame_height
+    tmpdir = tempfile.mkdtemp()
+    old_dirs = (const.cache_dir, const.output_dir)
+    const.cache_dir = os.path.join(tmpdir, 'cache')
+    const.output_dir = os.path.join(tmpdir, 'output')
+    try:
+        os.makedirs(const.cache_dir)
+        os.makedirs(const.output_dir)
+        frame_count = benchmark.write_video(const.video_fn('abc'), width,
+                                            height, 1)
+        rng = np.random.RandomState(0)
+        lefts = rng.randint(0, width - 40, frame_count)
+        tops = rng.randint(0, height - 30, frame_count)
+        boxes = [(left, top, left + 40, top + 30)
+                 for left, top in zip(lefts.tolist(), tops.tolist())]
+        expected = [
+            np.asarray(Image.fromarray(frame).crop(box))
+            for frame, box in zip(frames.read_video_frames(
+                const.video_fn('abc'), width, height), boxes)]
+
+        def read_frame(fn):
+            return np.asarray(Image.open(fn).convert('RGB'))
+
+        for frame_format, read, exact in [
+                ('png', read_frame, True),
+                ('png-fast', read_frame, True),
+                ('jpeg', read_frame, False),
+                ('raw', lambda fn: np.fromfile(fn, dtype=np.uint8).reshape(
+                    (30, 40, 3)), True)]:
+            n.eq_(shared.crop_to_bounding_boxes(
+                'abc', frame_count, boxes, frame_format, (40, 30),
+                encode_threads=3, queue_frames=2), frame_count)
+            template = const.output_frame_template(
+                'abc', shared.frame_formats[frame_format][0], (40, 30))
+            for i, cropped in enumerate(expected):
+                written = read(template % (i + 1))
+                if exact:
+                    np.testing.assert_array_equal(written, cropped)
+                else:
+                    n.ok_(np.abs(written.astype(int) - cropped).mean() < 8)
+            n.ok_(not os.path.exists(template % (frame_count + 1)))
+    finally:
+        const.cache_dir, const.output_dir = old_dirs
+        shutil.rmtree(tmpdir)
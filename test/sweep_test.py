@@ -0,0 +1,116 @@
+import shutil
+import tempfile
+
+import numpy as np
+import nose.tools as n
+import pandas as pd
+
+from mvz import array_file
+from mvz import const
+from mvz import image_processing
+from mvz import sweep
+from mvz.methods import bandpass_and_snapping
+from mvz.methods import shared
+
+
+def _random_positions(count, seed):
+    rng = np.random.RandomState(seed)
+    steps = np.repeat(rng.uniform(100, 700, (count // 100 + 1, 2)), 100,
+                      axis=0)[:count]
+    positions = steps + rng.randn(count, 2) * 10
+    positions[rng.rand(count) < 0.3] = float('NaN')
+    return positions
+
+
+def grid_test():
+    settings = sweep.grid({'padding': [60, 80], 'freq_cutoff': [0.05, 0.1]})
+    n.eq_(len(settings), 4)
+    n.eq_(set((s['padding'], s['freq_cutoff']) for s in settings),
+          {(60, 0.05), (60, 0.1), (80, 0.05), (80, 0.1)})
+    for setting in settings:
+        n.eq_(setting['anticipation_time'],
+              bandpass_and_snapping.anticipation_time)
+
+
+def parse_values_test():
+    n.eq_(sweep.parse_values('60,80'), [60, 80])
+    n.eq_(sweep.parse_values('0.03,0.05'), [0.03, 0.05])
+    assert isinstance(sweep.parse_values('1.0')[0], float)
+
+
+def settings_test():
+    padding = bandpass_and_snapping.padding
+    with bandpass_and_snapping.settings(padding=padding + 1):
+        n.eq_(bandpass_and_snapping.padding, padding + 1)
+    n.eq_(bandpass_and_snapping.padding, padding)
+    with n.assert_raises(ValueError):
+        with bandpass_and_snapping.settings(box_size=1):
+            pass
+
+
+def boxes_for_setting_matches_method_test():
+    raw = _random_positions(3000, 0)
+    cuts = [1000, 2200]
+    data = shared.clean_path_data(pd.DataFrame(raw.copy(),
+                                               columns=['x', 'y']), cuts)
+    cleaned = np.asarray(data, dtype=float)
+    for setting in sweep.grid({'padding': [40, 120],
+                               'anticipation_time': [10, 30],
+                               'freq_cutoff': [0.05, 0.1]}):
+        with bandpass_and_snapping.settings(**setting):
+            expected = bandpass_and_snapping.boxes_for_path_data(
+                data, 3001, 1280, 720, cuts=cuts, box_size=(300, 200))
+            expected_panned = bandpass_and_snapping.render_boxes(expected,
+                                                                 cuts)
+            filtered = bandpass_and_snapping.filter_positions(cleaned, cuts)
+        boxes, panned = sweep.boxes_for_setting(
+            filtered, 3001, 1280, 720, cuts, (300, 200), setting)
+        np.testing.assert_array_equal(boxes, expected)
+        np.testing.assert_array_equal(panned, expected_panned)
+
+
+def score_test():
+    raw = np.array([[150.0, 150.0], [float('NaN')] * 2, [50.0, 50.0],
+                    [350.0, 150.0]])
+    boxes = np.array([[100, 100, 300, 300]] * 2 + [[200, 100, 400, 300]] * 3)
+    scores = sweep.score(raw, boxes, boxes)
+    n.eq_(scores['shots'], 2)
+    n.eq_(scores['mean_shot_seconds'], 5.0 / const.frame_rate / 2)
+    # The third position is dropped as an outlier, as the method does.
+    n.eq_(scores['change_inside'], 1.0)
+    n.eq_(scores['motion_per_second'], 100 / (5.0 / const.frame_rate))
+
+
+def sweep_test():
+    tmpdir = tempfile.mkdtemp()
+    old_cache_dir = const.cache_dir
+    const.cache_dir = tmpdir
+    try:
+        raw = _random_positions(2000, 1)
+        labels = np.full(len(raw), image_processing.label_change)
+        labels[800] = image_processing.label_cut
+        array_file.write_path(const.path_array_fn('abc'), raw,
+                              const.frame_width, const.frame_height)
+        array_file.write_labels(const.path_labels_fn('abc'), labels,
+                                const.frame_width, const.frame_height)
+        settings = sweep.grid({'padding': [40, 120],
+                               'freq_cutoff': [0.05, 0.1]})
+        results = sweep.sweep('abc', settings, (300, 200))
+        n.eq_([{name: result[name] for name in setting}
+               for result, setting in zip(results, settings)], settings)
+        # The workers are sent the path data once, as they start.
+        n.eq_(sweep.sweep('abc', settings, (300, 200), workers=2), results)
+        n.eq_(sweep._data, None)
+
+        _, cleaned, cuts = sweep.load_path('abc')
+        n.eq_(cuts, [801])
+        with bandpass_and_snapping.settings(**settings[-1]):
+            filtered = bandpass_and_snapping.filter_positions(cleaned, cuts)
+        boxes, panned = sweep.boxes_for_setting(
+            filtered, 2001, const.frame_width, const.frame_height, cuts,
+            (300, 200), settings[-1])
+        n.eq_(results[-1], dict(settings[-1],
+                                **sweep.score(raw, boxes, panned)))
+    finally:
+        const.cache_dir = old_cache_dir
+        shutil.rmtree(tmpdir)
@@ -0,0 +1,78 @@
+import nose.tools as n
+import numpy as np
+
+from mvz import const
+from mvz import image_processing as ip
+from mvz import tracker
+from mvz.methods import bandpass_and_snapping as bas
+from mvz.methods import shared
+
+from .bandpass_and_snapping_test import _random_path
+
+
+def _track_positions(positions, **kwargs):
+    t = tracker.StreamingTracker(1280, 720, **kwargs)
+    boxes = []
+    for x, y in positions:
+        boxes.extend(t.push_position(x, y))
+    boxes.extend(t.flush())
+    n.eq_([i for i, _ in boxes], list(range(len(positions) + 1)))
+    return [box for _, box in boxes]
+
+
+def full_lookahead_matches_offline_test():
+    # (Seed 0 starts with a missing position.  Offline, clean_path_data fills
+    # it from the first position after it, which the tracker hasn't seen
+    # yet, so it uses the center of the frame.)
+    for seed in range(1, 4):
+        raw = _random_path(2000, seed, nan_fraction=0.05)
+        data = shared.clean_path_data(raw.copy())
+        expected = bas.render_boxes(
+            bas.boxes_for_path_data(data, 2001, 1280, 720))
+        n.eq_(_track_positions(list(raw.itertuples(index=False)),
+                               lookahead=2001), expected)
+
+
+def far_below_zero_matches_offline_test():
+    # A spike far enough below zero that, once filtered, points are too far
+    # out for any window, and each gets a window of its own.
+    raw = _random_path(600, 1)
+    raw.loc[300:302, 'y'] = -20000.0
+    data = shared.clean_path_data(raw.copy())
+    _, y_filt = bas.bandpass_filter_data(data)
+    n.ok_(np.nanmin(y_filt) <= -(const.box_height - bas.padding))
+    expected = bas.render_boxes(bas.boxes_for_path_data(data, 601, 1280, 720))
+    n.eq_(_track_positions(list(raw.itertuples(index=False)),
+                           lookahead=601), expected)
+
+
+def bounded_lookahead_test():
+    positions = list(_random_path(500, 1).itertuples(index=False))
+    for lookahead in (bas.anticipation_time, 45, 100):
+        t = tracker.StreamingTracker(1280, 720, lookahead=lookahead)
+        for i, (x, y) in enumerate(positions):
+            for frame, box in t.push_position(x, y):
+                # Frame i + 1 has just arrived.
+                assert frame <= i + 1 - lookahead
+                n.eq_(box[2] - box[0], 400)
+        # Nothing is held back any longer than it has to be.
+        n.eq_(len(t.flush()), lookahead + 1)
+    with n.assert_raises(ValueError):
+        tracker.StreamingTracker(lookahead=bas.anticipation_time - 1)
+
+
+def push_frame_matches_offline_positions_test():
+    rng = np.random.RandomState(0)
+    frames = [rng.randint(0, 256, (48, 64, 3)).astype(np.uint8)
+              for _ in range(10)]
+    from_frames = tracker.StreamingTracker(64 * 20, 48 * 15, lookahead=40)
+    from_positions = tracker.StreamingTracker(64 * 20, 48 * 15, lookahead=40)
+    boxes = []
+    for frame in frames:
+        boxes.extend(from_frames.push_frame(frame))
+    boxes.extend(from_frames.flush())
+    expected = []
+    for x, y in ip.center_of_change_positions(frames):
+        expected.extend(from_positions.push_position(x, y))
+    expected.extend(from_positions.flush())
+    n.eq_(boxes, expected)